@@ -0,0 +1,95 @@
+"""
+Benchmark of the parallel writer of blinded raw files against the serial one, on a
+synthetic raw file.
+
+Run from the repository root with:
+
+    python -m benchmarks.blind_writer
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import lgdo
+import lgdo.lh5 as lh5
+import numpy as np
+from scripts.util.blinding import copy_channels
+
+log = logging.getLogger(__name__)
+
+hdf_settings = {"compression": "gzip", "shuffle": True}
+
+
+def make_raw_file(raw_file, n_channels, n_rows, wf_len=1000, seed=0):
+    """
+    Writes a synthetic raw file of `n_channels` channels with `n_rows` rows of
+    daqenergy, timestamp and noisy waveforms of `wf_len` samples.
+    """
+    rng = np.random.default_rng(seed)
+    store = lh5.LH5Store()
+    channels = [f"ch{1104000 + i}" for i in range(n_channels)]
+    for channel in channels:
+        values = (rng.normal(15000, 20, (n_rows, wf_len))).astype(np.uint16)
+        table = lgdo.Table(
+            col_dict={
+                "daqenergy": lgdo.Array(rng.integers(0, 2**16, n_rows).astype(np.uint16)),
+                "timestamp": lgdo.Array(np.sort(rng.uniform(0, 3600, n_rows))),
+                "waveform": lgdo.WaveformTable(t0=np.zeros(n_rows), dt=16.0, values=values),
+            }
+        )
+        store.write_object(table, "raw", raw_file, group=channel, wo_mode="w", **hdf_settings)
+    return channels
+
+
+def time_copy(raw_file, out_file, channels, keep, n_processes):
+    start = time.perf_counter()
+    copy_channels(raw_file, out_file, channels, keep, hdf_settings, n_processes=n_processes)
+    return time.perf_counter() - start
+
+
+def same_channels(file1, file2, channels):
+    store = lh5.LH5Store()
+    for channel in channels:
+        tb1, _ = store.read(f"{channel}/raw", file1)
+        tb2, _ = store.read(f"{channel}/raw", file2)
+        for field in ("daqenergy", "timestamp"):
+            if not np.array_equal(tb1[field].nda, tb2[field].nda):
+                return False
+        if not np.array_equal(tb1["waveform"]["values"].nda, tb2["waveform"]["values"].nda):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--n_channels", help="number of channels", type=int, default=32)
+    argparser.add_argument("--n_rows", help="rows per channel", type=int, default=5000)
+    argparser.add_argument(
+        "--n_processes", help="numbers of processes", nargs="*", type=int, default=[2, 4, 8]
+    )
+    argparser.add_argument("--blind_fraction", help="fraction of rows", type=float, default=0.01)
+    argparser.add_argument("--seed", help="random seed", type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_file = os.path.join(tmp_dir, "raw.lh5")
+        channels = make_raw_file(raw_file, args.n_channels, args.n_rows, seed=args.seed)
+        rng = np.random.default_rng(args.seed)
+        keep = np.flatnonzero(rng.random(args.n_rows) >= args.blind_fraction)
+
+        serial_file = os.path.join(tmp_dir, "serial.lh5")
+        t_serial = time_copy(raw_file, serial_file, channels, keep, 1)
+        log.info(f"{'n_processes':>12} {'time [s]':>9} {'speed-up':>9}")
+        log.info(f"{1:>12} {t_serial:>9.3f} {1:>9.2f}")
+        for n_processes in args.n_processes:
+            out_file = os.path.join(tmp_dir, f"parallel{n_processes}.lh5")
+            t_parallel = time_copy(raw_file, out_file, channels, keep, n_processes)
+            if not same_channels(serial_file, out_file, channels):
+                msg = f"outputs differ with {n_processes} processes"
+                raise RuntimeError(msg)
+            log.info(f"{n_processes:>12} {t_parallel:>9.3f} {t_serial / t_parallel:>9.2f}")
@@ -0,0 +1,52 @@
+"""
+Benchmark of the validity catalog generation against the list based implementation it
+replaced (kept in ``tests/par_keylist_reference.py``).
+
+Run from the repository root with:
+
+    python -m benchmarks.par_keylist
+"""
+
+import argparse
+import logging
+import time
+
+from scripts.util.create_pars_keylist import pars_key_resolve
+from tests.par_keylist_reference import (
+    list_generate_par_keylist,
+    list_match_all_entries,
+    make_keys,
+    to_jsonl,
+)
+
+log = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "--n_keys", help="numbers of keys", nargs="*", type=int, default=[10**3, 10**4, 5 * 10**4]
+    )
+    argparser.add_argument("--n_runs", help="number of runs", type=int, default=500)
+    argparser.add_argument("--seed", help="random seed", type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    name_dict = {"cal": ["par_dsp"], "lar": ["par_dsp"]}
+    log.info(f"{'n_keys':>8} {'n_entries':>10} {'list [s]':>9} {'sorted [s]':>11}")
+    for n_keys in args.n_keys:
+        keys = make_keys(n_keys, args.n_runs, seed=args.seed)
+
+        start = time.perf_counter()
+        expected = to_jsonl(list_match_all_entries(list_generate_par_keylist(keys), name_dict))
+        t_list = time.perf_counter() - start
+
+        start = time.perf_counter()
+        keylist = pars_key_resolve.generate_par_keylist(keys)
+        result = to_jsonl(pars_key_resolve.match_all_entries(keylist, name_dict))
+        t_sorted = time.perf_counter() - start
+        if result != expected:
+            msg = f"catalogs differ for {n_keys} keys"
+            raise RuntimeError(msg)
+        log.info(f"{n_keys:>8} {len(keylist):>10} {t_list:>9.4f} {t_sorted:>11.4f}")
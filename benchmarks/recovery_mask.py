@@ -0,0 +1,61 @@
+"""
+Benchmark of the discharge recovery mask against the per-discharge loop it replaced.
+
+Run from the repository root with:
+
+    python -m benchmarks.recovery_mask
+"""
+
+import argparse
+import logging
+import time
+
+import numpy as np
+from scripts.util.discharges import get_recovery_mask
+
+log = logging.getLogger(__name__)
+
+
+def loop_recovery_mask(timestamps, discharges, window=0.01):
+    is_recovering = np.full(len(timestamps), False, dtype=bool)
+    for tstamp in timestamps[discharges]:
+        is_recovering = is_recovering | np.where(
+            (((timestamps - tstamp) < window) & ((timestamps - tstamp) > 0)),
+            True,
+            False,
+        )
+    return is_recovering
+
+
+def time_call(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument(
+        "--n_events", help="numbers of events", nargs="*", type=int, default=[10**4, 10**5, 10**6]
+    )
+    argparser.add_argument("--discharge_rate", help="discharge fraction", type=float, default=1e-3)
+    argparser.add_argument("--window", help="recovery window in s", type=float, default=0.01)
+    argparser.add_argument("--seed", help="random seed", type=int, default=0)
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    rng = np.random.default_rng(args.seed)
+    log.info(f"{'n_events':>10} {'n_discharges':>13} {'loop [s]':>10} {'sorted [s]':>11}")
+    for n_events in args.n_events:
+        # two concatenated files to check unsorted input
+        timestamps = np.sort(rng.uniform(0, n_events / 1000, n_events))
+        timestamps = np.roll(timestamps, n_events // 2)
+        discharges = rng.random(n_events) < args.discharge_rate
+
+        expected, t_loop = time_call(loop_recovery_mask, timestamps, discharges, args.window)
+        result, t_sorted = time_call(get_recovery_mask, timestamps, discharges, args.window)
+        if not np.array_equal(result, expected):
+            msg = f"recovery masks differ for {n_events} events"
+            raise RuntimeError(msg)
+        log.info(f"{n_events:>10} {discharges.sum():>13} {t_loop:>10.4f} {t_sorted:>11.4f}")
@@ -10,16 +10,26 @@ from scripts.util.patterns import (
     get_pattern_tier_daq,
     get_pattern_tier_raw,
     get_pattern_plts_tmp_channel,
+    get_pattern_channel_shards,
+    get_pattern_pars_tmp_batch,
 )
-from scripts.util import ProcessingFileKey
+from scripts.util.utils import channel_batch_size, use_channel_shards
+from scripts.util import ChannelProcKey, ProcessingFileKey
+from scripts.util.pars_loading import pars_catalog
 
 
 def read_filelist(wildcards):
-    with checkpoints.gen_filelist.get(
+    filelist = checkpoints.gen_filelist.get(
         label=wildcards.label, tier=wildcards.tier, extension="file"
-    ).output[0].open() as f:
+    ).output[0]
+    with filelist.open() as f:
         files = f.read().splitlines()
-        return files
+    # resolve the par inputs of the whole filelist at once so that the
+    # per job input functions are just lookups
+    pars_catalog.precompute_par_files(
+        setup, files, key=(os.path.abspath(filelist), os.stat(filelist).st_mtime_ns)
+    )
+    return files
 
 
 def read_filelist_phy(wildcards, tier):
@@ -49,6 +59,44 @@ def read_filelist_fft(wildcards, tier):
         return files
 
 
+def read_filelist_run(wildcards, tier):
+    label = f"all-{wildcards.experiment}-{wildcards.period}-{wildcards.run}-{wildcards.datatype}"
+    with checkpoints.gen_filelist.get(label=label, tier=tier, extension="file").output[
+        0
+    ].open() as f:
+        files = f.read().splitlines()
+        return files
+
+
+def get_run_input(tier, datatype="cal", filelist=True):
+    """
+    Input of the per channel par rules: the directory of the channel shards of the
+    run if channel_shards is set in the options, otherwise the run filelist or,
+    if not filelist, the files of the run
+    """
+    if use_channel_shards(setup):
+        return get_pattern_channel_shards(setup, tier, datatype)
+    elif filelist:
+        return os.path.join(
+            filelist_path(setup),
+            "all-{experiment}-{period}-{run}-" + f"{datatype}-{tier}.filelist",
+        )
+    elif datatype == "fft":
+        return lambda wildcards: read_filelist_fft(wildcards, tier)
+    else:
+        return lambda wildcards: read_filelist_cal(wildcards, tier)
+
+
+def get_channel_input(files, channel, extension="filelist"):
+    """
+    Passes the channel's shard (or its filelist) inside the shard directory
+    from get_run_input to the scripts, the input unchanged without shards
+    """
+    if use_channel_shards(setup):
+        return os.path.join(files, f"{channel}.{extension}")
+    return files
+
+
 def read_filelist_pars_cal_channel(wildcards, tier):
     """
     This function will read the filelist of the channels and return a list of dsp files one for each channel
@@ -61,6 +109,49 @@ def read_filelist_pars_cal_channel(wildcards, tier):
         return files
 
 
+def get_channel_list(tier):
+    """The filelist with a par file per channel of the run (read_filelist_pars_cal_channel)"""
+    return os.path.join(
+        filelist_path(setup),
+        "all-{experiment}-{period}-{run}-cal-{timestamp}-channels-" + f"par_{tier}.chanlist",
+    )
+
+
+def get_channel_batch(tier):
+    """
+    Input function returning the batch directory of the fused par chain (see
+    channel_batch in the options) which holds the outputs of the channel
+    """
+
+    def batch_dir(wildcards):
+        channels = [
+            ChannelProcKey.get_filekey_from_pattern(os.path.basename(file)).channel
+            for file in read_filelist_pars_cal_channel(wildcards, tier)
+        ]
+        batch = channels.index(wildcards.channel) // channel_batch_size(setup)
+        return get_pattern_pars_tmp_batch(setup, tier).format(
+            batch=f"batch{batch:03d}", **dict(wildcards.items())
+        )
+
+    return batch_dir
+
+
+def get_batch_template(pattern, in_batch=True):
+    """
+    Params function passing a per channel pattern to the batch jobs of the fused par
+    chains with {channel} left in for the scripts, inside the batch directory (the
+    first output) if in_batch
+    """
+
+    def template(wildcards, output):
+        path = pattern.format(channel="{channel}", **dict(wildcards.items()))
+        if in_batch:
+            return os.path.join(output[0], os.path.basename(path))
+        return path
+
+    return template
+
+
 def read_filelist_plts_cal_channel(wildcards, tier):
     """
     This function will read the filelist of the channels and return a list of dsp files one for each channel
@@ -6,8 +6,10 @@ Snakemake rules for processing dsp tier. This is done in 4 steps:
 - running dsp over all channels using par file
 """
 
+import shutil
+
 from scripts.util.pars_loading import pars_catalog
-from scripts.util.utils import par_dsp_path
+from scripts.util.utils import channel_batch_size, par_dsp_path, use_fused_pars
 from scripts.util.patterns import (
     get_pattern_pars_tmp_channel,
     get_pattern_plts_tmp_channel,
@@ -22,16 +24,18 @@ from scripts.util.patterns import (
     get_pattern_pars,
     get_pattern_pars_overwrite,
     get_pattern_pars_svm,
+    get_pattern_pars_tmp_batch,
 )
 
 
 rule build_pars_dsp_tau:
     input:
-        files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-cal-raw.filelist"
+        files=get_run_input("raw"),
+        pulser=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
         ),
-        pulser=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
     params:
+        files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -55,18 +59,19 @@ rule build_pars_dsp_tau:
         "--plot_path {output.plots} "
         "--output_file {output.decay_const} "
         "--pulser_file {input.pulser} "
-        "--raw_files {input.files}"
+        "--raw_files {params.files}"
 
 
 rule build_pars_event_selection:
     input:
-        files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-cal-raw.filelist"
+        files=get_run_input("raw"),
+        pulser_file=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
         ),
-        pulser_file=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
         database=get_pattern_pars_tmp_channel(setup, "dsp", "decay_constant"),
         raw_cal=get_blinding_curve_file,
     params:
+        files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -91,18 +96,17 @@ rule build_pars_event_selection:
         "--pulser_file {input.pulser_file} "
         "--decay_const {input.database} "
         "--raw_cal {input.raw_cal} "
-        "--raw_filelist {input.files}"
+        "--raw_filelist {params.files}"
 
 
 # This rule builds the optimal energy filter parameters for the dsp using fft files
 rule build_pars_dsp_nopt:
     input:
-        files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-fft-raw.filelist"
-        ),
+        files=get_run_input("raw", "fft"),
         database=get_pattern_pars_tmp_channel(setup, "dsp", "decay_constant"),
         inplots=get_pattern_plts_tmp_channel(setup, "dsp", "decay_constant"),
     params:
+        files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -129,19 +133,20 @@ rule build_pars_dsp_nopt:
         "--inplots {input.inplots} "
         "--plot_path {output.plots} "
         "--dsp_pars {output.dsp_pars_nopt} "
-        "--raw_filelist {input.files}"
+        "--raw_filelist {params.files}"
 
 
 # This rule builds the dplms energy filter for the dsp using fft and cal files
 rule build_pars_dsp_dplms:
     input:
-        fft_files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-fft-raw.filelist"
-        ),
+        fft_files=get_run_input("raw", "fft"),
         peak_file=get_pattern_pars_tmp_channel(setup, "dsp", "peaks", "lh5"),
         database=get_pattern_pars_tmp_channel(setup, "dsp", "noise_optimization"),
         inplots=get_pattern_plts_tmp_channel(setup, "dsp", "noise_optimization"),
     params:
+        fft_files=lambda wildcards, input: get_channel_input(
+            input.fft_files, wildcards.channel
+        ),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -160,7 +165,7 @@ rule build_pars_dsp_dplms:
     shell:
         "{swenv} python3 -B "
         f"{workflow.source_path('../scripts/pars_dsp_dplms.py')} "
-        "--fft_raw_filelist {input.fft_files} "
+        "--fft_raw_filelist {params.fft_files} "
         "--peak_file {input.peak_file} "
         "--database {input.database} "
         "--inplots {input.inplots} "
@@ -194,6 +199,7 @@ rule build_pars_dsp_eopt:
         get_pattern_log_channel(setup, "pars_dsp_eopt"),
     group:
         "par-dsp"
+    threads: 4
     resources:
         runtime=300,
     shell:
@@ -212,6 +218,222 @@ rule build_pars_dsp_eopt:
         "--final_dsp_pars {output.dsp_pars}"
 
 
+if use_fused_pars(setup):
+
+    # Runs the rules above for a channel in a single process, the outputs only
+    # used within the chain are written next to the final ones and removed at the end
+    rule build_pars_dsp_chain:
+        input:
+            files=get_run_input("raw"),
+            fft_files=get_run_input("raw", "fft"),
+            pulser_file=get_pattern_pars_tmp(
+                setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+            ),
+            raw_cal=get_blinding_curve_file,
+        params:
+            files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
+            fft_files=lambda wildcards, input: get_channel_input(
+                input.fft_files, wildcards.channel
+            ),
+            decay_const=get_pattern_pars_tmp_channel(setup, "dsp", "decay_constant"),
+            decay_const_plots=get_pattern_plts_tmp_channel(setup, "dsp", "decay_constant"),
+            peak_file=get_pattern_pars_tmp_channel(setup, "dsp", "peaks", "lh5"),
+            nopt_pars=get_pattern_pars_tmp_channel(setup, "dsp", "noise_optimization"),
+            nopt_plots=get_pattern_plts_tmp_channel(setup, "dsp", "noise_optimization"),
+            dplms_pars=get_pattern_pars_tmp_channel(setup, "dsp", "dplms"),
+            dplms_plots=get_pattern_plts_tmp_channel(setup, "dsp", "dplms"),
+            timestamp="{timestamp}",
+            datatype="cal",
+            channel="{channel}",
+        output:
+            dsp_pars=temp(get_pattern_pars_tmp_channel(setup, "dsp_eopt")),
+            lh5_path=temp(
+                get_pattern_pars_tmp_channel(setup, "dsp", "dplms", extension="lh5")
+            ),
+            qbb_grid=temp(
+                get_pattern_pars_tmp_channel(setup, "dsp", "objects", extension="pkl")
+            ),
+            plots=temp(get_pattern_plts_tmp_channel(setup, "dsp")),
+        log:
+            chain=get_pattern_log_channel(setup, "pars_dsp_chain"),
+            tau=get_pattern_log_channel(setup, "par_dsp_decay_constant"),
+            event_selection=get_pattern_log_channel(setup, "par_dsp_event_selection"),
+            nopt=get_pattern_log_channel(setup, "par_dsp_noise_optimization"),
+            dplms=get_pattern_log_channel(setup, "pars_dsp_dplms"),
+            eopt=get_pattern_log_channel(setup, "pars_dsp_eopt"),
+        group:
+            "par-dsp"
+        threads: 4
+        resources:
+            runtime=1200,
+            mem_swap=70,
+        shell:
+            "{swenv} python3 -B "
+            f"{workflow.source_path('../scripts/pars_dsp_chain.py')} "
+            "--configs {configs} "
+            "--datatype {params.datatype} "
+            "--timestamp {params.timestamp} "
+            "--channel {params.channel} "
+            "--raw_filelist {params.files} "
+            "--fft_raw_filelist {params.fft_files} "
+            "--pulser_file {input.pulser_file} "
+            "--raw_cal {input.raw_cal} "
+            "--log {log.chain} "
+            "--tau_log {log.tau} "
+            "--event_selection_log {log.event_selection} "
+            "--nopt_log {log.nopt} "
+            "--dplms_log {log.dplms} "
+            "--eopt_log {log.eopt} "
+            "--decay_const {params.decay_const} "
+            "--decay_const_plots {params.decay_const_plots} "
+            "--peak_file {params.peak_file} "
+            "--nopt_pars {params.nopt_pars} "
+            "--nopt_plots {params.nopt_plots} "
+            "--dplms_pars {params.dplms_pars} "
+            "--dplms_lh5 {output.lh5_path} "
+            "--dplms_plots {params.dplms_plots} "
+            "--final_dsp_pars {output.dsp_pars} "
+            "--qbb_grid_path {output.qbb_grid} "
+            "--plot_path {output.plots}"
+
+    ruleorder: build_pars_dsp_chain > build_pars_dsp_eopt
+    ruleorder: build_pars_dsp_chain > build_pars_dsp_dplms
+
+    if channel_batch_size(setup) > 0:
+
+        # Runs the chain for channel_batch channels per job, the outputs are written
+        # to a batch directory from which unpack_pars_dsp_batch moves them in place
+        rule build_pars_dsp_batch:
+            input:
+                chan_list=get_channel_list("dsp"),
+                files=get_run_input("raw"),
+                fft_files=get_run_input("raw", "fft"),
+                pulser_file=get_pattern_pars_tmp(
+                    setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+                ),
+                raw_cal=get_blinding_curve_file,
+            params:
+                files=lambda wildcards, input: get_channel_input(input.files, "{channel}"),
+                fft_files=lambda wildcards, input: get_channel_input(
+                    input.fft_files, "{channel}"
+                ),
+                decay_const=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "decay_constant")
+                ),
+                decay_const_plots=get_batch_template(
+                    get_pattern_plts_tmp_channel(setup, "dsp", "decay_constant")
+                ),
+                peak_file=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "peaks", "lh5")
+                ),
+                nopt_pars=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "noise_optimization")
+                ),
+                nopt_plots=get_batch_template(
+                    get_pattern_plts_tmp_channel(setup, "dsp", "noise_optimization")
+                ),
+                dplms_pars=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "dplms")
+                ),
+                dplms_plots=get_batch_template(
+                    get_pattern_plts_tmp_channel(setup, "dsp", "dplms")
+                ),
+                dsp_pars=get_batch_template(get_pattern_pars_tmp_channel(setup, "dsp_eopt")),
+                lh5_path=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "dplms", extension="lh5")
+                ),
+                qbb_grid=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "objects", extension="pkl")
+                ),
+                plots=get_batch_template(get_pattern_plts_tmp_channel(setup, "dsp")),
+                chain_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_dsp_chain"), in_batch=False
+                ),
+                tau_log=get_batch_template(
+                    get_pattern_log_channel(setup, "par_dsp_decay_constant"), in_batch=False
+                ),
+                event_selection_log=get_batch_template(
+                    get_pattern_log_channel(setup, "par_dsp_event_selection"), in_batch=False
+                ),
+                nopt_log=get_batch_template(
+                    get_pattern_log_channel(setup, "par_dsp_noise_optimization"),
+                    in_batch=False,
+                ),
+                dplms_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_dsp_dplms"), in_batch=False
+                ),
+                eopt_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_dsp_eopt"), in_batch=False
+                ),
+                batch=lambda wildcards: int(wildcards.batch[len("batch") :]),
+                batch_size=channel_batch_size(setup),
+                timestamp="{timestamp}",
+                datatype="cal",
+            output:
+                temp(directory(get_pattern_pars_tmp_batch(setup, "dsp"))),
+            wildcard_constraints:
+                batch="batch\d{3}",
+            group:
+                "par-dsp"
+            threads: 4
+            resources:
+                runtime=1200 * channel_batch_size(setup),
+                mem_swap=70,
+            shell:
+                "{swenv} python3 -B "
+                f"{workflow.source_path('../scripts/pars_dsp_chain.py')} "
+                "--configs {configs} "
+                "--datatype {params.datatype} "
+                "--timestamp {params.timestamp} "
+                "--channel {input.chan_list} "
+                "--batch {params.batch} "
+                "--batch_size {params.batch_size} "
+                "--raw_filelist {params.files} "
+                "--fft_raw_filelist {params.fft_files} "
+                "--pulser_file {input.pulser_file} "
+                "--raw_cal {input.raw_cal} "
+                "--log {params.chain_log} "
+                "--tau_log {params.tau_log} "
+                "--event_selection_log {params.event_selection_log} "
+                "--nopt_log {params.nopt_log} "
+                "--dplms_log {params.dplms_log} "
+                "--eopt_log {params.eopt_log} "
+                "--decay_const {params.decay_const} "
+                "--decay_const_plots {params.decay_const_plots} "
+                "--peak_file {params.peak_file} "
+                "--nopt_pars {params.nopt_pars} "
+                "--nopt_plots {params.nopt_plots} "
+                "--dplms_pars {params.dplms_pars} "
+                "--dplms_lh5 {params.lh5_path} "
+                "--dplms_plots {params.dplms_plots} "
+                "--final_dsp_pars {params.dsp_pars} "
+                "--qbb_grid_path {params.qbb_grid} "
+                "--plot_path {params.plots}"
+
+        rule unpack_pars_dsp_batch:
+            input:
+                get_channel_batch("dsp"),
+            output:
+                dsp_pars=temp(get_pattern_pars_tmp_channel(setup, "dsp_eopt")),
+                lh5_path=temp(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "dplms", extension="lh5")
+                ),
+                qbb_grid=temp(
+                    get_pattern_pars_tmp_channel(setup, "dsp", "objects", extension="pkl")
+                ),
+                plots=temp(get_pattern_plts_tmp_channel(setup, "dsp")),
+            run:
+                for file in output:
+                    shutil.move(os.path.join(input[0], os.path.basename(file)), file)
+
+        localrules:
+            unpack_pars_dsp_batch,
+
+        ruleorder: unpack_pars_dsp_batch > build_pars_dsp_chain
+        ruleorder: unpack_pars_dsp_batch > build_pars_dsp_eopt
+        ruleorder: unpack_pars_dsp_batch > build_pars_dsp_dplms
+
+
 rule build_svm_dsp:
     input:
         hyperpars=lambda wildcards: get_svm_file(wildcards, "dsp", "svm_hyperpars"),
@@ -355,6 +577,7 @@ rule build_dsp:
                 setup, wildcards.timestamp, "dsp"
             )
         ),
+        jit_cache=ancient(get_jit_cache_warm_up),
     params:
         timestamp="{timestamp}",
         datatype="{datatype}",
@@ -365,6 +588,7 @@ rule build_dsp:
         get_pattern_log(setup, "tier_dsp"),
     group:
         "tier-dsp"
+    threads: 2
     resources:
         runtime=300,
         mem_swap=lambda wildcards: 35 if wildcards.datatype == "cal" else 25,
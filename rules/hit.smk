@@ -6,7 +6,10 @@ Snakemake rules for processing hit tier. This is done in 4 steps:
 - running build hit over all channels using par file
 """
 
+import shutil
+
 from scripts.util.pars_loading import pars_catalog
+from scripts.util.utils import channel_batch_size, use_fused_pars
 from scripts.util.patterns import (
     get_pattern_pars_tmp_channel,
     get_pattern_plts_tmp_channel,
@@ -18,16 +21,25 @@ from scripts.util.patterns import (
     get_pattern_pars_tmp,
     get_pattern_log,
     get_pattern_pars,
+    get_pattern_pars_tmp_batch,
 )
 
 
 # This rule builds the qc using the calibration dsp files and fft files
 rule build_qc:
     input:
-        files=lambda wildcards: read_filelist_cal(wildcards, "dsp"),
-        fft_files=lambda wildcards: read_filelist_fft(wildcards, "dsp"),
-        pulser=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
+        files=get_run_input("dsp", filelist=False),
+        fft_files=get_run_input("dsp", "fft", filelist=False),
+        pulser=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+        ),
     params:
+        files=lambda wildcards, input: get_channel_input(
+            input.files, wildcards.channel, "lh5"
+        ),
+        fft_files=lambda wildcards, input: get_channel_input(
+            input.fft_files, wildcards.channel, "lh5"
+        ),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -51,17 +63,17 @@ rule build_qc:
         "--plot_path {output.plot_file} "
         "--save_path {output.qc_file} "
         "--pulser_file {input.pulser} "
-        "--cal_files {input.files} "
-        "--fft_files {input.fft_files} "
+        "--cal_files {params.files} "
+        "--fft_files {params.fft_files} "
 
 
 # This rule builds the energy calibration using the calibration dsp files
 rule build_energy_calibration:
     input:
-        files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-cal-dsp.filelist"
+        files=get_run_input("dsp"),
+        pulser=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
         ),
-        pulser=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
         ctc_dict=ancient(
             lambda wildcards: pars_catalog.get_par_file(
                 setup, wildcards.timestamp, "dsp"
@@ -70,6 +82,7 @@ rule build_energy_calibration:
         inplots=get_pattern_plts_tmp_channel(setup, "hit", "qc"),
         in_hit_dict=get_pattern_pars_tmp_channel(setup, "hit", "qc"),
     params:
+        files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -85,6 +98,7 @@ rule build_energy_calibration:
         get_pattern_log_channel(setup, "pars_hit_energy_cal"),
     group:
         "par-hit"
+    threads: 4
     resources:
         runtime=300,
     shell:
@@ -103,22 +117,23 @@ rule build_energy_calibration:
         "--in_hit_dict {input.in_hit_dict} "
         "--ctc_dict {input.ctc_dict} "
         "--pulser_file {input.pulser} "
-        "--files {input.files}"
+        "--files {params.files}"
 
 
 # This rule builds the a/e calibration using the calibration dsp files
 rule build_aoe_calibration:
     input:
-        files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-cal-dsp.filelist"
+        files=get_run_input("dsp"),
+        pulser=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
         ),
-        pulser=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
         ecal_file=get_pattern_pars_tmp_channel(setup, "hit", "energy_cal"),
         eres_file=get_pattern_pars_tmp_channel(
             setup, "hit", "energy_cal_objects", extension="pkl"
         ),
         inplots=get_pattern_plts_tmp_channel(setup, "hit", "energy_cal"),
     params:
+        files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -151,22 +166,23 @@ rule build_aoe_calibration:
         "--plot_file {output.plot_file} "
         "--pulser_file {input.pulser} "
         "--ecal_file {input.ecal_file} "
-        "{input.files}"
+        "{params.files}"
 
 
 # This rule builds the lq calibration using the calibration dsp files
 rule build_lq_calibration:
     input:
-        files=os.path.join(
-            filelist_path(setup), "all-{experiment}-{period}-{run}-cal-dsp.filelist"
+        files=get_run_input("dsp"),
+        pulser=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
         ),
-        pulser=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
         ecal_file=get_pattern_pars_tmp_channel(setup, "hit", "aoe_cal"),
         eres_file=get_pattern_pars_tmp_channel(
             setup, "hit", "aoe_cal_objects", extension="pkl"
         ),
         inplots=get_pattern_plts_tmp_channel(setup, "hit", "aoe_cal"),
     params:
+        files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
         timestamp="{timestamp}",
         datatype="cal",
         channel="{channel}",
@@ -197,7 +213,219 @@ rule build_lq_calibration:
         "--plot_file {output.plot_file} "
         "--pulser_file {input.pulser} "
         "--ecal_file {input.ecal_file} "
-        "{input.files}"
+        "{params.files}"
+
+
+if use_fused_pars(setup):
+
+    # Runs the rules above for a channel in a single process, the outputs only
+    # used within the chain are written next to the final ones and removed at the end
+    rule build_pars_hit_chain:
+        input:
+            files=get_run_input("dsp"),
+            fft_files=get_run_input("dsp", "fft", filelist=False),
+            pulser=get_pattern_pars_tmp(
+                setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+            ),
+            ctc_dict=ancient(
+                lambda wildcards: pars_catalog.get_par_file(
+                    setup, wildcards.timestamp, "dsp"
+                )
+            ),
+        params:
+            files=lambda wildcards, input: get_channel_input(input.files, wildcards.channel),
+            fft_files=lambda wildcards, input: get_channel_input(
+                input.fft_files, wildcards.channel, "lh5"
+            ),
+            qc_file=get_pattern_pars_tmp_channel(setup, "hit", "qc"),
+            qc_plots=get_pattern_plts_tmp_channel(setup, "hit", "qc"),
+            ecal_file=get_pattern_pars_tmp_channel(setup, "hit", "energy_cal"),
+            ecal_results=get_pattern_pars_tmp_channel(
+                setup, "hit", "energy_cal_objects", extension="pkl"
+            ),
+            ecal_plots=get_pattern_plts_tmp_channel(setup, "hit", "energy_cal"),
+            aoe_file=get_pattern_pars_tmp_channel(setup, "hit", "aoe_cal"),
+            aoe_results=get_pattern_pars_tmp_channel(
+                setup, "hit", "aoe_cal_objects", extension="pkl"
+            ),
+            aoe_plots=get_pattern_plts_tmp_channel(setup, "hit", "aoe_cal"),
+            timestamp="{timestamp}",
+            datatype="cal",
+            channel="{channel}",
+        output:
+            hit_pars=temp(get_pattern_pars_tmp_channel(setup, "hit")),
+            lq_results=temp(
+                get_pattern_pars_tmp_channel(setup, "hit", "objects", extension="pkl")
+            ),
+            plot_file=temp(get_pattern_plts_tmp_channel(setup, "hit")),
+        log:
+            chain=get_pattern_log_channel(setup, "pars_hit_chain"),
+            qc=get_pattern_log_channel(setup, "pars_hit_qc"),
+            ecal=get_pattern_log_channel(setup, "pars_hit_energy_cal"),
+            aoe=get_pattern_log_channel(setup, "pars_hit_aoe_cal"),
+            lq=get_pattern_log_channel(setup, "pars_hit_lq_cal"),
+        group:
+            "par-hit"
+        threads: 4
+        resources:
+            runtime=1200,
+        shell:
+            "{swenv} python3 -B "
+            f"{workflow.source_path('../scripts/pars_hit_chain.py')} "
+            "--configs {configs} "
+            "--metadata {meta} "
+            "--datatype {params.datatype} "
+            "--timestamp {params.timestamp} "
+            "--channel {params.channel} "
+            "--filelist {params.files} "
+            "--fft_files {params.fft_files} "
+            "--pulser_file {input.pulser} "
+            "--ctc_dict {input.ctc_dict} "
+            "--log {log.chain} "
+            "--qc_log {log.qc} "
+            "--ecal_log {log.ecal} "
+            "--aoe_log {log.aoe} "
+            "--lq_log {log.lq} "
+            "--qc_file {params.qc_file} "
+            "--qc_plots {params.qc_plots} "
+            "--ecal_file {params.ecal_file} "
+            "--ecal_results {params.ecal_results} "
+            "--ecal_plots {params.ecal_plots} "
+            "--aoe_file {params.aoe_file} "
+            "--aoe_results {params.aoe_results} "
+            "--aoe_plots {params.aoe_plots} "
+            "--hit_pars {output.hit_pars} "
+            "--lq_results {output.lq_results} "
+            "--plot_file {output.plot_file}"
+
+    ruleorder: build_pars_hit_chain > build_lq_calibration
+
+    if channel_batch_size(setup) > 0:
+
+        # Runs the chain for channel_batch channels per job, the outputs are written
+        # to a batch directory from which unpack_pars_hit_batch moves them in place
+        rule build_pars_hit_batch:
+            input:
+                chan_list=get_channel_list("hit"),
+                files=get_run_input("dsp"),
+                fft_files=get_run_input("dsp", "fft", filelist=False),
+                pulser=get_pattern_pars_tmp(
+                    setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+                ),
+                ctc_dict=ancient(
+                    lambda wildcards: pars_catalog.get_par_file(
+                        setup, wildcards.timestamp, "dsp"
+                    )
+                ),
+            params:
+                files=lambda wildcards, input: get_channel_input(input.files, "{channel}"),
+                fft_files=lambda wildcards, input: get_channel_input(
+                    input.fft_files, "{channel}", "lh5"
+                ),
+                qc_file=get_batch_template(get_pattern_pars_tmp_channel(setup, "hit", "qc")),
+                qc_plots=get_batch_template(get_pattern_plts_tmp_channel(setup, "hit", "qc")),
+                ecal_file=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "hit", "energy_cal")
+                ),
+                ecal_results=get_batch_template(
+                    get_pattern_pars_tmp_channel(
+                        setup, "hit", "energy_cal_objects", extension="pkl"
+                    )
+                ),
+                ecal_plots=get_batch_template(
+                    get_pattern_plts_tmp_channel(setup, "hit", "energy_cal")
+                ),
+                aoe_file=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "hit", "aoe_cal")
+                ),
+                aoe_results=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "hit", "aoe_cal_objects", extension="pkl")
+                ),
+                aoe_plots=get_batch_template(
+                    get_pattern_plts_tmp_channel(setup, "hit", "aoe_cal")
+                ),
+                hit_pars=get_batch_template(get_pattern_pars_tmp_channel(setup, "hit")),
+                lq_results=get_batch_template(
+                    get_pattern_pars_tmp_channel(setup, "hit", "objects", extension="pkl")
+                ),
+                plot_file=get_batch_template(get_pattern_plts_tmp_channel(setup, "hit")),
+                chain_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_hit_chain"), in_batch=False
+                ),
+                qc_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_hit_qc"), in_batch=False
+                ),
+                ecal_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_hit_energy_cal"), in_batch=False
+                ),
+                aoe_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_hit_aoe_cal"), in_batch=False
+                ),
+                lq_log=get_batch_template(
+                    get_pattern_log_channel(setup, "pars_hit_lq_cal"), in_batch=False
+                ),
+                batch=lambda wildcards: int(wildcards.batch[len("batch") :]),
+                batch_size=channel_batch_size(setup),
+                timestamp="{timestamp}",
+                datatype="cal",
+            output:
+                temp(directory(get_pattern_pars_tmp_batch(setup, "hit"))),
+            wildcard_constraints:
+                batch="batch\d{3}",
+            group:
+                "par-hit"
+            threads: 4
+            resources:
+                runtime=1200 * channel_batch_size(setup),
+            shell:
+                "{swenv} python3 -B "
+                f"{workflow.source_path('../scripts/pars_hit_chain.py')} "
+                "--configs {configs} "
+                "--metadata {meta} "
+                "--datatype {params.datatype} "
+                "--timestamp {params.timestamp} "
+                "--channel {input.chan_list} "
+                "--batch {params.batch} "
+                "--batch_size {params.batch_size} "
+                "--filelist {params.files} "
+                "--fft_files {params.fft_files} "
+                "--pulser_file {input.pulser} "
+                "--ctc_dict {input.ctc_dict} "
+                "--log {params.chain_log} "
+                "--qc_log {params.qc_log} "
+                "--ecal_log {params.ecal_log} "
+                "--aoe_log {params.aoe_log} "
+                "--lq_log {params.lq_log} "
+                "--qc_file {params.qc_file} "
+                "--qc_plots {params.qc_plots} "
+                "--ecal_file {params.ecal_file} "
+                "--ecal_results {params.ecal_results} "
+                "--ecal_plots {params.ecal_plots} "
+                "--aoe_file {params.aoe_file} "
+                "--aoe_results {params.aoe_results} "
+                "--aoe_plots {params.aoe_plots} "
+                "--hit_pars {params.hit_pars} "
+                "--lq_results {params.lq_results} "
+                "--plot_file {params.plot_file}"
+
+        rule unpack_pars_hit_batch:
+            input:
+                get_channel_batch("hit"),
+            output:
+                hit_pars=temp(get_pattern_pars_tmp_channel(setup, "hit")),
+                lq_results=temp(
+                    get_pattern_pars_tmp_channel(setup, "hit", "objects", extension="pkl")
+                ),
+                plot_file=temp(get_pattern_plts_tmp_channel(setup, "hit")),
+            run:
+                for file in output:
+                    shutil.move(os.path.join(input[0], os.path.basename(file)), file)
+
+        localrules:
+            unpack_pars_hit_batch,
+
+        ruleorder: unpack_pars_hit_batch > build_pars_hit_chain
+        ruleorder: unpack_pars_hit_batch > build_lq_calibration
 
 
 # rule build_pars_hit:
@@ -230,6 +458,7 @@ rule build_hit:
         pars_file=lambda wildcards: pars_catalog.get_par_file(
             setup, wildcards.timestamp, "hit"
         ),
+        jit_cache=ancient(get_jit_cache_warm_up),
     output:
         tier_file=get_pattern_tier(setup, "hit", check_in_cycle=check_in_cycle),
         db_file=get_pattern_pars_tmp(setup, "hit_db"),
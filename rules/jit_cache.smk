@@ -0,0 +1,71 @@
+"""
+Snakemake rule warming up the shared numba cache. With a jit_cache path set the
+kernels used by the dsp and hit configs of a run are compiled once, before the
+build_dsp and build_hit jobs of the run which then load them from the cache.
+The warm-up output is kept with the pars of the production, not in the shared
+cache, and is an ancient input so warming up again doesn't rerun the tiers.
+"""
+
+from scripts.util.FileKey import FileKey
+from scripts.util.pars_loading import pars_catalog
+from scripts.util.patterns import (
+    get_pattern_jit_cache_warm_up,
+    get_pattern_log_concat,
+    get_pattern_tier_raw,
+)
+from scripts.util.utils import jit_cache_path
+
+
+def get_jit_cache_warm_up(wildcards):
+    """The warm-up output of the run as input of the tier rules, none without a jit_cache path"""
+    if jit_cache_path(setup) == "":
+        return []
+    return get_pattern_jit_cache_warm_up(setup).format(
+        experiment=wildcards.experiment,
+        period=wildcards.period,
+        run=wildcards.run,
+        datatype=wildcards.datatype,
+    )
+
+
+def get_jit_cache_raw_file(wildcards):
+    return sorted(read_filelist_run(wildcards, "raw"))[0]
+
+
+if jit_cache_path(setup) != "":
+
+    rule warm_jit_cache:
+        input:
+            raw_file=get_jit_cache_raw_file,
+            pars_file=ancient(
+                lambda wildcards: pars_catalog.get_par_file(
+                    setup,
+                    FileKey.get_filekey_from_pattern(
+                        get_jit_cache_raw_file(wildcards), get_pattern_tier_raw(setup)
+                    ).timestamp,
+                    "dsp",
+                )
+            ),
+        params:
+            timestamp=lambda wildcards: FileKey.get_filekey_from_pattern(
+                get_jit_cache_raw_file(wildcards), get_pattern_tier_raw(setup)
+            ).timestamp,
+            datatype="{datatype}",
+        output:
+            get_pattern_jit_cache_warm_up(setup),
+        log:
+            get_pattern_log_concat(setup, "warm_jit_cache"),
+        group:
+            "jit-cache"
+        resources:
+            runtime=300,
+        shell:
+            "{swenv} python3 -B "
+            f"{workflow.source_path('../scripts/warm_jit_cache.py')} "
+            "--log {log} "
+            "--configs {configs} "
+            "--datatype {params.datatype} "
+            "--timestamp {params.timestamp} "
+            "--input {input.raw_file} "
+            "--output {output} "
+            "--pars_file {input.pars_file}"
@@ -8,7 +8,12 @@ Snakemake rules for processing pht (partition hit) tier data. This is done in 4
 
 from scripts.util.pars_loading import pars_catalog
 from scripts.util.create_pars_keylist import pars_key_resolve
-from scripts.util.utils import filelist_path, par_pht_path, set_last_rule_name
+from scripts.util.utils import (
+    filelist_path,
+    file_index_path,
+    par_pht_path,
+    set_last_rule_name,
+)
 from scripts.util.patterns import (
     get_pattern_pars_tmp_channel,
     get_pattern_plts_tmp_channel,
@@ -26,6 +31,7 @@ ds.pars_key_resolve.write_par_catalog(
     os.path.join(pars_path(setup), "pht", "validity.jsonl"),
     get_pattern_tier_raw(setup),
     {"cal": ["par_pht"], "lar": ["par_pht"]},
+    index_file=file_index_path(setup),
 )
 
 intier = "psp"
@@ -49,13 +55,14 @@ for key, dataset in part.datasets.items():
                 cal_files=part.get_filelists(partition, key, intier),
                 fft_files=part.get_filelists(partition, key, intier, datatype="fft"),
                 pulser_files=[
-                    file.replace("pht", "tcm")
-                    for file in part.get_par_files(
+                    file.replace("par_pht", "par_tcm")
+                    for file in part.get_run_par_files(
                         f"{par_pht_path(setup)}/validity.jsonl",
                         partition,
                         key,
                         tier="pht",
                         name="pulser_ids",
+                        extension="npz",
                     )
                 ],
                 check_files=part.get_par_files(
@@ -151,7 +158,9 @@ rule build_pht_qc:
             filelist_path(setup),
             "all-{experiment}-{period}-{run}-fft-" + f"{intier}.filelist",
         ),
-        pulser_files=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
+        pulser_files=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+        ),
         check_file=get_pattern_pars_tmp_channel(setup, "pht", "check"),
         overwrite_files=lambda wildcards: get_overwrite_file("pht", wildcards=wildcards),
     params:
@@ -202,7 +211,9 @@ rule build_per_energy_calibration:
             filelist_path(setup),
             "all-{experiment}-{period}-{run}-cal-" + f"{intier}.filelist",
         ),
-        pulser=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
+        pulser=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+        ),
         pht_dict=get_pattern_pars_tmp_channel(setup, "pht", "qc"),
         inplots=get_pattern_plts_tmp_channel(setup, "pht", "qc"),
         ctc_dict=ancient(
@@ -227,6 +238,7 @@ rule build_per_energy_calibration:
         get_pattern_log_channel(setup, "par_pht_energy_cal"),
     group:
         "par-pht"
+    threads: 4
     resources:
         runtime=300,
     shell:
@@ -257,13 +269,14 @@ for key, dataset in part.datasets.items():
             input:
                 files=part.get_filelists(partition, key, intier),
                 pulser_files=[
-                    file.replace("pht", "tcm")
-                    for file in part.get_par_files(
+                    file.replace("par_pht", "par_tcm")
+                    for file in part.get_run_par_files(
                         f"{par_pht_path(setup)}/validity.jsonl",
                         partition,
                         key,
                         tier="pht",
                         name="pulser_ids",
+                        extension="npz",
                     )
                 ],
                 ecal_file=part.get_par_files(
@@ -338,6 +351,7 @@ for key, dataset in part.datasets.items():
                 ),
             group:
                 "par-pht"
+            threads: 4
             resources:
                 mem_swap=len(part.get_filelists(partition, key, intier)) * 15,
                 runtime=300,
@@ -377,7 +391,9 @@ rule build_pht_energy_super_calibrations:
             filelist_path(setup),
             "all-{experiment}-{period}-{run}-cal" + f"-{intier}.filelist",
         ),
-        pulser_files=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
+        pulser_files=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+        ),
         ecal_file=get_pattern_pars_tmp_channel(setup, "pht", "energy_cal"),
         eres_file=get_pattern_pars_tmp_channel(
             setup, "pht", "energy_cal_objects", extension="pkl"
@@ -399,6 +415,7 @@ rule build_pht_energy_super_calibrations:
         get_pattern_log_channel(setup, "par_pht_partcal"),
     group:
         "par-pht"
+    threads: 4
     resources:
         mem_swap=60,
         runtime=300,
@@ -439,13 +456,14 @@ for key, dataset in part.datasets.items():
             input:
                 files=part.get_filelists(partition, key, intier),
                 pulser_files=[
-                    file.replace("pht", "tcm")
-                    for file in part.get_par_files(
+                    file.replace("par_pht", "par_tcm")
+                    for file in part.get_run_par_files(
                         f"{par_pht_path(setup)}/validity.jsonl",
                         partition,
                         key,
                         tier="pht",
                         name="pulser_ids",
+                        extension="npz",
                     )
                 ],
                 ecal_file=part.get_par_files(
@@ -558,7 +576,9 @@ rule build_pht_aoe_calibrations:
             filelist_path(setup),
             "all-{experiment}-{period}-{run}-cal-" + f"{intier}.filelist",
         ),
-        pulser_files=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
+        pulser_files=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+        ),
         ecal_file=get_pattern_pars_tmp_channel(setup, "pht", "partcal"),
         eres_file=get_pattern_pars_tmp_channel(
             setup, "pht", "partcal_objects", extension="pkl"
@@ -619,13 +639,14 @@ for key, dataset in part.datasets.items():
             input:
                 files=part.get_filelists(partition, key, intier),
                 pulser_files=[
-                    file.replace("pht", "tcm")
-                    for file in part.get_par_files(
+                    file.replace("par_pht", "par_tcm")
+                    for file in part.get_run_par_files(
                         f"{par_pht_path(setup)}/validity.jsonl",
                         partition,
                         key,
                         tier="pht",
                         name="pulser_ids",
+                        extension="npz",
                     )
                 ],
                 ecal_file=part.get_par_files(
@@ -733,7 +754,9 @@ rule build_pht_lq_calibration:
             filelist_path(setup),
             "all-{experiment}-{period}-{run}-cal-" + f"{intier}.filelist",
         ),
-        pulser_files=get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids"),
+        pulser_files=get_pattern_pars_tmp(
+            setup, "tcm", "pulser_ids", datatype="cal", extension="npz"
+        ),
         ecal_file=get_pattern_pars_tmp_channel(setup, "pht", "aoecal"),
         eres_file=get_pattern_pars_tmp_channel(
             setup, "pht", "aoecal_objects", extension="pkl"
@@ -8,7 +8,12 @@ Snakemake rules for processing pht (partition hit) tier data. This is done in 4
 
 from scripts.util.pars_loading import pars_catalog
 from scripts.util.create_pars_keylist import pars_key_resolve
-from scripts.util.utils import par_psp_path, par_dsp_path, set_last_rule_name
+from scripts.util.utils import (
+    file_index_path,
+    par_psp_path,
+    par_dsp_path,
+    set_last_rule_name,
+)
 from scripts.util.patterns import (
     get_pattern_pars_tmp_channel,
     get_pattern_plts_tmp_channel,
@@ -25,6 +30,7 @@ pars_key_resolve.write_par_catalog(
     os.path.join(pars_path(setup), "dsp", "validity.jsonl"),
     get_pattern_tier_raw(setup),
     {"cal": ["par_dsp"], "lar": ["par_dsp"]},
+    index_file=file_index_path(setup),
 )
 
 pars_key_resolve.write_par_catalog(
@@ -32,6 +38,7 @@ pars_key_resolve.write_par_catalog(
     os.path.join(pars_path(setup), "psp", "validity.jsonl"),
     get_pattern_tier_raw(setup),
     {"cal": ["par_psp"], "lar": ["par_psp"]},
+    index_file=file_index_path(setup),
 )
 
 psp_rules = {}
@@ -334,6 +341,7 @@ rule build_psp:
         get_pattern_log(setup, "tier_psp"),
     group:
         "tier-dsp"
+    threads: 2
     resources:
         runtime=300,
         mem_swap=lambda wildcards: 35 if wildcards.datatype == "cal" else 25,
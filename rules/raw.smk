@@ -5,6 +5,7 @@ from scripts.util.patterns import (
     get_pattern_log,
     get_pattern_tier_raw_blind,
 )
+from scripts.util.utils import fused_raw_blind
 
 
 rule build_raw:
@@ -54,6 +55,7 @@ rule build_raw_blind:
         get_pattern_log(setup, "tier_raw_blind").replace("{datatype}", "phy"),
     group:
         "tier-raw"
+    threads: 4
     resources:
         mem_swap=110,
         runtime=300,
@@ -69,3 +71,54 @@ rule build_raw_blind:
         "--blind_curve {input.blind_file} "
         "--input {input.tier_file} "
         "--output {output}"
+
+
+if fused_raw_blind(setup):
+
+    rule build_raw_blind_fused:
+        """
+        This rule runs build raw and the blinding of phy data in one job, it takes in a daq file
+        and outputs the blinded raw file, and the raw file if fused_raw_blind is "both"
+        """
+        input:
+            daq_file=get_pattern_tier_daq(setup).replace("{datatype}", "phy"),
+            blind_file=get_blinding_curve_file,
+            check_file=get_blinding_check_file,
+        params:
+            timestamp="{timestamp}",
+            datatype="phy",
+            raw_file=lambda wildcards, output: getattr(output, "raw_file", ""),
+        output:
+            blind_file=get_pattern_tier_raw_blind(setup),
+            **(
+                {
+                    "raw_file": get_pattern_tier(
+                        setup, "raw", check_in_cycle=check_in_cycle
+                    ).replace("{datatype}", "phy")
+                }
+                if fused_raw_blind(setup) == "both"
+                else {}
+            ),
+        log:
+            get_pattern_log(setup, "tier_raw_blind").replace("{datatype}", "phy"),
+        group:
+            "tier-raw"
+        threads: 4
+        resources:
+            mem_swap=110,
+            runtime=300,
+        shell:
+            "{swenv} python3 -B "
+            f"{workflow.source_path('../scripts/build_raw.py')} "
+            "--log {log} "
+            "--configs {configs} "
+            "--chan_maps {chan_maps} "
+            "--metadata {meta} "
+            "--datatype {params.datatype} "
+            "--timestamp {params.timestamp} "
+            "--blind_curve {input.blind_file} "
+            "--blind_output {output.blind_file} "
+            "{input.daq_file} {params.raw_file}"
+
+    ruleorder: build_raw_blind_fused > build_raw_blind
+    ruleorder: build_raw_blind_fused > build_raw
@@ -0,0 +1,37 @@
+"""
+Snakemake rules for the optional channel-major reshard of calibration runs.
+With channel_shards set in the options every cal/fft run is rewritten once into
+one file per channel which the per channel par rules read instead of the run files.
+"""
+
+from scripts.util.patterns import get_pattern_channel_shards, get_pattern_log
+
+
+rule build_channel_shards:
+    input:
+        files=lambda wildcards: read_filelist_run(wildcards, wildcards.tier),
+    params:
+        timestamp="{timestamp}",
+        datatype="{datatype}",
+        tier="{tier}",
+    output:
+        temp(directory(get_pattern_channel_shards(setup, "{tier}"))),
+    wildcard_constraints:
+        datatype="cal|fft",
+        tier="raw|dsp",
+    log:
+        get_pattern_log(setup, "channel_shards_{tier}"),
+    group:
+        "channel-shards"
+    resources:
+        runtime=300,
+    shell:
+        "{swenv} python3 -B "
+        f"{workflow.source_path('../scripts/build_channel_shards.py')} "
+        "--log {log} "
+        "--configs {configs} "
+        "--datatype {params.datatype} "
+        "--timestamp {params.timestamp} "
+        "--tier {params.tier} "
+        "--output {output} "
+        "--input {input.files}"
@@ -6,8 +6,7 @@ from scripts.util.patterns import (
     get_pattern_tier_raw,
     get_pattern_tier,
     get_pattern_log,
-    get_pattern_pars_tmp_channel,
-    get_pattern_log_channel,
+    get_pattern_pars_tmp,
 )
 
 
@@ -37,18 +36,19 @@ rule build_tier_tcm:
         "{output}"
 
 
-# This rule builds the tcm files each raw file
+# This rule builds the pulser masks of all channels of a cal run from the tcm files
 rule build_pulser_ids:
     input:
         tcm_files=lambda wildcards: read_filelist_cal(wildcards, "tcm"),
     params:
         timestamp="{timestamp}",
         datatype="cal",
-        channel="{channel}",
     output:
-        pulser=temp(get_pattern_pars_tmp_channel(setup, "tcm", "pulser_ids")),
+        pulser=temp(
+            get_pattern_pars_tmp(setup, "tcm", "pulser_ids", datatype="cal", extension="npz")
+        ),
     log:
-        get_pattern_log_channel(setup, "tcm_pulsers"),
+        get_pattern_log(setup, "tcm_pulsers").replace("{datatype}", "cal"),
     group:
         "tier-tcm"
     resources:
@@ -60,6 +60,5 @@ rule build_pulser_ids:
         "--configs {configs} "
         "--datatype {params.datatype} "
         "--timestamp {params.timestamp} "
-        "--channel {params.channel} "
         "--tcm_files {input.tcm_files} "
         "--pulser_file {output.pulser} "
@@ -10,7 +10,9 @@ import logging
 import os
 import pickle as pkl
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+
+setup_jit_cache()
 os.environ["LGDO_BOUNDSCHECK"] = "false"
 
 import lgdo.lh5_store as lh5
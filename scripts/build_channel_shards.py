@@ -0,0 +1,84 @@
+"""
+Rewrites the files of a run into one file per channel holding the concatenated
+rows of the channel, so the per channel parameter jobs do a single sequential
+read instead of opening every file of the run. Next to each shard a filelist
+pointing to it is written so the shards can be passed wherever the run
+filelists are.
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import re
+import time
+
+from util.jit_cache import setup_jit_cache
+
+setup_jit_cache()
+os.environ["LGDO_BOUNDSCHECK"] = "false"
+
+import lgdo.lh5 as lh5
+from util.metadata_cache import MetadataSnapshot
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--configs", help="configs path", type=str, required=True)
+argparser.add_argument("--log", help="log file", type=str)
+argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
+argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
+argparser.add_argument("--tier", help="tier of the input files", type=str, required=True)
+argparser.add_argument("--input", help="input files", nargs="*", type=str, required=True)
+argparser.add_argument("--output", help="output directory", type=str, required=True)
+args = argparser.parse_args()
+
+pathlib.Path(os.path.dirname(args.log)).mkdir(parents=True, exist_ok=True)
+logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
+logging.getLogger("numba").setLevel(logging.INFO)
+logging.getLogger("parse").setLevel(logging.INFO)
+logging.getLogger("lgdo").setLevel(logging.INFO)
+logging.getLogger("h5py").setLevel(logging.INFO)
+logging.getLogger("legendmeta").setLevel(logging.INFO)
+log = logging.getLogger(__name__)
+
+rule_dict = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs).config[
+    "snakemake_rules"
+]
+# only the columns the parameter generation needs, all columns if not configured
+fields = rule_dict.get("build_channel_shards", {}).get("inputs", {}).get("fields", {})
+fields = fields.get(args.tier, None)
+
+if args.input[0].split(".")[-1] == "filelist":
+    with open(args.input[0]) as f:
+        files = f.read().splitlines()
+else:
+    files = args.input
+# same order as the run filelists are read in by the par scripts
+files = sorted(files)
+
+pathlib.Path(args.output).mkdir(parents=True, exist_ok=True)
+sto = lh5.LH5Store()
+
+start = time.time()
+n_rows = {}
+for file in files:
+    channels = [channel for channel in lh5.ls(file) if re.match("(ch\\d{7})", channel)]
+    for channel in channels:
+        tb = sto.read(f"{channel}/{args.tier}", file, field_mask=fields)[0]
+        sto.write(
+            obj=tb,
+            name=args.tier,
+            lh5_file=os.path.join(args.output, f"{channel}.lh5"),
+            group=channel,
+            wo_mode="append",
+        )
+        n_rows[channel] = n_rows.get(channel, 0) + len(tb)
+    log.debug(f"sharded {file}")
+
+for channel in n_rows:
+    with open(os.path.join(args.output, f"{channel}.filelist"), "w") as f:
+        f.write(f"{os.path.join(args.output, f'{channel}.lh5')}\n")
+
+log.info(
+    f"{len(files)} files sharded into {len(n_rows)} channels "
+    f"({sum(n_rows.values())} rows) in {time.time() - start:.2f}s"
+)
@@ -7,16 +7,20 @@ import re
 import time
 import warnings
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+from util.threads import set_threads
+
+setup_jit_cache()
+set_threads(parallel=True)
 os.environ["LGDO_BOUNDSCHECK"] = "false"
-os.environ["DSPEED_CACHE"] = "false"
 os.environ["DSPEED_BOUNDSCHECK"] = "false"
 
 import lgdo.lh5 as lh5
 import numpy as np
 from dspeed import build_dsp
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
+from util.dsp_settings import get_dsp_settings
+from util.metadata_cache import MetadataSnapshot
 
 
 def replace_list_with_array(dic):
@@ -50,12 +54,17 @@ logging.getLogger("parse").setLevel(logging.INFO)
 logging.getLogger("lgdo").setLevel(logging.INFO)
 log = logging.getLogger(__name__)
 
-configs = LegendMetadata(path=args.configs)
-channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]["tier_dsp"][
-    "inputs"
-]["processing_chain"]
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
+dsp_inputs = configs.config["snakemake_rules"]["tier_dsp"]["inputs"]
+channel_dict = dsp_inputs["processing_chain"]
+
+# buffer_len and block_width tuned for the datatype, if tuned
+dsp_settings = get_dsp_settings(
+    configs.read(dsp_inputs["dsp_settings"]) if "dsp_settings" in dsp_inputs else None,
+    args.datatype,
+)
 
-channel_dict = {chan: Props.read_from(file) for chan, file in channel_dict.items()}
+channel_dict = {chan: configs.read(file) for chan, file in channel_dict.items()}
 db_files = [
     par_file
     for par_file in args.pars_file
@@ -80,11 +89,14 @@ build_dsp(
     database=database_dic,
     chan_config=channel_dict,
     write_mode="r",
-    buffer_len=3200 if args.datatype == "cal" else 3200,
-    block_width=16,
+    buffer_len=dsp_settings["buffer_len"],
+    block_width=dsp_settings["block_width"],
 )
 
-log.info(f"build_dsp finished in {time.time()-start}")
+log.info(
+    f"build_dsp finished in {time.time()-start} with buffer_len {dsp_settings['buffer_len']} "
+    f"and block_width {dsp_settings['block_width']}"
+)
 
 os.rename(temp_output, args.output)
 
@@ -7,30 +7,15 @@ import time
 
 import lgdo.lh5 as lh5
 import numpy as np
-from legendmeta import LegendMetadata
-from legendmeta.catalog import Props
 from lgdo.types import Array
 from pygama.evt import build_evt
+from util.channel_index import ChannelIndex
+from util.coincidences import match_timestamps
+from util.metadata_cache import MetadataSnapshot
 
 sto = lh5.LH5Store()
 
 
-def find_matching_values_with_delay(arr1, arr2, jit_delay):
-    matching_values = []
-
-    # Create an array with all possible delay values
-    delays = np.arange(0, int(1e9 * jit_delay)) * jit_delay
-
-    for delay in delays:
-        arr2_delayed = arr2 + delay
-
-        # Find matching values and indices
-        mask = np.isin(arr1, arr2_delayed, assume_unique=True)
-        matching_values.extend(arr1[mask])
-
-    return np.unique(matching_values)
-
-
 argparser = argparse.ArgumentParser()
 argparser.add_argument("--hit_file", help="hit file", type=str)
 argparser.add_argument("--dsp_file", help="dsp file", type=str)
@@ -64,36 +49,26 @@ logging.getLogger("h5py._conv").setLevel(logging.INFO)
 log = logging.getLogger(__name__)
 
 # load in config
-configs = LegendMetadata(path=args.configs)
+configs = MetadataSnapshot.load(
+    args.timestamp, args.datatype, configs=args.configs, metadata=args.metadata
+)
 if args.tier == "evt" or args.tier == "pet":
-    config_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]["tier_evt"][
-        "inputs"
-    ]
+    config_dict = configs.config["snakemake_rules"]["tier_evt"]["inputs"]
     evt_config_file = config_dict["evt_config"]
 else:
     msg = "unknown tier"
     raise ValueError(msg)
 
-meta = LegendMetadata(path=args.metadata)
-chmap = meta.channelmap(args.timestamp)
+chan_index = ChannelIndex(configs.channelmap)
 
-evt_config = Props.read_from(evt_config_file)
+evt_config = configs.read(evt_config_file)
 
 # block for snakemake to fill in channel lists
 for field, dic in evt_config["channels"].items():
     if isinstance(dic, dict):
-        chans = chmap.map("system", unique=False)[dic["system"]]
-        if "selectors" in dic:
-            try:
-                for k, val in dic["selectors"].items():
-                    chans = chans.map(k, unique=False)[val]
-            except KeyError:
-                chans = None
-        if chans is not None:
-            chans = [f"ch{chan}" for chan in list(chans.map("daq.rawid"))]
-        else:
-            chans = []
-        evt_config["channels"][field] = chans
+        evt_config["channels"][field] = chan_index.channel_names(
+            dic["system"], dic.get("selectors", None)
+        )
 
 log.debug(json.dumps(evt_config["channels"], indent=2))
 
@@ -115,23 +90,14 @@ table = build_evt(
 )
 
 if "muon_config" in config_dict and config_dict["muon_config"] is not None:
-    muon_config = Props.read_from(config_dict["muon_config"]["evt_config"])
-    field_config = Props.read_from(config_dict["muon_config"]["field_config"])
+    muon_config = configs.read(config_dict["muon_config"]["evt_config"])
+    field_config = configs.read(config_dict["muon_config"]["field_config"])
     # block for snakemake to fill in channel lists
     for field, dic in muon_config["channels"].items():
         if isinstance(dic, dict):
-            chans = chmap.map("system", unique=False)[dic["system"]]
-            if "selectors" in dic:
-                try:
-                    for k, val in dic["selectors"].items():
-                        chans = chans.map(k, unique=False)[val]
-                except KeyError:
-                    chans = None
-            if chans is not None:
-                chans = [f"ch{chan}" for chan in list(chans.map("daq.rawid"))]
-            else:
-                chans = []
-            muon_config["channels"][field] = chans
+            muon_config["channels"][field] = chan_index.channel_names(
+                dic["system"], dic.get("selectors", None)
+            )
 
     trigger_timestamp = table[field_config["ged_timestamp"]["table"]][
         field_config["ged_timestamp"]["field"]
@@ -149,18 +115,21 @@ if "muon_config" in config_dict and config_dict["muon_config"] is not None:
 
         muon_timestamp = muon_table[field_config["muon_timestamp"]["field"]].nda
         muon_tbl_flag = muon_table[field_config["muon_flag"]["field"]].nda
-        if len(muon_timestamp[muon_tbl_flag]) > 0:
-            is_muon_veto_triggered = find_matching_values_with_delay(
-                trigger_timestamp, muon_timestamp[muon_tbl_flag], field_config["jitter"]
-            )
-            muon_flag = np.isin(trigger_timestamp, is_muon_veto_triggered)
-        else:
-            muon_flag = np.zeros(len(trigger_timestamp), dtype=bool)
+        muon_flag, muon_idx = match_timestamps(
+            trigger_timestamp, muon_timestamp[muon_tbl_flag], field_config["jitter"]
+        )
+        # convert to row index of the muon table
+        muon_idx[muon_flag] = np.flatnonzero(muon_tbl_flag)[muon_idx[muon_flag]]
     else:
         muon_flag = np.zeros(len(trigger_timestamp), dtype=bool)
+        muon_idx = np.full(len(trigger_timestamp), -1, dtype=np.int64)
     table[field_config["output_field"]["table"]].add_column(
         field_config["output_field"]["field"], Array(muon_flag)
     )
+    if "index_field" in field_config:
+        table[field_config["index_field"]["table"]].add_column(
+            field_config["index_field"]["field"], Array(muon_idx)
+        )
 
 sto.write(obj=table, name="evt", lh5_file=temp_output, wo_mode="a")
 
@@ -5,10 +5,10 @@ import os
 import pathlib
 import time
 
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
 from lgdo.lh5 import ls
 from pygama.hit.build_hit import build_hit
+from util.metadata_cache import MetadataSnapshot
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument("--input", help="input file", type=str)
@@ -36,11 +36,9 @@ logging.getLogger("h5py._conv").setLevel(logging.INFO)
 log = logging.getLogger(__name__)
 
 
-configs = LegendMetadata(path=args.configs)
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
 if args.tier == "hit" or args.tier == "pht":
-    channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]["tier_hit"][
-        "inputs"
-    ]["hit_config"]
+    channel_dict = configs.config["snakemake_rules"]["tier_hit"]["inputs"]["hit_config"]
 else:
     msg = "unknown tier"
     raise ValueError(msg)
@@ -55,7 +53,7 @@ channels_present = ls(args.input)
 for channel in pars_dict:
     chan_pars = pars_dict[channel].copy()
     if channel in channel_dict:
-        cfg_dict = Props.read_from(channel_dict[channel])
+        cfg_dict = configs.read(channel_dict[channel])
         Props.add_to(cfg_dict, chan_pars)
         chan_pars = cfg_dict
 
@@ -71,7 +69,7 @@ log.info(f"Done!  Time elapsed: {t_elap:.2f} sec.")
 hit_outputs = {}
 hit_channels = []
 for channel, file in channel_dict.items():
-    output = Props.read_from(file)["outputs"]
+    output = configs.read(file)["outputs"]
     in_dict = False
     for entry in hit_outputs:
         if hit_outputs[entry]["fields"] == output:
@@ -2,88 +2,117 @@ import argparse
 import logging
 import os
 import pathlib
+import shutil
+import tempfile
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+
+setup_jit_cache()
 os.environ["LGDO_BOUNDSCHECK"] = "false"
 
 import numpy as np
 from daq2lh5.build_raw import build_raw
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
+from util.blinding import blind_raw_file, blinding_curves, default_chunk_rows
+from util.channel_index import ChannelIndex
+from util.metadata_cache import MetadataSnapshot
+from util.threads import job_threads
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument("input", help="input file", type=str)
-argparser.add_argument("output", help="output file", type=str)
+argparser.add_argument("output", help="output file", type=str, nargs="?", default=None)
 argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
 argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
 argparser.add_argument("--configs", help="config file", type=str)
 argparser.add_argument("--chan_maps", help="chan map", type=str)
+argparser.add_argument("--metadata", help="metadata", type=str)
+argparser.add_argument("--blind_output", help="blinded output file", type=str, default=None)
+argparser.add_argument("--blind_curve", help="blinding curves file", type=str, nargs="*")
 argparser.add_argument("--log", help="log file", type=str)
 args = argparser.parse_args()
 
 os.makedirs(os.path.dirname(args.log), exist_ok=True)
 logging.basicConfig(level=logging.INFO, filename=args.log, filemode="w")
 
-pathlib.Path(os.path.dirname(args.output)).mkdir(parents=True, exist_ok=True)
+for output in (args.output, args.blind_output):
+    if output is not None:
+        pathlib.Path(os.path.dirname(output)).mkdir(parents=True, exist_ok=True)
 
-configs = LegendMetadata(path=args.configs)
-channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]["tier_raw"][
-    "inputs"
-]
-settings = Props.read_from(channel_dict["settings"])
+configs = MetadataSnapshot.load(
+    args.timestamp, args.datatype, configs=args.configs, chan_maps=args.chan_maps
+)
+channel_dict = configs.config["snakemake_rules"]["tier_raw"]["inputs"]
+settings = configs.read(channel_dict["settings"])
 channel_dict = channel_dict["out_spec"]
-all_config = Props.read_from(channel_dict["gen_config"])
+all_config = configs.read(channel_dict["gen_config"])
 
-chmap = LegendMetadata(path=args.chan_maps)
+chan_index = ChannelIndex(configs.channelmap)
 
 if "geds_config" in list(channel_dict):
-    ged_config = Props.read_from(channel_dict["geds_config"])
-
-    ged_channels = list(
-        chmap.channelmaps.on(args.timestamp).map("system", unique=False)["geds"].map("daq.rawid")
-    )
-
-    ged_config[next(iter(ged_config))]["geds"]["key_list"] = sorted(ged_channels)
+    ged_config = configs.read(channel_dict["geds_config"])
+    ged_config[next(iter(ged_config))]["geds"]["key_list"] = chan_index.rawids("geds").tolist()
     Props.add_to(all_config, ged_config)
 
 if "spms_config" in list(channel_dict):
-    spm_config = Props.read_from(channel_dict["spms_config"])
-
-    spm_channels = list(
-        chmap.channelmaps.on(args.timestamp).map("system", unique=False)["spms"].map("daq.rawid")
-    )
-
-    spm_config[next(iter(spm_config))]["spms"]["key_list"] = sorted(spm_channels)
+    spm_config = configs.read(channel_dict["spms_config"])
+    spm_config[next(iter(spm_config))]["spms"]["key_list"] = chan_index.rawids("spms").tolist()
     Props.add_to(all_config, spm_config)
 
 if "auxs_config" in list(channel_dict):
-    aux_config = Props.read_from(channel_dict["auxs_config"])
-    aux_channels = list(
-        chmap.channelmaps.on(args.timestamp).map("system", unique=False)["auxs"].map("daq.rawid")
-    )
-    aux_channels += list(
-        chmap.channelmaps.on(args.timestamp).map("system", unique=False)["puls"].map("daq.rawid")
-    )
-    aux_channels += list(
-        chmap.channelmaps.on(args.timestamp).map("system", unique=False)["bsln"].map("daq.rawid")
-    )
+    aux_config = configs.read(channel_dict["auxs_config"])
     top_key = next(iter(aux_config))
-    aux_config[top_key][next(iter(aux_config[top_key]))]["key_list"] = sorted(aux_channels)
+    aux_config[top_key][next(iter(aux_config[top_key]))]["key_list"] = chan_index.rawids(
+        "auxs", "puls", "bsln"
+    ).tolist()
     Props.add_to(all_config, aux_config)
 
 if "muon_config" in list(channel_dict):
-    muon_config = Props.read_from(channel_dict["muon_config"])
-    muon_channels = list(
-        chmap.channelmaps.on(args.timestamp).map("system", unique=False)["muon"].map("daq.rawid")
-    )
+    muon_config = configs.read(channel_dict["muon_config"])
     top_key = next(iter(muon_config))
-    muon_config[top_key][next(iter(muon_config[top_key]))]["key_list"] = sorted(muon_channels)
+    muon_config[top_key][next(iter(muon_config[top_key]))]["key_list"] = chan_index.rawids(
+        "muon"
+    ).tolist()
     Props.add_to(all_config, muon_config)
 
 rng = np.random.default_rng()
 rand_num = f"{rng.integers(0,99999):05d}"
-temp_output = f"{args.output}.{rand_num}"
 
-build_raw(args.input, out_spec=all_config, filekey=temp_output, **settings)
+if args.blind_output is None:
+    temp_output = f"{args.output}.{rand_num}"
 
-os.rename(temp_output, args.output)
+    build_raw(args.input, out_spec=all_config, filekey=temp_output, **settings)
+
+    os.rename(temp_output, args.output)
+else:
+    # fused raw and blinding: the daq file is decoded once to the node's temporary
+    # directory and blinded from there, the raw file is only written to the output
+    # if asked for
+    blind_configs = MetadataSnapshot.load(
+        args.timestamp, args.datatype, configs=args.configs, metadata=args.metadata
+    )
+    blinding_settings = blind_configs.read(
+        blind_configs.config["snakemake_rules"]["tier_raw_blind"]["inputs"]["config"]
+    )
+    temp_blind_output = f"{args.blind_output}.{rand_num}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        raw_file = os.path.join(tmp_dir, os.path.basename(args.blind_output))
+        build_raw(args.input, out_spec=all_config, filekey=raw_file, **settings)
+
+        blind_raw_file(
+            raw_file,
+            temp_blind_output,
+            ChannelIndex(blind_configs.channelmap),
+            blinding_curves(args.blind_curve),
+            blinding_settings["centroid_in_keV"],
+            blinding_settings["width_in_keV"],
+            settings["hdf5_settings"],
+            blinding_settings.get("chunk_rows", default_chunk_rows),
+            n_processes=job_threads(),
+        )
+
+        if args.output is not None:
+            temp_output = f"{args.output}.{rand_num}"
+            shutil.move(raw_file, temp_output)
+            os.rename(temp_output, args.output)
+    os.rename(temp_blind_output, args.blind_output)
@@ -5,6 +5,10 @@ channels in a raw file, removing those events that fall within the ROI for Ge de
 that have a daqenergy calibration curve and are not anti-coincidence only (AC). It removes
 the whole event from all of the Ge and SiPM channels.
 
+The blinded channels are copied in chunks of rows so memory doesn't grow with the
+file, split between a process per thread of the job. The other objects are copied
+as they are without decoding them.
+
 In the Snakemake dataflow, this script only runs if the checkfile is found on disk,
 but this is controlled by the Snakemake flow (presumably an error is thrown if the file
 is not found). This script itself does not check for the existence of such a file.
@@ -15,14 +19,16 @@ import logging
 import os
 import pathlib
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+
+setup_jit_cache()
 os.environ["LGDO_BOUNDSCHECK"] = "false"
 
-import lgdo.lh5 as lh5
-import numexpr as ne
 import numpy as np
-from legendmeta import LegendMetadata
-from legendmeta.catalog import Props
+from util.blinding import blind_raw_file, blinding_curves, default_chunk_rows
+from util.channel_index import ChannelIndex
+from util.metadata_cache import MetadataSnapshot
+from util.threads import job_threads
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument("--input", help="input file", type=str)
@@ -44,130 +50,41 @@ logging.getLogger("lgdo").setLevel(logging.INFO)
 
 pathlib.Path(os.path.dirname(args.output)).mkdir(parents=True, exist_ok=True)
 
-configs = LegendMetadata(path=args.configs)
-channel_dict = configs.on(args.timestamp, system=args.datatype)
+configs = MetadataSnapshot.load(
+    args.timestamp, args.datatype, configs=args.configs, metadata=args.metadata
+)
+channel_dict = configs.config
 
-hdf_settings = Props.read_from(channel_dict["snakemake_rules"]["tier_raw"]["inputs"]["settings"])[
+hdf_settings = configs.read(channel_dict["snakemake_rules"]["tier_raw"]["inputs"]["settings"])[
     "hdf5_settings"
 ]
-blinding_settings = Props.read_from(
+blinding_settings = configs.read(
     channel_dict["snakemake_rules"]["tier_raw_blind"]["inputs"]["config"]
 )
 
 centroid = blinding_settings["centroid_in_keV"]  # keV
 width = blinding_settings["width_in_keV"]  # keV
 
-# list of all channels and objects in the raw file
-all_channels = lh5.ls(args.input)
-
-# list of Ge channels and SiPM channels with associated metadata
-legendmetadata = LegendMetadata(args.metadata)
-ged_channels = (
-    legendmetadata.channelmap(args.timestamp).map("system", unique=False)["geds"].map("daq.rawid")
-)
-spms_channels = (
-    legendmetadata.channelmap(args.timestamp).map("system", unique=False)["spms"].map("daq.rawid")
-)
-auxs_channels = (
-    legendmetadata.channelmap(args.timestamp).map("system", unique=False)["auxs"].map("daq.rawid")
-)
-blsn_channels = (
-    legendmetadata.channelmap(args.timestamp).map("system", unique=False)["bsln"].map("daq.rawid")
-)
-puls_channels = (
-    legendmetadata.channelmap(args.timestamp).map("system", unique=False)["puls"].map("daq.rawid")
-)
-
-store = lh5.LH5Store()
-
-# rows that need blinding
-toblind = np.array([])
-
-# first, loop through the Ge detector channels, calibrate them and look for events that should be blinded
-for chnum in list(ged_channels):
-    # skip Ge detectors that are anti-coincidence only or not able to be blinded for some other reason
-    if ged_channels[chnum]["analysis"]["is_blinded"] is False:
-        continue
-
-    # load in just the daqenergy for now
-    daqenergy, _ = store.read(f"ch{chnum}/raw/daqenergy", args.input)
-
-    # read in calibration curve for this channel
-    blind_curve = Props.read_from(args.blind_curve)[f"ch{chnum}"]["pars"]["operations"]
-
-    # calibrate daq energy using pre existing curve
-    daqenergy_cal = ne.evaluate(
-        blind_curve["daqenergy_cal"]["expression"],
-        local_dict=dict(daqenergy=daqenergy, **blind_curve["daqenergy_cal"]["parameters"]),
-    )
-
-    # figure out which event indices should be blinded
-    toblind = np.append(
-        toblind, np.nonzero(np.abs(np.asarray(daqenergy_cal) - centroid) <= width)[0]
-    )
-
-# remove duplicates
-toblind = np.unique(toblind)
-
-# total number of events (from last Ge channel loaded, should be same for all Ge channels)
-allind = np.arange(len(daqenergy))
-
-# gets events that should not be blinded
-tokeep = allind[np.logical_not(np.isin(allind, toblind))]
+# Ge channels, SiPM channels and the other systems blinded with them
+chan_index = ChannelIndex(configs.channelmap)
 
 # make some temp file to write the output to before renaming it
 rng = np.random.default_rng()
 rand_num = f"{rng.integers(0,99999):05d}"
 temp_output = f"{args.output}.{rand_num}"
 
-for channel in all_channels:
-    try:
-        chnum = int(channel[2::])
-    except ValueError:
-        # if this isn't an interesting channel, just copy it to the output file
-        chobj, _ = store.read(channel, args.input, decompress=False)
-        store.write_object(
-            chobj,
-            channel,
-            lh5_file=temp_output,
-            wo_mode="w",
-            **hdf_settings,
-        )
-        continue
-
-    if (
-        (chnum not in list(ged_channels))
-        and (chnum not in list(spms_channels))
-        and (chnum not in list(auxs_channels))
-        and (chnum not in list(blsn_channels))
-        and (chnum not in list(puls_channels))
-    ):
-        # if this is a PMT or not included for some reason, just copy it to the output file
-        chobj, _ = store.read(channel + "/raw", args.input, decompress=False)
-        store.write_object(
-            chobj,
-            group=channel,
-            name="raw",
-            lh5_file=temp_output,
-            wo_mode="w",
-            **hdf_settings,
-        )
-        continue
-
-    # the rest should be the Ge and SiPM channels that need to be blinded
-
-    # read in all of the data but only for the unblinded events
-    blinded_chobj, _ = store.read(channel + "/raw", args.input, idx=tokeep, decompress=False)
-
-    # now write the blinded data for this channel
-    store.write_object(
-        blinded_chobj,
-        group=channel,
-        name="raw",
-        lh5_file=temp_output,
-        wo_mode="w",
-        **hdf_settings,
-    )
+# copy only the unblinded events, a chunk at a time, in a process per thread of the job
+blind_raw_file(
+    args.input,
+    temp_output,
+    chan_index,
+    blinding_curves(args.blind_curve),
+    centroid,
+    width,
+    hdf_settings,
+    blinding_settings.get("chunk_rows", default_chunk_rows),
+    n_processes=job_threads(),
+)
 
 # rename the temp file
 os.rename(temp_output, args.output)
@@ -5,11 +5,10 @@ import pathlib
 
 import lgdo.lh5 as lh5
 import numpy as np
-from legendmeta import LegendMetadata
-from legendmeta.catalog import Props
 from lgdo.types import Table
 from pygama.skm.build_skm import build_skm
 from util.FileKey import ProcessingFileKey
+from util.metadata_cache import MetadataSnapshot
 
 sto = lh5.LH5Store()
 
@@ -71,17 +70,13 @@ logging.getLogger("h5py._conv").setLevel(logging.INFO)
 log = logging.getLogger(__name__)
 
 # load in config
-configs = LegendMetadata(path=args.configs)
-skm_config_file = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]["tier_skm"][
-    "inputs"
-]["skm_config"]
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
+skm_config_file = configs.config["snakemake_rules"]["tier_skm"]["inputs"]["skm_config"]
 
 if isinstance(skm_config_file, dict):
-    skm_config = {
-        key: Props.read_from(config_file) for key, config_file in skm_config_file.items()
-    }
+    skm_config = {key: configs.read(config_file) for key, config_file in skm_config_file.items()}
 else:
-    skm_config = {"all": Props.read_from(skm_config_file)}
+    skm_config = {"all": configs.read(skm_config_file)}
 
 if isinstance(args.hit_files, list) and args.hit_files[0].split(".")[-1] == "filelist":
     hit_files = args.hit_files[0]
@@ -2,13 +2,12 @@ import argparse
 import logging
 import os
 import pathlib
+import time
 
-import lgdo.lh5 as lh5
 import numpy as np
-from daq2lh5.orca import orca_flashcam
-from legendmeta import LegendMetadata
-from legendmeta.catalog import Props
 from pygama.evt.build_tcm import build_tcm
+from util.metadata_cache import MetadataSnapshot
+from util.tcm import build_fcid_tcms, fcid_channels
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument("input", help="input file", type=str)
@@ -16,39 +15,55 @@ argparser.add_argument("output", help="output file", type=str)
 argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
 argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
 argparser.add_argument("--configs", help="config file", type=str)
+argparser.add_argument(
+    "--mode",
+    help="read all channels once or build_tcm per fcid",
+    choices=["single_pass", "per_fcid"],
+    default="single_pass",
+)
 argparser.add_argument("--log", help="log file", type=str)
 args = argparser.parse_args()
 
 logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
+log = logging.getLogger(__name__)
 
 pathlib.Path(os.path.dirname(args.output)).mkdir(parents=True, exist_ok=True)
 
-configs = LegendMetadata(path=args.configs)
-channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]["tier_tcm"][
-    "inputs"
-]
-settings = Props.read_from(channel_dict["config"])
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
+channel_dict = configs.config["snakemake_rules"]["tier_tcm"]["inputs"]
+settings = configs.read(channel_dict["config"])
 
 rng = np.random.default_rng()
 rand_num = f"{rng.integers(0,99999):05d}"
 temp_output = f"{args.output}.{rand_num}"
 
-# get the list of channels by fcid
-ch_list = lh5.ls(args.input, "/ch*")
-fcid_channels = {}
-for ch in ch_list:
-    key = int(ch[2:])
-    fcid = orca_flashcam.get_fcid(key)
-    if fcid not in fcid_channels:
-        fcid_channels[fcid] = []
-    fcid_channels[fcid].append(f"/{ch}/raw")
-
-# make a hardware_tcm_[fcid] for each fcid
-for fcid in fcid_channels:
-    out_name = f"hardware_tcm_{fcid}"
-    ch_list = fcid_channels[fcid]
-    build_tcm(
-        [(args.input, ch_list)], out_file=temp_output, out_name=out_name, wo_mode="o", **settings
-    )
+t_start = time.time()
+if args.mode == "single_pass":
+    # make a hardware_tcm_[fcid] for each fcid from one read of the channels
+    stats = build_fcid_tcms(args.input, temp_output, **settings)
+    log.info(f"read all channels in {stats.pop('read_time'):.2f}s")
+    for fcid, fcid_stats in stats.items():
+        log.info(
+            f"hardware_tcm_{fcid}: {fcid_stats['n_channels']} channels, "
+            f"{fcid_stats['n_hits']} hits, {fcid_stats['n_events']} events, "
+            f"{fcid_stats['time']:.2f}s"
+        )
+else:
+    # make a hardware_tcm_[fcid] for each fcid
+    for fcid, ch_list in fcid_channels(args.input).items():
+        start = time.time()
+        out_name = f"hardware_tcm_{fcid}"
+        tcm = build_tcm(
+            [(args.input, ch_list)],
+            out_file=temp_output,
+            out_name=out_name,
+            wo_mode="o",
+            **settings,
+        )
+        log.info(
+            f"{out_name}: {len(ch_list)} channels, {len(tcm['array_id'])} hits, "
+            f"{len(tcm['cumulative_length'])} events, {time.time() - start:.2f}s"
+        )
+log.info(f"built tcm in {args.mode} mode in {time.time() - t_start:.2f}s")
 
 os.rename(temp_output, args.output)
@@ -10,6 +10,7 @@ from pathlib import Path
 import util.patterns as pat
 import util.utils as ut
 from util.CalibCatalog import Props
+from util.FileIndex import FileIndex
 from util.FileKey import FileKey
 
 
@@ -123,9 +124,11 @@ def get_keys(input_files):
         return f"{Filekey.experiment}-{Filekey.period}-{Filekey.run}-{Filekey.datatype}"
 
     files = glob.glob(input_files)
+    keys = FileKey.get_filekeys_from_pattern(
+        [os.path.basename(file) for file in files], pat.processing_pattern()
+    )
     key_dict = {}
-    for file in files:
-        key = FileKey.get_filekey_from_filename(os.path.basename(file))
+    for file, key in zip(files, keys):
         if get_run(key) in key_dict:
             key_dict[get_run(key)].append(file)
         else:
@@ -275,4 +278,9 @@ if snakemake.wildcards.tier != "daq":
 
     build_valid_keys(snakemake.params.tmp_par_path, snakemake.params.valid_keys_path)
 
+# the run added new tier files, refresh the file index so the next
+# workflow start doesn't have to rescan these directories
+with FileIndex(ut.file_index_path(setup)) as index:
+    index.update(pat.get_pattern_tier_raw(setup))
+
 pathlib.Path(snakemake.output.gen_output).touch()
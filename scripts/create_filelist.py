@@ -1,11 +1,12 @@
 # ruff: noqa: F821, T201
 
-import glob
 import json
 import os
 
+from util.FileIndex import FileIndex
 from util.FileKey import FileKey, run_grouper
 from util.patterns import get_pattern_tier, get_pattern_tier_raw_blind
+from util.utils import file_index_path
 
 setup = snakemake.params.setup
 
@@ -35,24 +36,6 @@ if snakemake.params.configs:
             analysis_runs = []
             print("no analysis_runs file found")
 
-key = FileKey.parse_keypart(keypart)
-
-item_list = []
-for item in key:
-    _item = item.split("_") if "_" in item else item
-    if isinstance(_item, list):
-        item_list.append(_item)
-    else:
-        item_list.append([_item])
-
-filekeys = []
-for i in item_list[0]:
-    for j in item_list[1]:
-        for k in item_list[2]:
-            for i2 in item_list[3]:
-                for j2 in item_list[4]:
-                    filekeys.append(FileKey(i, j, k, i2, j2))
-
 phy_filenames = []
 other_filenames = []
 if tier == "blind":
@@ -64,43 +47,39 @@ elif tier == "evt_concat":
 else:
     fn_pattern = get_pattern_tier(setup, tier, check_in_cycle=False)
 
-for key in filekeys:
-    fn_glob_pattern = key.get_path_from_filekey(search_pattern)[0]
-    files = glob.glob(fn_glob_pattern)
-    for f in files:
-        _key = FileKey.get_filekey_from_pattern(f, search_pattern)
-        if _key.name in ignore_keys:
-            pass
+with FileIndex(file_index_path(setup)) as index:
+    indexed_files = index.query(search_pattern, keypart)
+
+for _, _key in indexed_files:
+    if _key.name in ignore_keys:
+        pass
+    else:
+        if tier == "blind" and _key.datatype == "phy":
+            filename = FileKey.get_path_from_filekey(_key, get_pattern_tier_raw_blind(setup))
+        elif tier == "skm":  # and _key.datatype != "phy"
+            filename = FileKey.get_path_from_filekey(
+                _key, get_pattern_tier(setup, "pet", check_in_cycle=False)
+            )
         else:
-            if tier == "blind" and _key.datatype == "phy":
-                filename = FileKey.get_path_from_filekey(_key, get_pattern_tier_raw_blind(setup))
-            elif tier == "skm":  # and _key.datatype != "phy"
-                filename = FileKey.get_path_from_filekey(
-                    _key, get_pattern_tier(setup, "pet", check_in_cycle=False)
-                )
-            else:
-                filename = FileKey.get_path_from_filekey(_key, fn_pattern)
+            filename = FileKey.get_path_from_filekey(_key, fn_pattern)
 
-            if file_selection == "all":
+        if file_selection == "all":
+            if _key.datatype == "phy":
+                phy_filenames += filename
+            else:
+                other_filenames += filename
+        elif file_selection == "sel":
+            if analysis_runs == "all" or (
+                _key.period in analysis_runs
+                and (_key.run in analysis_runs[_key.period] or analysis_runs[_key.period] == "all")
+            ):
                 if _key.datatype == "phy":
                     phy_filenames += filename
                 else:
                     other_filenames += filename
-            elif file_selection == "sel":
-                if analysis_runs == "all" or (
-                    _key.period in analysis_runs
-                    and (
-                        _key.run in analysis_runs[_key.period]
-                        or analysis_runs[_key.period] == "all"
-                    )
-                ):
-                    if _key.datatype == "phy":
-                        phy_filenames += filename
-                    else:
-                        other_filenames += filename
-            else:
-                msg = "unknown file selection"
-                raise ValueError(msg)
+        else:
+            msg = "unknown file selection"
+            raise ValueError(msg)
 
 phy_filenames = sorted(phy_filenames)
 other_filenames = sorted(other_filenames)
@@ -4,9 +4,10 @@ import logging
 import os
 import pickle as pkl
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+
+setup_jit_cache()
 os.environ["LGDO_BOUNDSCHECK"] = "false"
-os.environ["DSPEED_CACHE"] = "false"
 os.environ["DSPEED_BOUNDSCHECK"] = "false"
 
 import lgdo.lh5 as lh5
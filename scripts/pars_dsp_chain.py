@@ -0,0 +1,203 @@
+"""
+Runs the dsp parameter generation of a channel (tau, event selection, nopt, dplms
+and eopt) in a single process. The stages share the loaded configs and the
+tables they read, in particular the events selected by the event selection are
+passed to dplms and eopt in memory. Every stage still writes its usual output
+files, with ``--keep_intermediates --resume`` a failed chain can be restarted
+from the stage which failed. Several channels can be given, see
+`util.stage_cache.run_channels`.
+"""
+
+import argparse
+
+import pars_dsp_dplms
+import pars_dsp_eopt
+import pars_dsp_event_selection
+import pars_dsp_nopt
+import pars_dsp_tau
+from util.stage_cache import run_chain, run_channels
+
+
+def main(argv=None, cache=None):
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--configs", help="configs path", type=str, required=True)
+    argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
+    argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
+    argparser.add_argument("--channel", help="Channel", type=str, required=True)
+
+    argparser.add_argument("--raw_filelist", help="raw filelist", type=str, required=True)
+    argparser.add_argument("--fft_raw_filelist", help="fft raw filelist", type=str, required=True)
+    argparser.add_argument("--pulser_file", help="pulser file", type=str, required=True)
+    argparser.add_argument("--raw_cal", help="raw_cal", type=str, nargs="*", required=True)
+
+    argparser.add_argument("--tau_log", help="tau log file", type=str)
+    argparser.add_argument("--event_selection_log", help="event selection log file", type=str)
+    argparser.add_argument("--nopt_log", help="nopt log file", type=str)
+    argparser.add_argument("--dplms_log", help="dplms log file", type=str)
+    argparser.add_argument("--eopt_log", help="eopt log file", type=str)
+
+    argparser.add_argument("--decay_const", help="tau pars", type=str, required=True)
+    argparser.add_argument("--decay_const_plots", help="tau plots", type=str, required=True)
+    argparser.add_argument(
+        "--peak_file", help="event selection peak file", type=str, required=True
+    )
+    argparser.add_argument("--nopt_pars", help="nopt pars", type=str, required=True)
+    argparser.add_argument("--nopt_plots", help="nopt plots", type=str, required=True)
+    argparser.add_argument("--dplms_pars", help="dplms pars", type=str, required=True)
+    argparser.add_argument("--dplms_lh5", help="dplms coefficients", type=str, required=True)
+    argparser.add_argument("--dplms_plots", help="dplms plots", type=str, required=True)
+    argparser.add_argument("--final_dsp_pars", help="eopt pars", type=str, required=True)
+    argparser.add_argument("--qbb_grid_path", help="eopt objects", type=str, required=True)
+    argparser.add_argument("--plot_path", help="eopt plots", type=str, required=True)
+
+    argparser.add_argument(
+        "--keep_intermediates",
+        help="keep the outputs of tau, event selection, nopt and dplms which only the chain uses",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--resume",
+        help="skip the stages whose outputs exist, they must come from the same inputs and configs",
+        action="store_true",
+    )
+    argparser.add_argument("--log", help="chain log file", type=str)
+    args = argparser.parse_args(argv)
+
+    common = [
+        "--configs",
+        args.configs,
+        "--datatype",
+        args.datatype,
+        "--timestamp",
+        args.timestamp,
+        "--channel",
+        args.channel,
+    ]
+
+    stages = [
+        (
+            "tau",
+            pars_dsp_tau,
+            [
+                *common,
+                "--log",
+                args.tau_log,
+                "--pulser_file",
+                args.pulser_file,
+                "--raw_files",
+                args.raw_filelist,
+                "--output_file",
+                args.decay_const,
+                "--plot_path",
+                args.decay_const_plots,
+            ],
+            [args.decay_const, args.decay_const_plots],
+        ),
+        (
+            "event_selection",
+            pars_dsp_event_selection,
+            [
+                *common,
+                "--log",
+                args.event_selection_log,
+                "--raw_filelist",
+                args.raw_filelist,
+                "--pulser_file",
+                args.pulser_file,
+                "--decay_const",
+                args.decay_const,
+                "--peak_file",
+                args.peak_file,
+                "--raw_cal",
+                *args.raw_cal,
+            ],
+            [args.peak_file],
+        ),
+        (
+            "nopt",
+            pars_dsp_nopt,
+            [
+                *common,
+                "--log",
+                args.nopt_log,
+                "--raw_filelist",
+                args.fft_raw_filelist,
+                "--database",
+                args.decay_const,
+                "--inplots",
+                args.decay_const_plots,
+                "--dsp_pars",
+                args.nopt_pars,
+                "--plot_path",
+                args.nopt_plots,
+            ],
+            [args.nopt_pars, args.nopt_plots],
+        ),
+        (
+            "dplms",
+            pars_dsp_dplms,
+            [
+                *common,
+                "--log",
+                args.dplms_log,
+                "--fft_raw_filelist",
+                args.fft_raw_filelist,
+                "--peak_file",
+                args.peak_file,
+                "--database",
+                args.nopt_pars,
+                "--inplots",
+                args.nopt_plots,
+                "--dsp_pars",
+                args.dplms_pars,
+                "--lh5_path",
+                args.dplms_lh5,
+                "--plot_path",
+                args.dplms_plots,
+            ],
+            [args.dplms_pars, args.dplms_lh5, args.dplms_plots],
+        ),
+        (
+            "eopt",
+            pars_dsp_eopt,
+            [
+                *common,
+                "--log",
+                args.eopt_log,
+                "--peak_file",
+                args.peak_file,
+                "--decay_const",
+                args.dplms_pars,
+                "--inplots",
+                args.dplms_plots,
+                "--final_dsp_pars",
+                args.final_dsp_pars,
+                "--qbb_grid_path",
+                args.qbb_grid_path,
+                "--plot_path",
+                args.plot_path,
+            ],
+            [args.final_dsp_pars, args.qbb_grid_path, args.plot_path],
+        ),
+    ]
+
+    run_chain(
+        stages,
+        intermediates=[
+            args.decay_const,
+            args.decay_const_plots,
+            args.peak_file,
+            args.nopt_pars,
+            args.nopt_plots,
+            args.dplms_pars,
+            args.dplms_plots,
+        ],
+        keep_intermediates=args.keep_intermediates,
+        resume=args.resume,
+        log_file=args.log,
+        cache=cache,
+    )
+
+
+if __name__ == "__main__":
+    run_channels(main)
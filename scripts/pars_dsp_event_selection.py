@@ -6,24 +6,27 @@ import pathlib
 import time
 import warnings
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+from util.threads import set_threads
+
+setup_jit_cache()
 os.environ["LGDO_BOUNDSCHECK"] = "false"
-os.environ["DSPEED_CACHE"] = "false"
 os.environ["DSPEED_BOUNDSCHECK"] = "false"
-os.environ["PYGAMA_PARALLEL"] = "false"
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 from bisect import bisect_left
 
 import lgdo
-import lgdo.lh5 as lh5
 import numpy as np
 import pygama.math.histogram as pgh
 import pygama.pargen.energy_cal as pgc
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
 from pygama.pargen.data_cleaning import generate_cuts, get_keys, get_tcm_pulser_ids
 from pygama.pargen.dsp_optimize import run_one_dsp
+from util.discharges import get_recovery_mask
+from util.pulser import load_pulser_mask
+from util.stage_cache import StageCache, run_channels
 
 warnings.filterwarnings(action="ignore", category=RuntimeWarning)
 
@@ -85,7 +88,7 @@ def get_out_data(
     return out_tbl, len(np.where(final_mask)[0])
 
 
-if __name__ == "__main__":
+def main(argv=None, cache=None):
     argparser = argparse.ArgumentParser()
     argparser.add_argument("--raw_filelist", help="raw_filelist", type=str)
     argparser.add_argument("--tcm_filelist", help="tcm_filelist", type=str, required=False)
@@ -102,9 +105,9 @@ if __name__ == "__main__":
     argparser.add_argument("--channel", help="Channel", type=str, required=True)
 
     argparser.add_argument("--peak_file", help="peak_file", type=str, required=True)
-    args = argparser.parse_args()
+    args = argparser.parse_args(argv)
 
-    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
+    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w", force=True)
     logging.getLogger("numba").setLevel(logging.INFO)
     logging.getLogger("parse").setLevel(logging.INFO)
     logging.getLogger("lgdo").setLevel(logging.INFO)
@@ -114,11 +117,12 @@ if __name__ == "__main__":
     logging.getLogger("dspeed.processing_chain").setLevel(logging.INFO)
 
     log = logging.getLogger(__name__)
-    sto = lh5.LH5Store()
+    if cache is None:
+        cache = StageCache()
+    sto = cache.sto
     t0 = time.time()
 
-    conf = LegendMetadata(path=args.configs)
-    configs = conf.on(args.timestamp, system=args.datatype)
+    configs = cache.config_on(args.configs, args.timestamp, args.datatype)
     dsp_config = configs["snakemake_rules"]["pars_dsp_peak_selection"]["inputs"][
         "processing_chain"
     ][args.channel]
@@ -135,22 +139,22 @@ if __name__ == "__main__":
         rng = np.random.default_rng()
         rand_num = f"{rng.integers(0,99999):05d}"
         temp_output = f"{args.peak_file}.{rand_num}"
+        # the selected events are also kept in memory for the following stages
+        cache.forget(f"{args.channel}/raw", args.peak_file)
 
         with open(args.raw_filelist) as f:
             files = f.read().splitlines()
         raw_files = sorted(files)
 
         if args.pulser_file:
-            with open(args.pulser_file) as f:
-                pulser_dict = json.load(f)
-            mask = np.array(pulser_dict["mask"])
+            mask = load_pulser_mask(args.pulser_file, args.channel)
 
         elif args.tcm_filelist:
             # get pulser mask from tcm files
             with open(args.tcm_filelist) as f:
                 tcm_files = f.read().splitlines()
             tcm_files = sorted(np.unique(tcm_files))
-            ids, mask = get_tcm_pulser_ids(
+            _ids, mask = get_tcm_pulser_ids(
                 tcm_files, args.channel, peak_dict["pulser_multiplicity_threshold"]
             )
         else:
@@ -174,19 +178,10 @@ if __name__ == "__main__":
         if lh5_path[-1] != "/":
             lh5_path += "/"
 
-        raw_fields = [field.replace(lh5_path, "") for field in lh5.ls(raw_files[0], lh5_path)]
-
-        tb = sto.read(lh5_path, raw_files, field_mask=["daqenergy", "t_sat_lo", "timestamp"])[0]
+        tb = cache.read(lh5_path, raw_files, field_mask=["daqenergy", "t_sat_lo", "timestamp"])[0]
 
         discharges = tb["t_sat_lo"].nda > 0
-        discharge_timestamps = np.where(tb["timestamp"].nda[discharges])[0]
-        is_recovering = np.full(len(tb), False, dtype=bool)
-        for tstamp in discharge_timestamps:
-            is_recovering = is_recovering | np.where(
-                (((tb["timestamp"].nda - tstamp) < 0.01) & ((tb["timestamp"].nda - tstamp) > 0)),
-                True,
-                False,
-            )
+        is_recovering = get_recovery_mask(tb["timestamp"].nda, discharges, window=0.01)
 
         for outname, info in raw_dict.items():
             outcol = tb.eval(info["expression"], info.get("parameters", None))
@@ -204,7 +199,7 @@ if __name__ == "__main__":
             masks[peak] = np.where(e_mask & (~is_recovering))[0]
             log.debug(f"{len(masks[peak])} events found in energy range for {peak}")
 
-        input_data = sto.read(f"{lh5_path}", raw_files, n_rows=10000, idx=np.where(~mask)[0])[0]
+        input_data = cache.read(f"{lh5_path}", raw_files, n_rows=10000, idx=np.where(~mask)[0])[0]
 
         if isinstance(dsp_config, str):
             dsp_config = Props.read_from(dsp_config)
@@ -334,6 +329,7 @@ if __name__ == "__main__":
                                 energy_param=energy_parameter,
                             )
                             sto.write(out_tbl, name=lh5_path, lh5_file=temp_output, wo_mode="a")
+                            cache.append(lh5_path, args.peak_file, out_tbl)
                             peak_dict["obj_buf"] = None
                             peak_dict["obj_buf_start"] = 0
                             peak_dict["n_events"] = n_wfs
@@ -359,6 +355,7 @@ if __name__ == "__main__":
                                 sto.write(
                                     out_tbl, name=lh5_path, lh5_file=temp_output, wo_mode="a"
                                 )
+                                cache.append(lh5_path, args.peak_file, out_tbl)
                                 peak_dict["obj_buf"] = None
                                 peak_dict["obj_buf_start"] = 0
                                 log.debug(f'found {peak_dict["n_events"]} events for {peak}')
@@ -371,3 +368,7 @@ if __name__ == "__main__":
 
     log.debug(f"event selection completed in {time.time()-t0} seconds")
     os.rename(temp_output, args.peak_file)
+
+
+if __name__ == "__main__":
+    run_channels(main)
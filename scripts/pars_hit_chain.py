@@ -0,0 +1,201 @@
+"""
+Runs the hit parameter generation of a channel (qc, energy calibration, A/E and
+LQ calibration) in a single process. The stages load their data with
+`StageCache.load_data`, so each dsp field is read once and kept in memory for the
+following stages, as are the pulser mask and the plot and calibration objects
+handed from one stage to the next. Every stage still
+writes its usual par, plot and object files, with ``--keep_intermediates --resume``
+a failed chain can be restarted from the stage which failed.
+Several channels can be given, see `util.stage_cache.run_channels`.
+"""
+
+import argparse
+
+import pars_hit_aoe
+import pars_hit_ecal
+import pars_hit_lq
+import pars_hit_qc
+from util.stage_cache import run_chain, run_channels
+
+
+def main(argv=None, cache=None):
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("--configs", help="configs path", type=str, required=True)
+    argparser.add_argument("--metadata", help="metadata path", type=str, required=True)
+    argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
+    argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
+    argparser.add_argument("--channel", help="Channel", type=str, required=True)
+
+    argparser.add_argument("--filelist", help="dsp filelist", type=str, required=True)
+    argparser.add_argument("--fft_files", help="fft dsp files", nargs="*", type=str, default=[])
+    argparser.add_argument("--pulser_file", help="pulser file", type=str, required=True)
+    argparser.add_argument("--ctc_dict", help="ctc_dict", nargs="*", required=True)
+
+    argparser.add_argument("--qc_log", help="qc log file", type=str)
+    argparser.add_argument("--ecal_log", help="energy calibration log file", type=str)
+    argparser.add_argument("--aoe_log", help="A/E calibration log file", type=str)
+    argparser.add_argument("--lq_log", help="LQ calibration log file", type=str)
+
+    argparser.add_argument("--qc_file", help="qc pars", type=str, required=True)
+    argparser.add_argument("--qc_plots", help="qc plots", type=str, required=True)
+    argparser.add_argument("--ecal_file", help="energy calibration pars", type=str, required=True)
+    argparser.add_argument(
+        "--ecal_results", help="energy calibration objects", type=str, required=True
+    )
+    argparser.add_argument(
+        "--ecal_plots", help="energy calibration plots", type=str, required=True
+    )
+    argparser.add_argument("--aoe_file", help="A/E calibration pars", type=str, required=True)
+    argparser.add_argument(
+        "--aoe_results", help="A/E calibration objects", type=str, required=True
+    )
+    argparser.add_argument("--aoe_plots", help="A/E calibration plots", type=str, required=True)
+    argparser.add_argument("--hit_pars", help="LQ calibration pars", type=str, required=True)
+    argparser.add_argument("--lq_results", help="LQ calibration objects", type=str, required=True)
+    argparser.add_argument("--plot_file", help="LQ calibration plots", type=str, required=True)
+
+    argparser.add_argument(
+        "--keep_intermediates",
+        help="keep the outputs of qc, energy and A/E calibration which only the chain uses",
+        action="store_true",
+    )
+    argparser.add_argument(
+        "--resume",
+        help="skip the stages whose outputs exist, they must come from the same inputs and configs",
+        action="store_true",
+    )
+    argparser.add_argument("--log", help="chain log file", type=str)
+    args = argparser.parse_args(argv)
+
+    # qc gets the files instead of the filelist, in the same order the other stages
+    # read them so the fields it loads are reused
+    with open(args.filelist) as f:
+        files = sorted(f.read().splitlines())
+
+    common = [
+        "--configs",
+        args.configs,
+        "--datatype",
+        args.datatype,
+        "--timestamp",
+        args.timestamp,
+        "--channel",
+        args.channel,
+        "--pulser_file",
+        args.pulser_file,
+    ]
+
+    stages = [
+        (
+            "qc",
+            pars_hit_qc,
+            [
+                *common,
+                "--log",
+                args.qc_log,
+                "--save_path",
+                args.qc_file,
+                "--plot_path",
+                args.qc_plots,
+                "--cal_files",
+                *files,
+                "--fft_files",
+                *args.fft_files,
+            ],
+            [args.qc_file, args.qc_plots],
+        ),
+        (
+            "ecal",
+            pars_hit_ecal,
+            [
+                *common,
+                "--log",
+                args.ecal_log,
+                "--metadata",
+                args.metadata,
+                "--in_hit_dict",
+                args.qc_file,
+                "--inplot_dict",
+                args.qc_plots,
+                "--save_path",
+                args.ecal_file,
+                "--results_path",
+                args.ecal_results,
+                "--plot_path",
+                args.ecal_plots,
+                "--ctc_dict",
+                *args.ctc_dict,
+                "--files",
+                args.filelist,
+            ],
+            [args.ecal_file, args.ecal_results, args.ecal_plots],
+        ),
+        (
+            "aoe",
+            pars_hit_aoe,
+            [
+                *common,
+                "--log",
+                args.aoe_log,
+                "--ecal_file",
+                args.ecal_file,
+                "--eres_file",
+                args.ecal_results,
+                "--inplots",
+                args.ecal_plots,
+                "--hit_pars",
+                args.aoe_file,
+                "--aoe_results",
+                args.aoe_results,
+                "--plot_file",
+                args.aoe_plots,
+                args.filelist,
+            ],
+            [args.aoe_file, args.aoe_results, args.aoe_plots],
+        ),
+        (
+            "lq",
+            pars_hit_lq,
+            [
+                *common,
+                "--log",
+                args.lq_log,
+                "--ecal_file",
+                args.aoe_file,
+                "--eres_file",
+                args.aoe_results,
+                "--inplots",
+                args.aoe_plots,
+                "--hit_pars",
+                args.hit_pars,
+                "--lq_results",
+                args.lq_results,
+                "--plot_file",
+                args.plot_file,
+                args.filelist,
+            ],
+            [args.hit_pars, args.lq_results, args.plot_file],
+        ),
+    ]
+
+    run_chain(
+        stages,
+        intermediates=[
+            args.qc_file,
+            args.qc_plots,
+            args.ecal_file,
+            args.ecal_results,
+            args.ecal_plots,
+            args.aoe_file,
+            args.aoe_results,
+            args.aoe_plots,
+        ],
+        keep_intermediates=args.keep_intermediates,
+        resume=args.resume,
+        log_file=args.log,
+        cache=cache,
+    )
+
+
+if __name__ == "__main__":
+    run_channels(main)
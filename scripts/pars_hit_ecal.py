@@ -6,11 +6,12 @@ import json
 import logging
 import os
 import pathlib
-import pickle as pkl
 import warnings
 from datetime import datetime
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads(parallel=True)
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import lgdo.lh5 as lh5
@@ -19,14 +20,13 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pygama.math.distributions as pgf
 import pygama.math.histogram as pgh
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
 from matplotlib.colors import LogNorm
 from pygama.math.distributions import nb_poly
 from pygama.pargen.data_cleaning import get_mode_stdev, get_tcm_pulser_ids
 from pygama.pargen.energy_cal import FWHMLinear, FWHMQuadratic, HPGeCalibration
-from pygama.pargen.utils import load_data
 from scipy.stats import binned_statistic
+from util.stage_cache import StageCache, run_channels
 
 log = logging.getLogger(__name__)
 mpl.use("agg")
@@ -418,7 +418,7 @@ def get_results_dict(ecal_class, data, cal_energy_param, selection_string):
         }
 
 
-if __name__ == "__main__":
+def main(argv=None, cache=None):
     argparser = argparse.ArgumentParser()
     argparser.add_argument("--files", help="filelist", nargs="*", type=str)
     argparser.add_argument("--tcm_filelist", help="tcm_filelist", type=str, required=False)
@@ -441,9 +441,9 @@ if __name__ == "__main__":
     argparser.add_argument("--plot_path", help="plot_path", type=str, required=False)
     argparser.add_argument("--save_path", help="save_path", type=str)
     argparser.add_argument("--results_path", help="results_path", type=str)
-    args = argparser.parse_args()
+    args = argparser.parse_args(argv)
 
-    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
+    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w", force=True)
     logging.getLogger("numba").setLevel(logging.INFO)
     logging.getLogger("parse").setLevel(logging.INFO)
     logging.getLogger("lgdo").setLevel(logging.INFO)
@@ -451,8 +451,9 @@ if __name__ == "__main__":
     logging.getLogger("matplotlib").setLevel(logging.INFO)
     logging.getLogger("legendmeta").setLevel(logging.INFO)
 
-    meta = LegendMetadata(path=args.metadata)
-    chmap = meta.channelmap(args.timestamp)
+    if cache is None:
+        cache = StageCache()
+    chmap = cache.channelmap(args.metadata, args.timestamp)
 
     det_status = chmap.map("daq.rawid")[int(args.channel[2:])]["analysis"]["usability"]
 
@@ -470,8 +471,7 @@ if __name__ == "__main__":
     hit_dict.update(database_dic[args.channel]["ctc_params"])
 
     # get metadata dictionary
-    configs = LegendMetadata(path=args.configs)
-    channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]
+    channel_dict = cache.config_on(args.configs, args.timestamp, args.datatype)["snakemake_rules"]
     if args.tier == "hit":
         channel_dict = channel_dict["pars_hit_ecal"]["inputs"]["ecal_config"][args.channel]
     elif args.tier == "pht":
@@ -496,7 +496,7 @@ if __name__ == "__main__":
     files = sorted(files)
 
     # load data in
-    data, threshold_mask = load_data(
+    data, threshold_mask = cache.load_data(
         files,
         f"{args.channel}/dsp",
         hit_dict,
@@ -507,16 +507,14 @@ if __name__ == "__main__":
     )
 
     if args.pulser_file:
-        with open(args.pulser_file) as f:
-            pulser_dict = json.load(f)
-        mask = np.array(pulser_dict["mask"])
+        mask = cache.pulser_mask(args.pulser_file, args.channel)
 
     elif args.tcm_filelist:
         # get pulser mask from tcm files
         with open(args.tcm_filelist) as f:
             tcm_files = f.read().splitlines()
         tcm_files = sorted(np.unique(tcm_files))
-        ids, mask = get_tcm_pulser_ids(
+        _ids, mask = get_tcm_pulser_ids(
             tcm_files, args.channel, kwarg_dict["pulser_multiplicity_threshold"]
         )
     else:
@@ -551,7 +549,7 @@ if __name__ == "__main__":
     for energy_param, cal_energy_param in zip(kwarg_dict["energy_params"], cal_energy_params):
         e_uncal = data.query(selection_string)[energy_param].to_numpy()
 
-        hist, bins, bar = pgh.get_hist(
+        hist, bins, _bar = pgh.get_hist(
             e_uncal[
                 (e_uncal > np.nanpercentile(e_uncal, 95))
                 & (e_uncal < np.nanpercentile(e_uncal, 99.9))
@@ -706,8 +704,7 @@ if __name__ == "__main__":
                 common_dict.update({key: param_dict})
 
         if args.inplot_dict:
-            with open(args.inplot_dict, "rb") as f:
-                total_plot_dict = pkl.load(f)
+            total_plot_dict = cache.read_pickle(args.inplot_dict)
         else:
             total_plot_dict = {}
 
@@ -719,8 +716,7 @@ if __name__ == "__main__":
         total_plot_dict.update({"ecal": plot_dict})
 
         pathlib.Path(os.path.dirname(args.plot_path)).mkdir(parents=True, exist_ok=True)
-        with open(args.plot_path, "wb") as f:
-            pkl.dump(total_plot_dict, f, protocol=pkl.HIGHEST_PROTOCOL)
+        cache.write_pickle(total_plot_dict, args.plot_path)
 
     # save output dictionary
     output_dict = {"pars": hit_dict, "results": {"ecal": results_dict}}
@@ -729,6 +725,9 @@ if __name__ == "__main__":
         json.dump(output_dict, fp, indent=4)
 
     # save calibration objects
-    with open(args.results_path, "wb") as fp:
-        pathlib.Path(os.path.dirname(args.results_path)).mkdir(parents=True, exist_ok=True)
-        pkl.dump({"ecal": full_object_dict}, fp, protocol=pkl.HIGHEST_PROTOCOL)
+    pathlib.Path(os.path.dirname(args.results_path)).mkdir(parents=True, exist_ok=True)
+    cache.write_pickle({"ecal": full_object_dict}, args.results_path)
+
+
+if __name__ == "__main__":
+    run_channels(main)
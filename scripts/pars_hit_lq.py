@@ -5,21 +5,21 @@ import json
 import logging
 import os
 import pathlib
-import pickle as pkl
 import warnings
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import numpy as np
 import pandas as pd
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
 from pygama.math.distributions import gaussian
 from pygama.pargen.data_cleaning import get_tcm_pulser_ids
 from pygama.pargen.lq_cal import *  # noqa: F403
 from pygama.pargen.lq_cal import LQCal
-from pygama.pargen.utils import load_data
+from util.stage_cache import StageCache, run_channels
 
 log = logging.getLogger(__name__)
 warnings.filterwarnings(action="ignore", category=RuntimeWarning)
@@ -121,162 +121,161 @@ def lq_calibration(
     return cal_dicts, get_results_dict(lq), fill_plot_dict(lq, data, plot_options), lq
 
 
-argparser = argparse.ArgumentParser()
-argparser.add_argument("files", help="files", nargs="*", type=str)
-argparser.add_argument("--pulser_file", help="pulser_file", type=str, required=False)
-argparser.add_argument("--tcm_filelist", help="tcm_filelist", type=str, required=False)
+def main(argv=None, cache=None):
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("files", help="files", nargs="*", type=str)
+    argparser.add_argument("--pulser_file", help="pulser_file", type=str, required=False)
+    argparser.add_argument("--tcm_filelist", help="tcm_filelist", type=str, required=False)
 
-argparser.add_argument("--ecal_file", help="ecal_file", type=str, required=True)
-argparser.add_argument("--eres_file", help="eres_file", type=str, required=True)
-argparser.add_argument("--inplots", help="in_plot_path", type=str, required=False)
+    argparser.add_argument("--ecal_file", help="ecal_file", type=str, required=True)
+    argparser.add_argument("--eres_file", help="eres_file", type=str, required=True)
+    argparser.add_argument("--inplots", help="in_plot_path", type=str, required=False)
 
-argparser.add_argument("--configs", help="configs", type=str, required=True)
-argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
-argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
-argparser.add_argument("--channel", help="Channel", type=str, required=True)
+    argparser.add_argument("--configs", help="configs", type=str, required=True)
+    argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
+    argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
+    argparser.add_argument("--channel", help="Channel", type=str, required=True)
 
-argparser.add_argument("--log", help="log_file", type=str)
+    argparser.add_argument("--log", help="log_file", type=str)
 
-argparser.add_argument("--plot_file", help="plot_file", type=str, required=False)
-argparser.add_argument("--hit_pars", help="hit_pars", type=str)
-argparser.add_argument("--lq_results", help="lq_results", type=str)
-args = argparser.parse_args()
+    argparser.add_argument("--plot_file", help="plot_file", type=str, required=False)
+    argparser.add_argument("--hit_pars", help="hit_pars", type=str)
+    argparser.add_argument("--lq_results", help="lq_results", type=str)
+    args = argparser.parse_args(argv)
 
-logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
-logging.getLogger("numba").setLevel(logging.INFO)
-logging.getLogger("parse").setLevel(logging.INFO)
-logging.getLogger("lgdo").setLevel(logging.INFO)
-logging.getLogger("h5py").setLevel(logging.INFO)
-logging.getLogger("matplotlib").setLevel(logging.INFO)
+    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w", force=True)
+    logging.getLogger("numba").setLevel(logging.INFO)
+    logging.getLogger("parse").setLevel(logging.INFO)
+    logging.getLogger("lgdo").setLevel(logging.INFO)
+    logging.getLogger("h5py").setLevel(logging.INFO)
+    logging.getLogger("matplotlib").setLevel(logging.INFO)
 
-configs = LegendMetadata(path=args.configs)
-channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"][
-    "pars_hit_lqcal"
-]["inputs"]["lqcal_config"][args.channel]
+    if cache is None:
+        cache = StageCache()
+    channel_dict = cache.config_on(args.configs, args.timestamp, args.datatype)["snakemake_rules"][
+        "pars_hit_lqcal"
+    ]["inputs"]["lqcal_config"][args.channel]
 
-kwarg_dict = Props.read_from(channel_dict)
+    kwarg_dict = Props.read_from(channel_dict)
 
-ecal_dict = Props.read_from(args.ecal_file)
-cal_dict = ecal_dict["pars"]["operations"]
-eres_dict = ecal_dict["results"]["ecal"]
+    ecal_dict = Props.read_from(args.ecal_file)
+    cal_dict = ecal_dict["pars"]["operations"]
+    eres_dict = ecal_dict["results"]["ecal"]
 
-with open(args.eres_file, "rb") as o:
-    object_dict = pkl.load(o)
+    object_dict = cache.read_pickle(args.eres_file)
 
-if kwarg_dict["run_lq"] is True:
-    kwarg_dict.pop("run_lq")
+    if kwarg_dict["run_lq"] is True:
+        kwarg_dict.pop("run_lq")
 
-    cdf = eval(kwarg_dict.pop("cdf")) if "cdf" in kwarg_dict else gaussian
+        cdf = eval(kwarg_dict.pop("cdf")) if "cdf" in kwarg_dict else gaussian
 
-    if "plot_options" in kwarg_dict:
-        for field, item in kwarg_dict["plot_options"].items():
-            kwarg_dict["plot_options"][field]["function"] = eval(item["function"])
+        if "plot_options" in kwarg_dict:
+            for field, item in kwarg_dict["plot_options"].items():
+                kwarg_dict["plot_options"][field]["function"] = eval(item["function"])
 
-    with open(args.files[0]) as f:
-        files = f.read().splitlines()
-    files = sorted(files)
+        with open(args.files[0]) as f:
+            files = f.read().splitlines()
+        files = sorted(files)
 
-    try:
-        eres = eres_dict[kwarg_dict["cal_energy_param"]]["eres_linear"].copy()
+        try:
+            eres = eres_dict[kwarg_dict["cal_energy_param"]]["eres_linear"].copy()
 
-        def eres_func(x):
-            return eval(eres["expression"], dict(x=x, **eres["parameters"]))
+            def eres_func(x):
+                return eval(eres["expression"], dict(x=x, **eres["parameters"]))
 
-    except KeyError:
+        except KeyError:
 
-        def eres_func(x):
-            return x * np.nan
+            def eres_func(x):
+                return x * np.nan
 
-    params = [
-        "lq80",
-        "dt_eff",
-        kwarg_dict["energy_param"],
-        kwarg_dict["cal_energy_param"],
-        kwarg_dict["cut_field"],
-    ]
+        params = [
+            "lq80",
+            "dt_eff",
+            kwarg_dict["energy_param"],
+            kwarg_dict["cal_energy_param"],
+            kwarg_dict["cut_field"],
+        ]
 
-    # load data in
-    data, threshold_mask = load_data(
-        files,
-        f"{args.channel}/dsp",
-        cal_dict,
-        params=params,
-        threshold=kwarg_dict.pop("threshold"),
-        return_selection_mask=True,
-    )
+        # load data in
+        data, threshold_mask = cache.load_data(
+            files,
+            f"{args.channel}/dsp",
+            cal_dict,
+            params=params,
+            threshold=kwarg_dict.pop("threshold"),
+            return_selection_mask=True,
+        )
 
-    if args.pulser_file:
-        with open(args.pulser_file) as f:
-            pulser_dict = json.load(f)
-        mask = np.array(pulser_dict["mask"])
-        if "pulser_multiplicity_threshold" in kwarg_dict:
-            kwarg_dict.pop("pulser_multiplicity_threshold")
-
-    elif args.tcm_filelist:
-        # get pulser mask from tcm files
-        with open(args.tcm_filelist) as f:
-            tcm_files = f.read().splitlines()
-        tcm_files = sorted(np.unique(tcm_files))
-        ids, mask = get_tcm_pulser_ids(
-            tcm_files, args.channel, kwarg_dict.pop("pulser_multiplicity_threshold")
+        if args.pulser_file:
+            mask = cache.pulser_mask(args.pulser_file, args.channel)
+            if "pulser_multiplicity_threshold" in kwarg_dict:
+                kwarg_dict.pop("pulser_multiplicity_threshold")
+
+        elif args.tcm_filelist:
+            # get pulser mask from tcm files
+            with open(args.tcm_filelist) as f:
+                tcm_files = f.read().splitlines()
+            tcm_files = sorted(np.unique(tcm_files))
+            _ids, mask = get_tcm_pulser_ids(
+                tcm_files, args.channel, kwarg_dict.pop("pulser_multiplicity_threshold")
+            )
+        else:
+            msg = "No pulser file or tcm filelist provided"
+            raise ValueError(msg)
+
+        data["is_pulser"] = mask[threshold_mask]
+
+        cal_dict, out_dict, plot_dict, obj = lq_calibration(
+            data,
+            selection_string=f"{kwarg_dict.pop('cut_field')}&(~is_pulser)",
+            cal_dicts=cal_dict,
+            eres_func=eres_func,
+            cdf=cdf,
+            **kwarg_dict,
         )
-    else:
-        msg = "No pulser file or tcm filelist provided"
-        raise ValueError(msg)
-
-    data["is_pulser"] = mask[threshold_mask]
-
-    cal_dict, out_dict, plot_dict, obj = lq_calibration(
-        data,
-        selection_string=f"{kwarg_dict.pop('cut_field')}&(~is_pulser)",
-        cal_dicts=cal_dict,
-        eres_func=eres_func,
-        cdf=cdf,
-        **kwarg_dict,
-    )
 
-    # need to change eres func as can't pickle lambdas
-    try:
-        obj.eres_func = eres_dict[kwarg_dict["cal_energy_param"]]["eres_linear"].copy()
-    except KeyError:
-        obj.eres_func = {}
-else:
-    out_dict = {}
-    plot_dict = {}
-    obj = None
-
-if args.plot_file:
-    common_dict = plot_dict.pop("common") if "common" in list(plot_dict) else None
-    if args.inplots:
-        with open(args.inplots, "rb") as r:
-            out_plot_dict = pkl.load(r)
-        out_plot_dict.update({"lq": plot_dict})
+        # need to change eres func as can't pickle lambdas
+        try:
+            obj.eres_func = eres_dict[kwarg_dict["cal_energy_param"]]["eres_linear"].copy()
+        except KeyError:
+            obj.eres_func = {}
     else:
-        out_plot_dict = {"lq": plot_dict}
-
-    if "common" in list(out_plot_dict) and common_dict is not None:
-        out_plot_dict["common"].update(common_dict)
-    elif common_dict is not None:
-        out_plot_dict["common"] = common_dict
+        out_dict = {}
+        plot_dict = {}
+        obj = None
+
+    if args.plot_file:
+        common_dict = plot_dict.pop("common") if "common" in list(plot_dict) else None
+        if args.inplots:
+            out_plot_dict = cache.read_pickle(args.inplots)
+            out_plot_dict.update({"lq": plot_dict})
+        else:
+            out_plot_dict = {"lq": plot_dict}
+
+        if "common" in list(out_plot_dict) and common_dict is not None:
+            out_plot_dict["common"].update(common_dict)
+        elif common_dict is not None:
+            out_plot_dict["common"] = common_dict
+
+        pathlib.Path(os.path.dirname(args.plot_file)).mkdir(parents=True, exist_ok=True)
+        cache.write_pickle(out_plot_dict, args.plot_file)
+
+    results_dict = dict(**eres_dict, lq=out_dict)
+    pathlib.Path(os.path.dirname(args.hit_pars)).mkdir(parents=True, exist_ok=True)
+    with open(args.hit_pars, "w") as w:
+        final_hit_dict = {
+            "pars": {"operations": cal_dict},
+            "results": results_dict,
+        }
+        json.dump(final_hit_dict, w, indent=4)
 
-    pathlib.Path(os.path.dirname(args.plot_file)).mkdir(parents=True, exist_ok=True)
-    with open(args.plot_file, "wb") as w:
-        pkl.dump(out_plot_dict, w, protocol=pkl.HIGHEST_PROTOCOL)
+    pathlib.Path(os.path.dirname(args.lq_results)).mkdir(parents=True, exist_ok=True)
+    final_object_dict = dict(
+        **object_dict,
+        lq=obj,
+    )
+    cache.write_pickle(final_object_dict, args.lq_results)
 
 
-results_dict = dict(**eres_dict, lq=out_dict)
-pathlib.Path(os.path.dirname(args.hit_pars)).mkdir(parents=True, exist_ok=True)
-with open(args.hit_pars, "w") as w:
-    final_hit_dict = {
-        "pars": {"operations": cal_dict},
-        "results": results_dict,
-    }
-    json.dump(final_hit_dict, w, indent=4)
-
-pathlib.Path(os.path.dirname(args.lq_results)).mkdir(parents=True, exist_ok=True)
-final_object_dict = dict(
-    **object_dict,
-    lq=obj,
-)
-with open(args.lq_results, "wb") as w:
-    pkl.dump(final_object_dict, w, protocol=pkl.HIGHEST_PROTOCOL)
+if __name__ == "__main__":
+    run_channels(main)
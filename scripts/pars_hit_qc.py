@@ -5,15 +5,15 @@ import json
 import logging
 import os
 import pathlib
-import pickle as pkl
 import re
 import warnings
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import numpy as np
-from legendmeta import LegendMetadata
 from legendmeta.catalog import Props
 from lgdo.lh5 import ls
 from pygama.pargen.data_cleaning import (
@@ -21,14 +21,15 @@ from pygama.pargen.data_cleaning import (
     get_keys,
     get_tcm_pulser_ids,
 )
-from pygama.pargen.utils import load_data
+from util.discharges import get_recovery_mask
+from util.stage_cache import StageCache, run_channels
 
 log = logging.getLogger(__name__)
 
 warnings.filterwarnings(action="ignore", category=RuntimeWarning)
 
 
-if __name__ == "__main__":
+def main(argv=None, cache=None):
     argparser = argparse.ArgumentParser()
     argparser.add_argument("--cal_files", help="cal_files", nargs="*", type=str)
     argparser.add_argument("--fft_files", help="fft_files", nargs="*", type=str)
@@ -45,9 +46,9 @@ if __name__ == "__main__":
 
     argparser.add_argument("--plot_path", help="plot_path", type=str, required=False)
     argparser.add_argument("--save_path", help="save_path", type=str)
-    args = argparser.parse_args()
+    args = argparser.parse_args(argv)
 
-    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
+    logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w", force=True)
     logging.getLogger("numba").setLevel(logging.INFO)
     logging.getLogger("parse").setLevel(logging.INFO)
     logging.getLogger("lgdo").setLevel(logging.INFO)
@@ -56,8 +57,9 @@ if __name__ == "__main__":
     logging.getLogger("legendmeta").setLevel(logging.INFO)
 
     # get metadata dictionary
-    configs = LegendMetadata(path=args.configs)
-    channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"]
+    if cache is None:
+        cache = StageCache()
+    channel_dict = cache.config_on(args.configs, args.timestamp, args.datatype)["snakemake_rules"]
     channel_dict = channel_dict["pars_hit_qc"]["inputs"]["qc_config"][args.channel]
 
     kwarg_dict = Props.read_from(channel_dict)
@@ -72,7 +74,7 @@ if __name__ == "__main__":
             kwarg_dict_fft["cut_parameters"],
         )
 
-        fft_data = load_data(
+        fft_data = cache.load_data(
             args.fft_files,
             f"{args.channel}/dsp",
             {},
@@ -80,17 +82,7 @@ if __name__ == "__main__":
         )
 
         discharges = fft_data["t_sat_lo"] > 0
-        discharge_timestamps = np.where(fft_data["timestamp"][discharges])[0]
-        is_recovering = np.full(len(fft_data), False, dtype=bool)
-        for tstamp in discharge_timestamps:
-            is_recovering = is_recovering | np.where(
-                (
-                    ((fft_data["timestamp"] - tstamp) < 0.01)
-                    & ((fft_data["timestamp"] - tstamp) > 0)
-                ),
-                True,
-                False,
-            )
+        is_recovering = get_recovery_mask(fft_data["timestamp"], discharges, window=0.01)
         fft_data["is_recovering"] = is_recovering
 
         hit_dict_fft = {}
@@ -147,7 +139,7 @@ if __name__ == "__main__":
         )
 
     # load data in
-    data, threshold_mask = load_data(
+    data, threshold_mask = cache.load_data(
         args.cal_files,
         f"{args.channel}/dsp",
         {},
@@ -158,16 +150,14 @@ if __name__ == "__main__":
     )
 
     if args.pulser_file:
-        with open(args.pulser_file) as f:
-            pulser_dict = json.load(f)
-        mask = np.array(pulser_dict["mask"])
+        mask = cache.pulser_mask(args.pulser_file, args.channel)
 
     elif args.tcm_filelist:
         # get pulser mask from tcm files
         with open(args.tcm_filelist) as f:
             tcm_files = f.read().splitlines()
         tcm_files = sorted(np.unique(tcm_files))
-        ids, mask = get_tcm_pulser_ids(
+        _ids, mask = get_tcm_pulser_ids(
             tcm_files, args.channel, kwarg_dict["pulser_multiplicity_threshold"]
         )
     else:
@@ -177,14 +167,7 @@ if __name__ == "__main__":
     data["is_pulser"] = mask[threshold_mask]
 
     discharges = data["t_sat_lo"] > 0
-    discharge_timestamps = np.where(data["timestamp"][discharges])[0]
-    is_recovering = np.full(len(data), False, dtype=bool)
-    for tstamp in discharge_timestamps:
-        is_recovering = is_recovering | np.where(
-            (((data["timestamp"] - tstamp) < 0.01) & ((data["timestamp"] - tstamp) > 0)),
-            True,
-            False,
-        )
+    is_recovering = get_recovery_mask(data["timestamp"], discharges, window=0.01)
     data["is_recovering"] = is_recovering
 
     rng = np.random.default_rng()
@@ -236,5 +219,8 @@ if __name__ == "__main__":
 
     if args.plot_path:
         pathlib.Path(os.path.dirname(args.plot_path)).mkdir(parents=True, exist_ok=True)
-        with open(args.plot_path, "wb") as f:
-            pkl.dump({"qc": plot_dict}, f, protocol=pkl.HIGHEST_PROTOCOL)
+        cache.write_pickle({"qc": plot_dict}, args.plot_path)
+
+
+if __name__ == "__main__":
+    run_channels(main)
@@ -10,7 +10,9 @@ import pickle as pkl
 import warnings
 from typing import Callable
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import numpy as np
@@ -21,7 +23,8 @@ from pygama.pargen.AoE_cal import *  # noqa: F403
 from pygama.pargen.AoE_cal import CalAoE, Pol1, SigmaFit, aoe_peak
 from pygama.pargen.data_cleaning import get_tcm_pulser_ids
 from pygama.pargen.utils import load_data
-from util.FileKey import ChannelProcKey, ProcessingFileKey
+from util.FileKey import ChannelProcKey, ProcessingFileKey, run_splitter
+from util.pulser import load_pulser_mask
 
 log = logging.getLogger(__name__)
 warnings.filterwarnings(action="ignore", category=RuntimeWarning)
@@ -136,24 +139,6 @@ logging.getLogger("matplotlib").setLevel(logging.INFO)
 logging.getLogger("legendmeta").setLevel(logging.INFO)
 
 
-def run_splitter(files):
-    """
-    Returns list containing lists of each run
-    """
-
-    runs = []
-    run_files = []
-    for file in files:
-        fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(file))
-        if f"{fk.period}-{fk.run}" not in runs:
-            runs.append(f"{fk.period}-{fk.run}")
-            run_files.append([])
-        for i, run in enumerate(runs):
-            if run == f"{fk.period}-{fk.run}":
-                run_files[i].append(file)
-    return run_files
-
-
 configs = LegendMetadata(path=args.configs)
 channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"][
     "pars_pht_aoecal"
@@ -262,12 +247,7 @@ if kwarg_dict.pop("run_aoe") is True:
     )
 
     if args.pulser_files:
-        mask = np.array([], dtype=bool)
-        for file in args.pulser_files:
-            with open(file) as f:
-                pulser_dict = json.load(f)
-            pulser_mask = np.array(pulser_dict["mask"])
-            mask = np.append(mask, pulser_mask)
+        mask = load_pulser_mask(args.pulser_files, args.channel)
         if "pulser_multiplicity_threshold" in kwarg_dict:
             kwarg_dict.pop("pulser_multiplicity_threshold")
 
@@ -8,7 +8,9 @@ import pathlib
 import pickle as pkl
 import warnings
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import numpy as np
@@ -20,7 +22,8 @@ from pygama.pargen.data_cleaning import get_tcm_pulser_ids
 from pygama.pargen.lq_cal import *  # noqa: F403
 from pygama.pargen.lq_cal import LQCal
 from pygama.pargen.utils import load_data
-from util.FileKey import ChannelProcKey, ProcessingFileKey
+from util.FileKey import ChannelProcKey, ProcessingFileKey, run_splitter
+from util.pulser import load_pulser_mask
 
 log = logging.getLogger(__name__)
 warnings.filterwarnings(action="ignore", category=RuntimeWarning)
@@ -150,24 +153,6 @@ logging.getLogger("matplotlib").setLevel(logging.INFO)
 logging.getLogger("legendmeta").setLevel(logging.INFO)
 
 
-def run_splitter(files):
-    """
-    Returns list containing lists of each run
-    """
-
-    runs = []
-    run_files = []
-    for file in files:
-        fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(file))
-        if f"{fk.period}-{fk.run}" not in runs:
-            runs.append(f"{fk.period}-{fk.run}")
-            run_files.append([])
-        for i, run in enumerate(runs):
-            if run == f"{fk.period}-{fk.run}":
-                run_files[i].append(file)
-    return run_files
-
-
 configs = LegendMetadata(path=args.configs)
 channel_dict = configs.on(args.timestamp, system=args.datatype)["snakemake_rules"][
     "pars_pht_lqcal"
@@ -265,12 +250,7 @@ if kwarg_dict.pop("run_lq") is True:
     )
 
     if args.pulser_files:
-        mask = np.array([], dtype=bool)
-        for file in args.pulser_files:
-            with open(file) as f:
-                pulser_dict = json.load(f)
-            pulser_mask = np.array(pulser_dict["mask"])
-            mask = np.append(mask, pulser_mask)
+        mask = load_pulser_mask(args.pulser_files, args.channel)
         if "pulser_multiplicity_threshold" in kwarg_dict:
             kwarg_dict.pop("pulser_multiplicity_threshold")
 
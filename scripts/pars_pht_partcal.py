@@ -10,7 +10,9 @@ import pickle as pkl
 import re
 import warnings
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads(parallel=True)
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import numpy as np
@@ -23,30 +25,13 @@ from pygama.math.distributions import nb_poly
 from pygama.pargen.data_cleaning import get_tcm_pulser_ids
 from pygama.pargen.energy_cal import FWHMLinear, FWHMQuadratic, HPGeCalibration
 from pygama.pargen.utils import load_data
-from util.FileKey import ChannelProcKey, ProcessingFileKey
+from util.FileKey import ChannelProcKey, ProcessingFileKey, run_splitter
+from util.pulser import load_pulser_mask
 
 log = logging.getLogger(__name__)
 warnings.filterwarnings(action="ignore", category=RuntimeWarning)
 
 
-def run_splitter(files):
-    """
-    Returns list containing lists of each run
-    """
-
-    runs = []
-    run_files = []
-    for file in files:
-        fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(file))
-        if f"{fk.period}-{fk.run}" not in runs:
-            runs.append(f"{fk.period}-{fk.run}")
-            run_files.append([])
-        for i, run in enumerate(runs):
-            if run == f"{fk.period}-{fk.run}":
-                run_files[i].append(file)
-    return run_files
-
-
 def update_cal_dicts(cal_dicts, update_dict):
     if re.match(r"(\d{8})T(\d{6})Z", next(iter(cal_dicts))):
         for tstamp in cal_dicts:
@@ -264,12 +249,7 @@ if __name__ == "__main__":
     )
 
     if args.pulser_files:
-        mask = np.array([], dtype=bool)
-        for file in args.pulser_files:
-            with open(file) as f:
-                pulser_dict = json.load(f)
-            pulser_mask = np.array(pulser_dict["mask"])
-            mask = np.append(mask, pulser_mask)
+        mask = load_pulser_mask(args.pulser_files, args.channel)
         if "pulser_multiplicity_threshold" in kwarg_dict:
             kwarg_dict.pop("pulser_multiplicity_threshold")
 
@@ -9,7 +9,9 @@ import pickle as pkl
 import re
 import warnings
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import numpy as np
@@ -22,6 +24,8 @@ from pygama.pargen.data_cleaning import (
     get_tcm_pulser_ids,
 )
 from pygama.pargen.utils import load_data
+from util.discharges import get_recovery_mask
+from util.pulser import load_pulser_mask
 
 log = logging.getLogger(__name__)
 
@@ -125,17 +129,7 @@ if __name__ == "__main__":
             )
 
             discharges = fft_data["t_sat_lo"] > 0
-            discharge_timestamps = np.where(fft_data["timestamp"][discharges])[0]
-            is_recovering = np.full(len(fft_data), False, dtype=bool)
-            for tstamp in discharge_timestamps:
-                is_recovering = is_recovering | np.where(
-                    (
-                        ((fft_data["timestamp"] - tstamp) < 0.01)
-                        & ((fft_data["timestamp"] - tstamp) > 0)
-                    ),
-                    True,
-                    False,
-                )
+            is_recovering = get_recovery_mask(fft_data["timestamp"], discharges, window=0.01)
             fft_data["is_recovering"] = is_recovering
 
             hit_dict_fft = {}
@@ -212,12 +206,7 @@ if __name__ == "__main__":
     )
 
     if args.pulser_files:
-        total_mask = np.array([], dtype=bool)
-        for file in args.pulser_files:
-            with open(file) as f:
-                pulser_dict = json.load(f)
-            pulser_mask = np.array(pulser_dict["mask"])
-            total_mask = np.append(total_mask, pulser_mask)
+        total_mask = load_pulser_mask(args.pulser_files, args.channel)
         if "pulser_multiplicity_threshold" in kwarg_dict:
             kwarg_dict.pop("pulser_multiplicity_threshold")
 
@@ -236,14 +225,7 @@ if __name__ == "__main__":
     data["is_pulser"] = total_mask[threshold_mask]
 
     discharges = data["t_sat_lo"] > 0
-    discharge_timestamps = np.where(data["timestamp"][discharges])[0]
-    is_recovering = np.full(len(data), False, dtype=bool)
-    for tstamp in discharge_timestamps:
-        is_recovering = is_recovering | np.where(
-            (((data["timestamp"] - tstamp) < 0.01) & ((data["timestamp"] - tstamp) > 0)),
-            True,
-            False,
-        )
+    is_recovering = get_recovery_mask(data["timestamp"], discharges, window=0.01)
     data["is_recovering"] = is_recovering
 
     rng = np.random.default_rng()
@@ -9,7 +9,9 @@ import pickle as pkl
 import re
 import warnings
 
-os.environ["PYGAMA_PARALLEL"] = "false"
+from util.threads import set_threads
+
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import lgdo.lh5 as lh5
@@ -21,6 +23,7 @@ from pygama.pargen.data_cleaning import (
     generate_cut_classifiers,
     get_keys,
 )
+from util.discharges import get_recovery_mask
 
 log = logging.getLogger(__name__)
 
@@ -107,17 +110,10 @@ if __name__ == "__main__":
     )[0].view_as("pd")
 
     discharges = data["t_sat_lo"] > 0
-    discharge_timestamps = np.where(data["timestamp"][discharges])[0]
-    is_recovering = np.full(len(data), False, dtype=bool)
-    for tstamp in discharge_timestamps:
-        is_recovering = is_recovering | np.where(
-            (((data["timestamp"] - tstamp) < 0.01) & ((data["timestamp"] - tstamp) > 0)),
-            True,
-            False,
-        )
+    is_recovering = get_recovery_mask(data["timestamp"], discharges, window=0.01)
     data["is_recovering"] = is_recovering
 
-    log.debug(f"{len(discharge_timestamps)} discharges found in {len(data)} events")
+    log.debug(f"{discharges.sum()} discharges found in {len(data)} events")
 
     hit_dict = {}
     plot_dict = {}
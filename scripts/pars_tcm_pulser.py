@@ -1,19 +1,21 @@
 import argparse
-import json
 import logging
 import os
 import pathlib
+import time
 
-os.environ["LGDO_CACHE"] = "false"
+from util.jit_cache import setup_jit_cache
+from util.threads import set_threads
+
+setup_jit_cache()
 os.environ["LGDO_BOUNDSCHECK"] = "false"
-os.environ["PYGAMA_PARALLEL"] = "false"
+set_threads()
 os.environ["PYGAMA_FASTMATH"] = "false"
 
 import lgdo.lh5 as lh5
 import numpy as np
-from legendmeta import LegendMetadata
-from legendmeta.catalog import Props
-from pygama.pargen.data_cleaning import get_tcm_pulser_ids
+from util.metadata_cache import MetadataSnapshot
+from util.pulser import concat_pulser_masks, get_pulser_masks, write_pulser_masks
 
 argparser = argparse.ArgumentParser()
 argparser.add_argument("--configs", help="configs path", type=str, required=True)
@@ -21,7 +23,6 @@ argparser.add_argument("--log", help="log file", type=str)
 
 argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
 argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
-argparser.add_argument("--channel", help="Channel", type=str, required=True)
 
 argparser.add_argument("--pulser_file", help="pulser file", type=str, required=False)
 
@@ -39,11 +40,10 @@ logging.getLogger("legendmeta").setLevel(logging.INFO)
 sto = lh5.LH5Store()
 log = logging.getLogger(__name__)
 
-configs = LegendMetadata(path=args.configs)
-config_dict = configs.on(args.timestamp, system=args.datatype)
-kwarg_dict = config_dict["snakemake_rules"]["pars_tcm_pulser"]["inputs"]["pulser_config"]
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
+kwarg_dict = configs.config["snakemake_rules"]["pars_tcm_pulser"]["inputs"]["pulser_config"]
 
-kwarg_dict = Props.read_from(kwarg_dict)
+kwarg_dict = configs.read(kwarg_dict)
 
 if isinstance(args.tcm_files, list) and args.tcm_files[0].split(".")[-1] == "filelist":
     tcm_files = args.tcm_files[0]
@@ -51,12 +51,21 @@ if isinstance(args.tcm_files, list) and args.tcm_files[0].split(".")[-1] == "fil
         tcm_files = f.read().splitlines()
 else:
     tcm_files = args.tcm_files
-# get pulser mask from tcm files
+# get pulser masks of all channels from tcm files, reading each file once
 tcm_files = sorted(np.unique(tcm_files))
-ids, mask = get_tcm_pulser_ids(
-    tcm_files, args.channel, kwarg_dict.pop("pulser_multiplicity_threshold")
+threshold = kwarg_dict.pop("pulser_multiplicity_threshold")
+start = time.time()
+masks_list = []
+for tcm_file in tcm_files:
+    array_id = sto.read("hardware_tcm_1/array_id", tcm_file)[0].view_as("np")
+    array_idx = sto.read("hardware_tcm_1/array_idx", tcm_file)[0].view_as("np")
+    cumulative_length = sto.read("hardware_tcm_1/cumulative_length", tcm_file)[0].view_as("np")
+    masks_list.append(get_pulser_masks(array_id, array_idx, cumulative_length, threshold))
+masks = concat_pulser_masks(masks_list)
+log.debug(
+    f"pulser masks of {len(masks)} channels from {len(tcm_files)} tcm files "
+    f"built in {time.time() - start:.2f}s"
 )
 
 pathlib.Path(os.path.dirname(args.pulser_file)).mkdir(parents=True, exist_ok=True)
-with open(args.pulser_file, "w") as f:
-    json.dump({"idxs": ids.tolist(), "mask": mask.tolist()}, f, indent=4)
+write_pulser_masks(masks, args.pulser_file)
@@ -0,0 +1,170 @@
+"""
+Tunes the ``buffer_len`` and ``block_width`` build_dsp uses for a datatype (see
+`util.dsp_settings`). build_dsp is run on the first rows of a raw file of the run
+for each pair of the grid, each in a forked process so the peak RSS of the pairs
+can be compared, and the pair with the highest throughput (within --max_rss if
+given, the pair with the lowest peak RSS if none is) is written to the section of
+the datatype in the dsp settings file. The file is the ``dsp_settings`` input of
+``tier_dsp`` in the configs, e.g.
+
+    python scripts/tune_dsp.py --configs ... --datatype phy --timestamp ... \
+        --pars_file ... --input raw.lh5 --output dsp_settings.json
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import resource
+import tempfile
+import time
+import warnings
+from multiprocessing import get_context
+
+from util.jit_cache import setup_jit_cache
+from util.threads import set_threads
+
+setup_jit_cache()
+set_threads(parallel=True)
+os.environ["LGDO_BOUNDSCHECK"] = "false"
+os.environ["DSPEED_BOUNDSCHECK"] = "false"
+
+import lgdo.lh5 as lh5
+import numpy as np
+from dspeed import build_dsp
+from legendmeta.catalog import Props
+from util.dsp_settings import best_trial, default_settings, write_dsp_settings
+from util.metadata_cache import MetadataSnapshot
+
+
+def replace_list_with_array(dic):
+    # as in build_dsp.py so the kernels are compiled for the same dtypes
+    for key, value in dic.items():
+        if isinstance(value, dict):
+            dic[key] = replace_list_with_array(value)
+        elif isinstance(value, list):
+            dic[key] = np.array(value, dtype="float32")
+    return dic
+
+
+warnings.filterwarnings(action="ignore", category=RuntimeWarning)
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--configs", help="configs path", type=str, required=True)
+argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
+argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
+argparser.add_argument("--pars_file", help="dsp pars", nargs="*", default=[])
+argparser.add_argument("--log", help="log file", type=str)
+argparser.add_argument("--input", help="raw file", type=str, required=True)
+argparser.add_argument("--n_rows", help="rows processed per channel", type=int, default=10000)
+argparser.add_argument(
+    "--buffer_len", help="buffer lengths", nargs="*", type=int, default=[800, 1600, 3200, 6400]
+)
+argparser.add_argument(
+    "--block_width", help="block widths", nargs="*", type=int, default=[8, 16, 32, 64]
+)
+argparser.add_argument("--max_rss", help="peak RSS limit in MB", type=float, default=None)
+argparser.add_argument("--output", help="dsp settings file", type=str, required=True)
+args = argparser.parse_args()
+
+if args.log is not None:
+    pathlib.Path(os.path.dirname(args.log)).mkdir(parents=True, exist_ok=True)
+logging.basicConfig(level=logging.INFO, filename=args.log, filemode="w")
+logging.getLogger("numba").setLevel(logging.INFO)
+logging.getLogger("parse").setLevel(logging.INFO)
+logging.getLogger("lgdo").setLevel(logging.INFO)
+log = logging.getLogger(__name__)
+
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
+channel_dict = configs.config["snakemake_rules"]["tier_dsp"]["inputs"]["processing_chain"]
+channel_dict = {chan: configs.read(file) for chan, file in channel_dict.items()}
+
+database_dic = Props.read_from(
+    [file for file in args.pars_file if os.path.splitext(file)[1] in (".json", ".yml")],
+    subst_pathvar=True,
+)
+database_dic = replace_list_with_array(database_dic)
+
+store = lh5.LH5Store()
+raw_channels = lh5.ls(args.input)
+n_wfs = sum(
+    min(args.n_rows, store.read_n_rows(f"{channel.split('/')[0]}/raw", args.input))
+    for channel in channel_dict
+    if channel.split("/")[0] in raw_channels
+)
+
+
+def run_dsp(out_file, buffer_len, block_width, n_max):
+    build_dsp(
+        args.input,
+        out_file,
+        {},
+        database=database_dic,
+        chan_config=channel_dict,
+        write_mode="r",
+        buffer_len=buffer_len,
+        block_width=block_width,
+        n_max=n_max,
+    )
+
+
+def run_trial(conn, out_file, buffer_len, block_width):
+    start = time.time()
+    run_dsp(out_file, buffer_len, block_width, args.n_rows)
+    # ru_maxrss is in kB on linux
+    conn.send((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    conn.close()
+
+
+trials = []
+with tempfile.TemporaryDirectory() as tmp_dir:
+    # compile the kernels before forking, so the trials don't include it
+    run_dsp(os.path.join(tmp_dir, "warm_up.lh5"), **default_settings, n_max=args.n_rows // 10 + 1)
+
+    ctx = get_context("fork")
+    for buffer_len in args.buffer_len:
+        for block_width in args.block_width:
+            if block_width > buffer_len:
+                continue
+            out_file = os.path.join(tmp_dir, f"dsp_{buffer_len}_{block_width}.lh5")
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            proc = ctx.Process(
+                target=run_trial, args=(child_conn, out_file, buffer_len, block_width)
+            )
+            proc.start()
+            child_conn.close()
+            try:
+                elapsed, peak_rss = parent_conn.recv()
+            except EOFError:
+                log.warning(f"buffer_len {buffer_len} block_width {block_width} failed")
+                continue
+            finally:
+                proc.join()
+                if os.path.isfile(out_file):
+                    os.remove(out_file)
+            trials.append(
+                {
+                    "buffer_len": buffer_len,
+                    "block_width": block_width,
+                    "time": elapsed,
+                    "throughput": n_wfs / elapsed,
+                    "peak_rss": peak_rss,
+                }
+            )
+            log.info(
+                f"buffer_len {buffer_len:>6} block_width {block_width:>4}: "
+                f"{n_wfs / elapsed:.0f} wf/s, peak RSS {peak_rss:.0f} MB"
+            )
+
+if len(trials) == 0:
+    msg = "no trial finished"
+    raise RuntimeError(msg)
+
+best = best_trial(trials, args.max_rss)
+if args.max_rss is not None and best["peak_rss"] > args.max_rss:
+    log.warning(f"no trial within {args.max_rss} MB, taking the one with the lowest peak RSS")
+log.info(
+    f"best for {args.datatype}: buffer_len {best['buffer_len']} "
+    f"block_width {best['block_width']}"
+)
+write_dsp_settings(args.output, args.datatype, best, trials)
@@ -18,15 +18,20 @@
 This module stores the scripts for leading validity files based on timestamp and system
 """
 
-import bisect
 import collections
 import copy
 import json
+import os
 import types
 from collections import namedtuple
 from pathlib import Path
 
-from .utils import unix_time
+import numpy as np
+
+from .utils import unix_time_array
+
+# catalogs read in this process, keyed by absolute path
+_catalog_cache = {}
 
 
 class Props:
@@ -81,32 +86,61 @@ class PropsStream:
                 yield json.loads(json_str)
 
 
-class CalibCatalog(namedtuple("CalibCatalog", ["entries"])):
+class CalibCatalog(namedtuple("CalibCatalog", ["entries", "valid_from"])):
     __slots__ = ()
 
     class Entry(namedtuple("Entry", ["valid_from", "file"])):
         __slots__ = ()
 
+    def __new__(cls, entries, valid_from=None):
+        if valid_from is None:
+            valid_from = {
+                system: np.array([entry.valid_from for entry in entries[system]], dtype=np.int64)
+                for system in entries
+            }
+        return super().__new__(cls, entries, valid_from)
+
     @staticmethod
     def read_from(file_name):
         entries = {}
 
-        for props in PropsStream.get(file_name):
-            timestamp = props["valid_from"]
+        props_list = list(PropsStream.get(file_name))
+        timestamps = unix_time_array([props["valid_from"] for props in props_list])
+        for props, timestamp in zip(props_list, timestamps):
             system = "all" if props.get("category") is None else props["category"]
             file_key = props["apply"]
             if system not in entries:
                 entries[system] = []
-            entries[system].append(CalibCatalog.Entry(unix_time(timestamp), file_key))
+            entries[system].append(CalibCatalog.Entry(int(timestamp), file_key))
 
         for system in entries:
             entries[system] = sorted(entries[system], key=lambda entry: entry.valid_from)
         return CalibCatalog(entries)
 
+    @staticmethod
+    def read_cached(file_name):
+        """
+        Returns the catalog for `file_name`, only re-reading the file if its
+        mtime or size changed since the last call in this process.
+        """
+        path = os.path.abspath(file_name)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = _catalog_cache.get(path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, CalibCatalog.read_from(path))
+            _catalog_cache[path] = cached
+        return cached[1]
+
+    @staticmethod
+    def clear_cache():
+        _catalog_cache.clear()
+
     def calib_for(self, timestamp, category="all", allow_none=False):
         if category in self.entries:
-            valid_from = [entry.valid_from for entry in self.entries[category]]
-            pos = bisect.bisect_right(valid_from, unix_time(timestamp))
+            pos = np.searchsorted(
+                self.valid_from[category], unix_time_array([timestamp])[0], side="right"
+            )
             if pos > 0:
                 return self.entries[category][pos - 1].file
             else:
@@ -122,7 +156,37 @@ class CalibCatalog(namedtuple("CalibCatalog", ["entries"])):
                 msg = f"No calibrations found for category: {category}"
                 raise RuntimeError(msg)
 
+    def calib_for_many(self, timestamps, category="all", allow_none=False):
+        """
+        Resolves many timestamps at once with a single ``np.searchsorted``.
+
+        Returns a list of ``(file, idxs)`` tuples, one per validity interval
+        that is hit, where `file` is the catalog entry valid in that interval
+        (None before the first entry if `allow_none`) and `idxs` are the
+        positions in `timestamps` that fall into it.
+        """
+        if category not in self.entries:
+            if allow_none:
+                return [(None, np.arange(len(timestamps)))]
+            msg = f"No calibrations found for category: {category}"
+            raise RuntimeError(msg)
+        pos = np.searchsorted(self.valid_from[category], unix_time_array(timestamps), side="right")
+        if not allow_none and np.any(pos == 0):
+            msg = (
+                "No valid calibration found for timestamps: "
+                f"{list(np.asarray(timestamps)[pos == 0])}, category: {category}"
+            )
+            raise RuntimeError(msg)
+        order = np.argsort(pos, kind="stable")
+        groups, starts = np.unique(pos[order], return_index=True)
+        return [
+            (None if group == 0 else self.entries[category][group - 1].file, idxs)
+            for group, idxs in zip(groups, np.split(order, starts[1:]))
+        ]
+
     @staticmethod
     def get_calib_files(catalog_file, timestamp, category="all"):
-        catalog = CalibCatalog.read_from(catalog_file)
-        return CalibCatalog.calib_for(catalog, timestamp, category)
+        catalog = CalibCatalog.read_cached(catalog_file)
+        files = CalibCatalog.calib_for(catalog, timestamp, category)
+        # copy so callers can't modify the cached entries
+        return copy.copy(files)
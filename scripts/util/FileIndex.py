@@ -0,0 +1,202 @@
+"""
+This module contains a persistent SQLite index of the files on disk matching the tier patterns,
+so file discovery doesn't need to glob the whole tree on every workflow start
+"""
+
+import fnmatch
+import glob
+import os
+import sqlite3
+
+from .FileKey import FileKey
+from .patterns import compile_pattern
+
+
+class FileIndex:
+    """
+    Index of the files matching a search pattern, e.g. `get_pattern_tier_raw`.
+
+    For each pattern the directories part is globbed (which only lists directories)
+    and only the directories whose mtime changed since the last update are listed
+    again, so adding a run only costs a scan of that run directory. For every file
+    the key fields, tier, size and mtime are stored.
+
+    Rewriting a file in place doesn't change the mtime of its directory, so its
+    size and mtime are only refreshed by updates with `check_files`, which stat
+    the indexed files of the unchanged directories as well. The keys and paths
+    don't depend on the content of the files.
+    """
+
+    key_fields = FileKey._fields
+
+    def __init__(self, index_file):
+        os.makedirs(os.path.dirname(os.path.abspath(index_file)), exist_ok=True)
+        self.index_file = index_file
+        self.connection = sqlite3.connect(index_file, timeout=60)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS dirs (
+                pattern TEXT, path TEXT, mtime_ns INTEGER, PRIMARY KEY (pattern, path)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                pattern TEXT, path TEXT, dir TEXT,
+                experiment TEXT, period TEXT, run TEXT, datatype TEXT, timestamp TEXT,
+                tier TEXT, size INTEGER, mtime_ns INTEGER,
+                PRIMARY KEY (pattern, path)
+            );
+            CREATE INDEX IF NOT EXISTS files_keys
+                ON files (pattern, datatype, period, run, experiment);
+            CREATE INDEX IF NOT EXISTS files_dir ON files (pattern, dir);
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _selection(keypart):
+        """
+        Returns dict of the allowed values of each key field in `keypart`,
+        values can be "_" separated lists as for the filelists.
+        """
+        if keypart is None:
+            return {}
+        key = FileKey.parse_keypart(keypart) if isinstance(keypart, str) else keypart
+        return {
+            field: value.split("_")
+            for field, value in key._asdict().items()
+            if value != "*" and "*" not in value
+        }
+
+    @staticmethod
+    def get_tier(filename):
+        """tier of a file from its name e.g. raw for ...-tier_raw.lh5, daq for .orca files"""
+        name, ext = os.path.splitext(os.path.basename(filename))
+        step = name.split("-")[-1]
+        if step.startswith("tier_"):
+            return step[len("tier_") :]
+        elif ext == ".orca":
+            return "daq"
+        return ext.lstrip(".")
+
+    def _scan_dir(self, pattern, parser, path):
+        rows = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                d = parser.parse(entry.path)
+                if d is None:
+                    continue
+                stat = entry.stat()
+                rows.append(
+                    (
+                        pattern,
+                        entry.path,
+                        path,
+                        *[d.get(field, "*") for field in self.key_fields],
+                        self.get_tier(entry.name),
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                    )
+                )
+        self.connection.execute("DELETE FROM files WHERE pattern=? AND dir=?", (pattern, path))
+        self.connection.executemany(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        return len(rows)
+
+    def _files_changed(self, pattern, path):
+        """True if a file indexed in the directory `path` was removed or rewritten."""
+        for file, size, mtime_ns in self.connection.execute(
+            "SELECT path, size, mtime_ns FROM files WHERE pattern=? AND dir=?", (pattern, path)
+        ):
+            try:
+                stat = os.stat(file)
+            except FileNotFoundError:
+                return True
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return True
+        return False
+
+    def update(self, pattern, keypart=None, check_files=False):
+        """
+        Rescans the directories of `pattern`, restricted to `keypart`, which are
+        new or whose mtime changed and drops the ones which disappeared. With
+        `check_files` the directories with a file whose size or mtime changed
+        are rescanned too. Returns the number of directories scanned.
+        """
+        dir_pattern = compile_pattern(os.path.dirname(pattern))
+        selection = self._selection(keypart)
+        dir_glob = dir_pattern.format(
+            **{
+                field: (
+                    selection[field][0]
+                    if field in selection and len(selection[field]) == 1
+                    else "*"
+                )
+                for field in dir_pattern.fields
+            }
+        )
+        dir_parser = dir_pattern.regex
+        parser = compile_pattern(pattern)
+
+        known = dict(
+            self.connection.execute(
+                "SELECT path, mtime_ns FROM dirs WHERE pattern=?", (pattern,)
+            ).fetchall()
+        )
+        found = set()
+        n_scanned = 0
+        with self.connection:
+            for path in glob.glob(dir_glob):
+                if not os.path.isdir(path) or dir_parser.match(path) is None:
+                    continue
+                found.add(path)
+                mtime_ns = os.stat(path).st_mtime_ns
+                if known.get(path) == mtime_ns and not (
+                    check_files and self._files_changed(pattern, path)
+                ):
+                    continue
+                self._scan_dir(pattern, parser, path)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (pattern, path, mtime_ns)
+                )
+                n_scanned += 1
+            for path in known:
+                if path not in found and fnmatch.fnmatchcase(path, dir_glob):
+                    self.connection.execute(
+                        "DELETE FROM files WHERE pattern=? AND dir=?", (pattern, path)
+                    )
+                    self.connection.execute(
+                        "DELETE FROM dirs WHERE pattern=? AND path=?", (pattern, path)
+                    )
+        return n_scanned
+
+    def query(self, pattern, keypart=None, update=True):
+        """
+        Returns sorted list of ``(path, FileKey)`` tuples of the indexed files
+        matching `pattern` and `keypart`, updating the index first by default.
+        """
+        if update:
+            self.update(pattern, keypart)
+        conditions = ["pattern=?"]
+        values = [pattern]
+        for field, allowed in self._selection(keypart).items():
+            conditions.append(f"{field} IN ({', '.join('?' * len(allowed))})")
+            values += allowed
+        rows = self.connection.execute(
+            f"SELECT path, {', '.join(self.key_fields)} FROM files "
+            f"WHERE {' AND '.join(conditions)} ORDER BY path",
+            values,
+        ).fetchall()
+        return [(row[0], FileKey(*row[1:])) for row in rows]
+
+    def get_keys(self, pattern, keypart=None, update=True):
+        return [key for _, key in self.query(pattern, keypart, update)]
@@ -2,13 +2,13 @@
 This module contains classes to convert between keys and files using the patterns defined in patterns.py
 """
 
-import os
 import re
 from collections import namedtuple
 
-import snakemake as smk
-
+from .KeyTable import KeyTable
 from .patterns import (
+    compile_pattern,
+    expand,
     full_channel_pattern_with_extension,
     get_pattern_tier,
     key_pattern,
@@ -52,20 +52,29 @@ class FileKey(namedtuple("FileKey", ["experiment", "period", "run", "datatype",
     @classmethod
     def get_filekey_from_pattern(cls, filename, pattern=None):
         if pattern is None:
-            key_pattern_rx = re.compile(smk.io.regex(cls.key_pattern))
-        else:
-            key_pattern_rx = re.compile(smk.io.regex(pattern))
-        if key_pattern_rx.match(filename) is None:
+            pattern = cls.key_pattern
+        d = compile_pattern(pattern).parse(filename)
+        if d is None:
             return None
         else:
-            d = key_pattern_rx.match(filename).groupdict()
-            for entry in list(d):
-                if entry not in cls._fields:
-                    d.pop(entry)
-            for wildcard in cls._fields:
-                if wildcard not in d:
-                    d[wildcard] = "*"
-            return cls(**d)
+            return cls._from_wildcards(d)
+
+    @classmethod
+    def get_filekeys_from_pattern(cls, filenames, pattern=None):
+        """
+        Parses a list of filenames in one go, entries which don't match
+        the pattern are None.
+        """
+        if pattern is None:
+            pattern = cls.key_pattern
+        return [
+            None if d is None else cls._from_wildcards(d)
+            for d in compile_pattern(pattern).parse_many(filenames)
+        ]
+
+    @classmethod
+    def _from_wildcards(cls, d):
+        return cls(**{wildcard: d.get(wildcard, "*") for wildcard in cls._fields})
 
     @classmethod
     def unix_time_from_string(cls, value):
@@ -86,7 +95,7 @@ class FileKey(namedtuple("FileKey", ["experiment", "period", "run", "datatype",
 
     def get_path_from_filekey(self, pattern, **kwargs):
         if kwargs is None:
-            return smk.io.expand(pattern, **self._asdict())
+            return expand(pattern, **self._asdict())
         else:
             for entry, value in kwargs.items():
                 if isinstance(value, dict):
@@ -94,7 +103,7 @@ class FileKey(namedtuple("FileKey", ["experiment", "period", "run", "datatype",
                         kwargs[entry] = value[next(iter(set(value).intersection(self._list())))]
                     else:
                         kwargs.pop(entry)
-            return smk.io.expand(pattern, **self._asdict(), **kwargs)
+            return expand(pattern, **self._asdict(), **kwargs)
 
     # get_path_from_key
     @classmethod
@@ -159,7 +168,7 @@ class ProcessingFileKey(FileKey):
         if not isinstance(pattern, str):
             pattern = pattern(self.tier, self.identifier)
         if kwargs is None:
-            return smk.io.expand(pattern, **self._asdict())
+            return expand(pattern, **self._asdict())
         else:
             for entry, value in kwargs.items():
                 if isinstance(value, dict):
@@ -167,7 +176,7 @@ class ProcessingFileKey(FileKey):
                         kwargs[entry] = value[next(iter(set(value).intersection(self._list())))]
                     else:
                         kwargs.pop(entry)
-            return smk.io.expand(pattern, **self._asdict(), **kwargs)
+            return expand(pattern, **self._asdict(), **kwargs)
 
 
 class ChannelProcKey(FileKey):
@@ -196,41 +205,32 @@ class ChannelProcKey(FileKey):
         for chan in chan_list:
             wildcards_dict = d._asdict()
             wildcards_dict.pop("channel")
-            file = smk.io.expand(par_pattern, **wildcards_dict, channel=chan)[0]
+            file = expand(par_pattern, **wildcards_dict, channel=chan)[0]
             filenames.append(file)
         return filenames
 
 
 def per_grouper(files):
     """
-    Returns list containing lists of each run
+    Returns list containing lists of each period
     """
-
-    pers = []
-    per_files = []
-    for file in files:
-        fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(file))
-        if f"{fk.experiment}-{fk.period}" not in pers:
-            pers.append(f"{fk.experiment}-{fk.period}")
-            per_files.append([])
-        for i, run in enumerate(pers):
-            if run == f"{fk.experiment}-{fk.period}":
-                per_files[i].append(file)
-    return per_files
+    table = KeyTable.from_files(files)
+    return [[files[i] for i in idxs] for idxs in table.group_indices("experiment", "period")]
 
 
 def run_grouper(files):
     """
     Returns list containing lists of each run
     """
-    runs = []
-    run_files = []
-    for file in files:
-        fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(file))
-        if f"{fk.experiment}-{fk.period}-{fk.run}" not in runs:
-            runs.append(f"{fk.experiment}-{fk.period}-{fk.run}")
-            run_files.append([])
-        for i, run in enumerate(runs):
-            if run == f"{fk.experiment}-{fk.period}-{fk.run}":
-                run_files[i].append(file)
-    return run_files
+    table = KeyTable.from_files(files)
+    return [
+        [files[i] for i in idxs] for idxs in table.group_indices("experiment", "period", "run")
+    ]
+
+
+def run_splitter(files):
+    """
+    Returns list containing lists of each run, runs are identified by period and run
+    """
+    table = KeyTable.from_files(files)
+    return [[files[i] for i in idxs] for idxs in table.group_indices("period", "run")]
@@ -0,0 +1,163 @@
+"""
+This module contains a columnar table of file keys for working with large key and file lists
+"""
+
+import os
+
+import numpy as np
+
+from .patterns import compile_pattern, processing_pattern
+from .utils import unix_time_array
+
+
+class KeyTable:
+    """
+    File keys stored in a NumPy structured array. Experiment, period, run and
+    datatype are stored as integer codes into sorted category arrays, so sorting
+    by codes is the same as sorting by name, and timestamps as int64 unix times.
+    The ``row`` column holds the position of each key in the list the table
+    was built from, so results can be mapped back to the original files.
+    """
+
+    categorical = ("experiment", "period", "run", "datatype")
+    dtype = np.dtype(
+        [
+            ("experiment", np.int32),
+            ("period", np.int32),
+            ("run", np.int32),
+            ("datatype", np.int32),
+            ("timestamp", np.int64),
+            ("row", np.int64),
+        ]
+    )
+
+    def __init__(self, data, categories):
+        self.data = data
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.data)
+
+    @classmethod
+    def from_columns(cls, experiment, period, run, datatype, timestamp):
+        data = np.zeros(len(timestamp), dtype=cls.dtype)
+        categories = {}
+        for name, values in zip(cls.categorical, [experiment, period, run, datatype]):
+            categories[name], data[name] = np.unique(
+                np.asarray(values, dtype=str), return_inverse=True
+            )
+        data["timestamp"] = unix_time_array(timestamp)
+        data["row"] = np.arange(len(data))
+        return cls(data, categories)
+
+    @classmethod
+    def from_keys(cls, keys):
+        keys = list(keys)
+        return cls.from_columns(
+            *[[getattr(key, name) for key in keys] for name in (*cls.categorical, "timestamp")]
+        )
+
+    @classmethod
+    def from_files(cls, files, pattern=None):
+        """Builds the table from the keys in the basenames of `files`."""
+        if pattern is None:
+            pattern = processing_pattern()
+        parsed = compile_pattern(pattern).parse_many([os.path.basename(file) for file in files])
+        for file, d in zip(files, parsed):
+            if d is None:
+                msg = f"{file} does not match pattern {pattern}"
+                raise ValueError(msg)
+        return cls.from_columns(
+            *[[d[name] for d in parsed] for name in (*cls.categorical, "timestamp")]
+        )
+
+    def _subset(self, idxs):
+        return KeyTable(self.data[idxs], self.categories)
+
+    def column(self, name):
+        """Returns the values of a column, categorical columns are decoded to strings."""
+        if name in self.categorical:
+            return self.categories[name][self.data[name]]
+        return self.data[name]
+
+    @property
+    def rows(self):
+        return self.data["row"]
+
+    def timestamps(self):
+        """Returns the timestamps as ``YYYYMMDDTHHMMSSZ`` strings."""
+        iso = np.datetime_as_string(self.data["timestamp"].astype("datetime64[s]"), unit="s")
+        return [f"{ts.replace('-', '').replace(':', '')}Z" for ts in iso]
+
+    def keys(self, key_class):
+        """Returns the rows as `key_class` objects e.g. FileKey."""
+        columns = [self.column(name).tolist() for name in self.categorical]
+        return [key_class(*values) for values in zip(*columns, self.timestamps())]
+
+    def sort(self, by=("timestamp",)):
+        """Returns the table sorted by the given columns, first column is the primary key."""
+        if isinstance(by, str):
+            by = (by,)
+        order = np.lexsort([self.data[name] for name in reversed(by)])
+        return self._subset(order)
+
+    def filter(self, mask=None, **selection):
+        """
+        Returns the rows passing a boolean `mask` and matching the selection
+        e.g. ``filter(datatype="cal", run=["r000", "r001"])``.
+        """
+        keep = np.ones(len(self), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        for name, values in selection.items():
+            selected = [values] if isinstance(values, str) else values
+            codes = np.flatnonzero(np.isin(self.categories[name], selected))
+            keep &= np.isin(self.data[name], codes)
+        return self._subset(keep)
+
+    def group_indices(self, *by):
+        """
+        Returns the positions of the rows in each group of equal values of
+        the `by` columns. Groups are in order of first appearance and rows keep
+        their order within a group.
+        """
+        if len(self) == 0:
+            return []
+        combined = np.zeros(len(self), dtype=np.int64)
+        for name in by:
+            n_values = len(self.categories[name]) if name in self.categorical else None
+            if n_values is None:
+                _, codes = np.unique(self.data[name], return_inverse=True)
+                n_values = codes.max() + 1
+            else:
+                codes = self.data[name]
+            combined = combined * n_values + codes
+        _, first, inverse = np.unique(combined, return_index=True, return_inverse=True)
+        # relabel groups by first appearance
+        rank = np.empty(len(first), dtype=np.int64)
+        rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+        group = rank[inverse.reshape(-1)]
+        order = np.argsort(group, kind="stable")
+        return np.split(order, np.flatnonzero(np.diff(group[order])) + 1)
+
+    def groupby(self, *by):
+        """Returns a list of ``(values, table)`` tuples, one per group of the `by` columns."""
+        groups = []
+        for idxs in self.group_indices(*by):
+            first = self.data[idxs[0]]
+            values = tuple(
+                self.categories[name][first[name]] if name in self.categorical else first[name]
+                for name in by
+            )
+            groups.append((values, self._subset(idxs)))
+        return groups
+
+    def join_timestamp(self, other):
+        """
+        For each row returns the position in `other` of the latest row with a
+        timestamp at or before it, -1 if there is none.
+        """
+        order = np.argsort(other.data["timestamp"], kind="stable")
+        pos = (
+            np.searchsorted(other.data["timestamp"][order], self.data["timestamp"], side="right")
+            - 1
+        )
+        return np.where(pos >= 0, order[np.maximum(pos, 0)], -1)
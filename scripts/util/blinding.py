@@ -0,0 +1,243 @@
+"""
+This module contains the blinding of raw files: the blinding curves are parsed
+once, the rows to blind are found in one pass over the Ge channels and the
+blinded channels are copied in chunks of rows so memory doesn't grow with the
+file. Objects which aren't blinded are copied as HDF5 objects, without decoding
+and compressing them again. Compressing the blinded channels can be split
+between processes writing their channels to shard files, which are then merged
+into the output file
+"""
+
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import h5py
+import lgdo.lh5 as lh5
+import numexpr as ne
+import numpy as np
+from legendmeta.catalog import Props
+
+log = logging.getLogger(__name__)
+
+# rows of a channel read and written at once
+default_chunk_rows = 10000
+
+# systems whose channels lose the blinded events
+blinded_systems = ("geds", "spms", "auxs", "bsln", "puls")
+
+
+def blinding_curves(files):
+    """Returns the daqenergy calibration of each channel in the blinding curve files."""
+    return {
+        channel: pars["pars"]["operations"]["daqenergy_cal"]
+        for channel, pars in Props.read_from(files).items()
+        if isinstance(pars, dict) and "daqenergy_cal" in pars.get("pars", {}).get("operations", {})
+    }
+
+
+def blind_rows(daqenergy, curve, centroid, width):
+    """Returns the mask of the rows with the calibrated `daqenergy` within `width` of `centroid`."""
+    daqenergy_cal = ne.evaluate(
+        curve["expression"],
+        local_dict=dict(daqenergy=np.asarray(daqenergy), **curve["parameters"]),
+    )
+    return np.abs(daqenergy_cal - centroid) <= width
+
+
+def blind_mask(raw_file, rawids, curves, centroid, width, store=None):
+    """
+    Returns the mask of the rows of `raw_file` to blind, the rows where any of the
+    Ge channels `rawids` is within `width` of `centroid`, None if no channel was
+    read. Only the daqenergy of the channels is read.
+    """
+    if store is None:
+        store = lh5.LH5Store()
+    mask = None
+    for rawid in rawids:
+        daqenergy, _ = store.read(f"ch{rawid}/raw/daqenergy", raw_file)
+        if mask is None:
+            mask = np.zeros(len(daqenergy), dtype=bool)
+        mask |= blind_rows(daqenergy.nda, curves[f"ch{rawid}"], centroid, width)
+    return mask
+
+
+def copy_objects(in_file, out_file, names):
+    """
+    Copies the objects `names` (e.g. channel groups) of `in_file` into `out_file`
+    with their attributes and compressed datasets as they are.
+    """
+    with h5py.File(in_file, "r") as f_in, h5py.File(out_file, "a") as f_out:
+        for name in names:
+            parent, base = os.path.split(name.strip("/"))
+            f_in.copy(f_in[name], f_out.require_group(parent) if parent else f_out, name=base)
+
+
+def row_runs(rows):
+    """Returns the ``(start, stop)`` of the runs of consecutive `rows` (sorted indices)."""
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = np.concatenate(([0], breaks))
+    stops = np.concatenate((breaks, [len(rows)]))
+    return [(int(rows[i]), int(rows[j - 1]) + 1) for i, j in zip(starts, stops)]
+
+
+def copy_rows(
+    in_file, out_file, channel, keep, hdf_settings, chunk_rows=default_chunk_rows, store=None
+):
+    """
+    Copies the rows `keep` (sorted indices) of ``{channel}/raw`` of `in_file` to
+    `out_file`, `chunk_rows` rows at a time. Each chunk is read as slices of its
+    runs of consecutive rows into one buffer, so only the kept rows are loaded
+    (an `idx` read would load the whole table for each chunk with a gap), which
+    is a single read for most chunks as few rows are blinded. Waveforms aren't
+    decompressed. The table is written even if no rows are kept.
+    """
+    if store is None:
+        store = lh5.LH5Store()
+    for start in range(0, max(len(keep), 1), chunk_rows):
+        rows = keep[start : start + chunk_rows]
+        if len(rows) == 0:
+            chobj, _ = store.read(f"{channel}/raw", in_file, n_rows=0, decompress=False)
+        else:
+            chobj, n_read = None, 0
+            for first, stop in row_runs(rows):
+                chobj, n_run = store.read(
+                    f"{channel}/raw",
+                    in_file,
+                    start_row=first,
+                    n_rows=stop - first,
+                    obj_buf=chobj,
+                    obj_buf_start=n_read,
+                    decompress=False,
+                )
+                n_read += n_run
+        store.write(
+            chobj,
+            name="raw",
+            lh5_file=out_file,
+            group=channel,
+            wo_mode="w" if start == 0 else "a",
+            **hdf_settings,
+        )
+
+
+def _write_shard(in_file, shard_file, channels, keep, hdf_settings, chunk_rows):
+    store = lh5.LH5Store()
+    for channel in channels:
+        copy_rows(in_file, shard_file, channel, keep, hdf_settings, chunk_rows, store=store)
+    return shard_file
+
+
+def copy_channels(
+    in_file,
+    out_file,
+    channels,
+    keep,
+    hdf_settings,
+    chunk_rows=default_chunk_rows,
+    n_processes=1,
+    store=None,
+):
+    """
+    `copy_rows` of each of `channels`. With more than one process the channels are
+    split between `n_processes` processes, each writing its channels to a shard file
+    next to `out_file`, and the shards are merged into `out_file` by HDF5 object
+    copies, so the channels are only compressed once.
+    """
+    n_processes = min(n_processes, len(channels))
+    if n_processes <= 1:
+        for channel in channels:
+            copy_rows(in_file, out_file, channel, keep, hdf_settings, chunk_rows, store=store)
+        return
+
+    # each shard has at least one channel, whose table is written even if no rows
+    # are kept, so every shard file exists to be merged
+    groups = [channels[i::n_processes] for i in range(n_processes)]
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_file))) as tmp_dir:
+        shard_files = [os.path.join(tmp_dir, f"shard{i:03d}.lh5") for i in range(n_processes)]
+        # forked so the processes don't import the calling script again
+        with ProcessPoolExecutor(n_processes, mp_context=get_context("fork")) as pool:
+            shard_files = list(
+                pool.map(
+                    _write_shard,
+                    [in_file] * n_processes,
+                    shard_files,
+                    groups,
+                    [keep] * n_processes,
+                    [hdf_settings] * n_processes,
+                    [chunk_rows] * n_processes,
+                )
+            )
+        for shard_file, group in zip(shard_files, groups):
+            copy_objects(shard_file, out_file, group)
+        log.debug(f"merged {len(channels)} channels from {n_processes} shards")
+
+
+def blind_raw_file(
+    in_file,
+    out_file,
+    chan_index,
+    curves,
+    centroid,
+    width,
+    hdf_settings,
+    chunk_rows=default_chunk_rows,
+    n_processes=1,
+):
+    """
+    Writes the blinded copy of the raw file `in_file` to `out_file`. The events
+    where a blinded Ge channel of `chan_index` (a `ChannelIndex` of the channel map
+    with the analysis flags) is within `width` of `centroid` are removed from the
+    channels of the `blinded_systems`, the other objects are copied as they are.
+    Returns the number of blinded events, raises if no Ge channel can be blinded.
+    """
+    store = lh5.LH5Store()
+
+    # Ge detectors that are anti-coincidence only or not able to be blinded for some
+    # other reason are skipped, the others are calibrated to look for events to blind
+    blinded_geds = [
+        chnum
+        for chnum in chan_index.rawids("geds")
+        if chan_index.info(chnum)["analysis"]["is_blinded"] is not False
+    ]
+    toblind = blind_mask(in_file, blinded_geds, curves, centroid, width, store=store)
+    if toblind is None:
+        msg = f"no Ge channel of {in_file} can be blinded"
+        raise RuntimeError(msg)
+    n_blinded = int(np.count_nonzero(toblind))
+    log.info(f"blinding {n_blinded} events with {len(blinded_geds)} Ge channels")
+
+    # rows that should not be blinded
+    tokeep = np.flatnonzero(~toblind)
+
+    to_copy = []
+    to_blind = []
+    for channel in lh5.ls(in_file):
+        try:
+            chnum = int(channel[2::])
+        except ValueError:
+            # if this isn't an interesting channel, just copy it to the output file
+            to_copy.append(channel)
+            continue
+
+        if not chan_index.is_in(chnum, *blinded_systems):
+            # if this is a PMT or not included for some reason, just copy it to the output file
+            to_copy.append(channel)
+        else:
+            # the Ge and SiPM channels that need to be blinded
+            to_blind.append(channel)
+
+    copy_objects(in_file, out_file, to_copy)
+    copy_channels(
+        in_file,
+        out_file,
+        to_blind,
+        tokeep,
+        hdf_settings,
+        chunk_rows,
+        n_processes=n_processes,
+        store=store,
+    )
+    return n_blinded
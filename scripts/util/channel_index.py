@@ -0,0 +1,95 @@
+"""
+This module contains an index of the channels of a channel map, built once per
+timestamp: the system of each rawid, the rawids of each system and the selector
+filtered subsets asked for, so scripts don't map the channel map again for every
+lookup
+"""
+
+import numpy as np
+
+
+def _get(info, key):
+    for part in key.split("."):
+        info = info[part]
+    return info
+
+
+class ChannelIndex:
+    """
+    Index of a channel map (``LegendMetadata.channelmap(timestamp)`` or
+    ``channelmaps.on(timestamp)``, e.g. from a `MetadataSnapshot` which caches
+    it on disk). Membership lookups are dictionary lookups. `rawids` are sorted,
+    as the key lists of the raw tier, the `select`-ed channels are in the order of
+    the channel map, as the channel lists of the evt tier. The arrays are not to be
+    modified.
+    """
+
+    def __init__(self, channelmap):
+        self.channels = {}
+        self.systems = {}
+        by_system = {}
+        for info in channelmap.values():
+            if not isinstance(info, dict) or "daq" not in info or "system" not in info:
+                continue
+            rawid = int(info["daq"]["rawid"])
+            self.channels[rawid] = info
+            self.systems[rawid] = info["system"]
+            by_system.setdefault(info["system"], []).append(rawid)
+        # in channel map order
+        self.in_map_order = {
+            system: np.array(rawids, dtype=int) for system, rawids in by_system.items()
+        }
+        self.by_system = {system: np.sort(rawids) for system, rawids in self.in_map_order.items()}
+        self._selected = {}
+
+    def __contains__(self, rawid):
+        return int(rawid) in self.systems
+
+    def __len__(self):
+        return len(self.systems)
+
+    def info(self, rawid):
+        """Returns the channel map entry of `rawid`."""
+        return self.channels[int(rawid)]
+
+    def system(self, rawid):
+        """Returns the system of `rawid`, None if it is not in the channel map."""
+        return self.systems.get(int(rawid), None)
+
+    def is_in(self, rawid, *systems):
+        """True if `rawid` belongs to one of `systems`."""
+        return self.systems.get(int(rawid), None) in systems
+
+    def rawids(self, *systems):
+        """Returns the sorted rawids of `systems`."""
+        if len(systems) == 1:
+            return self.by_system.get(systems[0], np.array([], dtype=int))
+        return np.sort(
+            np.concatenate(
+                [np.array([], dtype=int)] + [self.by_system.get(s, []) for s in systems]
+            ).astype(int)
+        )
+
+    def select(self, system, selectors=None):
+        """
+        Returns the rawids of `system` whose channel map entries equal the
+        `selectors` values, given as ``{"analysis.usability": "on"}``, in the order
+        of the channel map. Channels missing a selector key are left out.
+        """
+        if not selectors:
+            return self.in_map_order.get(system, np.array([], dtype=int))
+        key = (system, tuple(sorted((k, repr(v)) for k, v in selectors.items())))
+        if key not in self._selected:
+            selected = []
+            for rawid in self.select(system):
+                try:
+                    if all(_get(self.channels[rawid], k) == v for k, v in selectors.items()):
+                        selected.append(rawid)
+                except (KeyError, TypeError):
+                    continue
+            self._selected[key] = np.array(selected, dtype=int)
+        return self._selected[key]
+
+    def channel_names(self, system, selectors=None):
+        """Returns ``ch{rawid}`` of the `select`-ed channels."""
+        return [f"ch{rawid}" for rawid in self.select(system, selectors)]
@@ -0,0 +1,176 @@
+"""
+This module contains the running of the per channel parameter generation scripts
+for several channels in one job: the channels are given by name or filelist, can
+be taken in batches and run one after the other in the same process sharing a
+cache (see `stage_cache.run_channels`), or split over several processes, and the running
+of the stage scripts of a chain one after the other (see `stage_cache.run_chain`)
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from .FileKey import ChannelProcKey
+from .threads import job_threads, set_threads
+
+log = logging.getLogger(__name__)
+
+
+def get_channels(channels, batch=None, batch_size=None):
+    """
+    Returns the channels given as names or as filelists with a channel name or a
+    per channel file (e.g. the par files of the run) per line. With `batch` only
+    the channels of that batch of `batch_size` channels are returned.
+    """
+    out = []
+    for entry in channels:
+        if not os.path.isfile(entry):
+            out.append(entry)
+            continue
+        with open(entry) as f:
+            for line in f.read().splitlines():
+                channel = line
+                if os.path.basename(line) != line:
+                    channel = ChannelProcKey.get_filekey_from_pattern(
+                        os.path.basename(line)
+                    ).channel
+                if channel != "":
+                    out.append(channel)
+    if batch is not None:
+        out = out[batch * batch_size : (batch + 1) * batch_size]
+    return out
+
+
+def _run_channels(main, channels, argv, cache_type, n_threads=None):
+    """Runs `main` for each of `channels` with a shared cache, returns the failed ones."""
+    if n_threads is not None:
+        set_threads(n_threads=n_threads)
+    cache = cache_type()
+    failed = []
+    for channel in channels:
+        start = time.time()
+        try:
+            main(
+                [*(arg.replace("{channel}", channel) for arg in argv), "--channel", channel], cache
+            )
+        except Exception:
+            log.exception(f"{channel}: failed")
+            failed.append(channel)
+        else:
+            log.info(f"{channel}: finished in {time.time() - start:.2f}s")
+        cache.drop_tables()
+    return failed
+
+
+def run_channels(main, cache_type, argv=None):
+    """
+    Entry point of the per channel scripts, runs ``main(argv, cache)``.
+
+    ``--channel`` takes one or more channels or channel filelists, optionally with
+    ``--batch`` and ``--batch_size`` to only take a batch of them (see `get_channels`).
+    With a single channel `main` runs as before. With several, the channels run one
+    after the other in this process sharing a `cache_type` cache (its tables are
+    dropped after each channel), and ``{channel}`` in the other arguments (e.g. the
+    output paths) is replaced by each channel. With ``--processes`` the channels are
+    split over as many processes which share the threads of the job.
+    All channels are attempted before failing if any failed.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    argparser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    argparser.add_argument("--channel", nargs="+")
+    argparser.add_argument("--batch", type=int)
+    argparser.add_argument("--batch_size", type=int)
+    argparser.add_argument("--processes", type=int, default=1)
+    args, rest = argparser.parse_known_args(argv)
+
+    if args.channel is None or (
+        len(args.channel) == 1 and args.batch is None and not os.path.isfile(args.channel[0])
+    ):
+        return main(argv)
+
+    channels = get_channels(args.channel, args.batch, args.batch_size)
+    log.info(f"running {len(channels)} channels in {args.processes} processes")
+    processes = max(1, min(args.processes, len(channels)))
+    if processes == 1:
+        failed = _run_channels(main, channels, rest, cache_type)
+    else:
+        with ProcessPoolExecutor(processes, mp_context=get_context("fork")) as pool:
+            futures = [
+                pool.submit(
+                    _run_channels,
+                    main,
+                    channels[i::processes],
+                    rest,
+                    cache_type,
+                    max(1, job_threads() // processes),
+                )
+                for i in range(processes)
+            ]
+            failed = [channel for future in futures for channel in future.result()]
+    if len(failed) > 0:
+        msg = f"failed channels: {', '.join(sorted(failed))}"
+        raise RuntimeError(msg)
+    return None
+
+
+def _remove(files):
+    for file in files:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def run_chain(
+    stages, cache, intermediates=(), keep_intermediates=False, resume=False, log_file=None
+):
+    """
+    Runs the `main` of the stage scripts one after the other sharing `cache`.
+
+    `stages` is a list of ``(name, module, argv, outputs)`` tuples. All stages run
+    unless `resume` is set, then the stages whose outputs all exist are skipped up
+    to the first one which runs, so a chain kept with `keep_intermediates` can be
+    restarted from the stage which failed. The existing outputs are not checked
+    against the inputs and configs, resuming is only correct if they did not change.
+    If a stage fails its outputs and, unless `keep_intermediates`, the
+    `intermediates` (the outputs only the following stages use) are removed, as they
+    are at the end of the chain. The stages configure the root logger with their
+    own log files, the chain logs to `log_file`.
+    """
+    handler, level = None, log.level
+    if log_file is not None:
+        pathlib.Path(os.path.dirname(log_file)).mkdir(parents=True, exist_ok=True)
+        handler = logging.FileHandler(log_file, mode="w")
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+        log.addHandler(handler)
+        log.setLevel(logging.INFO)
+    try:
+        rerun = not resume
+        for name, stage, argv, outputs in stages:
+            if not rerun and all(os.path.exists(output) for output in outputs):
+                log.info(f"{name}: outputs exist, skipping")
+                continue
+            rerun = True
+            for output in outputs:
+                pathlib.Path(os.path.dirname(output)).mkdir(parents=True, exist_ok=True)
+            start = time.time()
+            try:
+                stage.main(argv, cache=cache)
+            except Exception:
+                log.exception(f"{name}: failed")
+                _remove(outputs)
+                if not keep_intermediates:
+                    _remove(intermediates)
+                raise
+            log.info(f"{name}: finished in {time.time() - start:.2f}s")
+
+        if not keep_intermediates:
+            _remove(intermediates)
+    finally:
+        if handler is not None:
+            log.removeHandler(handler)
+            log.setLevel(level)
+            handler.close()
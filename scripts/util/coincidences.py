@@ -0,0 +1,47 @@
+"""
+This module contains the utilities for matching timestamps between
+two subsystems e.g. flagging geds events in coincidence with the muon veto
+"""
+
+import numpy as np
+
+
+def match_timestamps(timestamps, other_timestamps, jitter):
+    """
+    Matches each entry of `timestamps` to the first entry of `other_timestamps`
+    inside ``[t, t + jitter]``.
+
+    `other_timestamps` is sorted once and every timestamp is resolved with a
+    single ``np.searchsorted`` so the cost is O((N+M) log M). Neither input
+    needs to be sorted.
+
+    Parameters
+    ----------
+    timestamps
+        timestamps to flag e.g. geds trigger timestamps
+    other_timestamps
+        timestamps to match against e.g. muon flagged timestamps
+    jitter
+        width of the coincidence window
+
+    Returns
+    -------
+    flag
+        boolean array, True if a timestamp has a match
+    matched_idx
+        index into `other_timestamps` of the earliest match, -1 if there is none
+    """
+    timestamps = np.asarray(timestamps)
+    other_timestamps = np.asarray(other_timestamps)
+    matched_idx = np.full(len(timestamps), -1, dtype=np.int64)
+    if len(other_timestamps) == 0 or len(timestamps) == 0:
+        return np.zeros(len(timestamps), dtype=bool), matched_idx
+
+    order = np.argsort(other_timestamps, kind="stable")
+    sorted_timestamps = other_timestamps[order]
+    pos = np.searchsorted(sorted_timestamps, timestamps, side="left")
+    in_range = pos < len(sorted_timestamps)
+    flag = np.zeros(len(timestamps), dtype=bool)
+    flag[in_range] = sorted_timestamps[pos[in_range]] <= timestamps[in_range] + jitter
+    matched_idx[flag] = order[pos[flag]]
+    return flag, matched_idx
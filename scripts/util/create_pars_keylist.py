@@ -6,14 +6,15 @@ import glob
 import json
 import os
 import pathlib
-import re
 import warnings
 from typing import ClassVar
 
-import snakemake as smk
+import numpy as np
 
+from .FileIndex import FileIndex
 from .FileKey import FileKey, ProcessingFileKey
-from .patterns import par_validity_pattern
+from .patterns import compile_pattern, expand, par_validity_pattern
+from .utils import unix_time_array
 
 
 class pars_key_resolve:
@@ -42,9 +43,36 @@ class pars_key_resolve:
 
     @staticmethod
     def write_to_jsonl(file_names, path):
+        """
+        Writes the entries to `path`, the file is left untouched if its content
+        wouldn't change so its mtime doesn't trigger reruns. Returns True if written.
+        """
+        content = "".join(f"{file_name.get_json()}\n" for file_name in file_names)
+        if os.path.isfile(path):
+            with open(path) as file:
+                if file.read() == content:
+                    return False
         with open(path, "w") as of:
-            for file_name in file_names:
-                of.write(f"{file_name.get_json()}\n")
+            of.write(content)
+        return True
+
+    @staticmethod
+    def get_keys_from_catalog(path):
+        """Returns the keys the entries of an existing validity file were generated from."""
+        keys = []
+        if not os.path.isfile(path):
+            return keys
+        with open(path) as file:
+            for line in file:
+                if line.strip() == "":
+                    continue
+                entry = json.loads(line)
+                for apply in entry["apply"]:
+                    key = ProcessingFileKey.get_filekey_from_filename(os.path.basename(apply))
+                    if key is not None and key.timestamp == entry["valid_from"]:
+                        keys.append(FileKey(*key._list()[: len(FileKey._fields)]))
+                        break
+        return keys
 
     @staticmethod
     def match_keys(key1, key2):
@@ -63,15 +91,23 @@ class pars_key_resolve:
 
     @staticmethod
     def generate_par_keylist(keys):
+        """
+        Returns the first key of every run in the time sorted `keys`, a run
+        starts again whenever keys of another run or datatype come in between.
+        Single pass over the keys after sorting.
+        """
+        keys = list(keys)
+        order = np.argsort(unix_time_array([key.timestamp for key in keys]), kind="stable")
         keylist = []
-        keys = sorted(keys, key=FileKey.get_unix_timestamp)
-        keylist.append(keys[0])
-        for key in keys[1:]:
-            matched_key = pars_key_resolve.match_keys(keylist[-1], key)
-            if matched_key not in keylist:
-                keylist.append(matched_key)
-            else:
-                pass
+        seen = set()
+        current_run = None
+        for idx in order:
+            key = keys[idx]
+            run = (key.experiment, key.period, key.run, key.datatype)
+            if run != current_run and key not in seen:
+                keylist.append(key)
+                seen.add(key)
+                current_run = run
         return keylist
 
     @staticmethod
@@ -85,31 +121,49 @@ class pars_key_resolve:
 
     @staticmethod
     def match_all_entries(entrylist, name_dict):
+        """
+        Each entry applies its own files followed by the files of the previous
+        entry of other datatypes, the datatype of every file is carried along
+        so the filenames are never parsed again.
+        """
         out_list = []
-        out_list.append(pars_key_resolve.from_filekey(entrylist[0], name_dict))
-        for entry in entrylist[1:]:
-            new_entry = pars_key_resolve.from_filekey(entry, name_dict)
-            pars_key_resolve.match_entries(out_list[-1], new_entry)
+        previous = []
+        for key in entrylist:
+            new_entry = pars_key_resolve.from_filekey(key, name_dict)
+            current = [(key.datatype, file) for file in new_entry.apply]
+            current += [
+                (datatype, file) for datatype, file in previous if datatype != key.datatype
+            ]
+            new_entry.apply = [file for _, file in current]
             out_list.append(new_entry)
+            previous = current
         return out_list
 
     @staticmethod
-    def get_keys(keypart, search_pattern):
+    def get_keys(keypart, search_pattern, index_file=None):
+        if index_file is not None:
+            with FileIndex(index_file) as index:
+                return index.get_keys(search_pattern, keypart)
         d = FileKey.parse_keypart(keypart)
-        tier_pattern_rx = re.compile(smk.io.regex(search_pattern))
-        fn_glob_pattern = smk.io.expand(search_pattern, **d._asdict())[0]
+        fn_glob_pattern = expand(search_pattern, **d._asdict())[0]
         files = glob.glob(fn_glob_pattern)
-        keys = []
-        for f in files:
-            m = tier_pattern_rx.match(f)
-            if m is not None:
-                d = m.groupdict()
-                key = FileKey(**d)
-                keys.append(key)
-        return keys
+        return [
+            FileKey(**d)
+            for d in compile_pattern(search_pattern).parse_many(files)
+            if d is not None
+        ]
 
     @staticmethod
-    def write_par_catalog(keypart, filename, search_patterns, name_dict):
+    def write_par_catalog(
+        keypart, filename, search_patterns, name_dict, index_file=None, overwrite=False
+    ):
+        """
+        Writes the validity file for the keys found with `search_patterns`.
+
+        Unless `overwrite`, the keys of an existing file are merged with the ones
+        found so entries are only ever added, and the file is only rewritten if
+        its content changed. Returns True if the file was written.
+        """
         if isinstance(keypart, str):
             keypart = [keypart]
         if isinstance(search_patterns, str):
@@ -117,16 +171,16 @@ class pars_key_resolve:
         keylist = []
         for search_pattern in search_patterns:
             for keypar in keypart:
-                keylist += pars_key_resolve.get_keys(keypar, search_pattern)
+                keylist += pars_key_resolve.get_keys(keypar, search_pattern, index_file)
+        if not overwrite:
+            keylist += pars_key_resolve.get_keys_from_catalog(filename)
+        pathlib.Path(os.path.dirname(filename)).mkdir(parents=True, exist_ok=True)
         if len(keylist) != 0:
-            keys = sorted(keylist, key=FileKey.get_unix_timestamp)
-            keylist = pars_key_resolve.generate_par_keylist(keys)
+            keylist = pars_key_resolve.generate_par_keylist(dict.fromkeys(keylist))
 
             entrylist = pars_key_resolve.match_all_entries(keylist, name_dict)
-            pathlib.Path(os.path.dirname(filename)).mkdir(parents=True, exist_ok=True)
-            pars_key_resolve.write_to_jsonl(entrylist, filename)
         else:
             msg = "No Keys found"
             warnings.warn(msg, stacklevel=0)
             entrylist = [pars_key_resolve("00000000T000000Z", "all", [])]
-            pars_key_resolve.write_to_jsonl(entrylist, filename)
+        return pars_key_resolve.write_to_jsonl(entrylist, filename)
@@ -9,6 +9,7 @@ from .CalibCatalog import PropsStream
 from .FileKey import ChannelProcKey, ProcessingFileKey
 from .patterns import (
     get_pattern_log_channel,
+    get_pattern_pars_tmp,
     get_pattern_pars_tmp_channel,
     get_pattern_plts_tmp_channel,
 )
@@ -48,16 +49,8 @@ class dataset_file:
                 ]
         return files
 
-    def get_par_files(
-        self,
-        catalog_file,
-        dataset,
-        channel,
-        tier,
-        experiment="l200",
-        datatype="cal",
-        name=None,
-        extension="json",
+    def get_par_keys(
+        self, catalog_file, dataset, channel, tier, experiment="l200", datatype="cal"
     ):
         dataset = self.get_dataset(dataset, channel)
         all_par_files = []
@@ -66,9 +59,7 @@ class dataset_file:
             for par_file in par_files:
                 if par_file.split("-")[-1] == f"par_{tier}.json":
                     all_par_files.append(par_file)
-        if channel == "default":
-            channel = "{channel}"
-        selected_par_files = []
+        selected_keys = []
         for par_file in all_par_files:
             fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(par_file))
             if (
@@ -77,25 +68,56 @@ class dataset_file:
                 and fk.period in list(dataset)
                 and (dataset[fk.period] == "all" or fk.run in dataset[fk.period])
             ):
-                if name is not None:
-                    selected_par_files.append(
-                        fk.get_path_from_filekey(
-                            get_pattern_pars_tmp_channel(
-                                self.setup, tier, name=name, extension=extension
-                            ),
-                            channel=channel,
-                        )[0]
-                    )
-                else:
-                    selected_par_files.append(
-                        fk.get_path_from_filekey(
-                            get_pattern_pars_tmp_channel(
-                                self.setup, tier, name=name, extension=extension
-                            ),
-                            channel=channel,
-                        )[0]
-                    )
-        return selected_par_files
+                selected_keys.append(fk)
+        return selected_keys
+
+    def get_par_files(
+        self,
+        catalog_file,
+        dataset,
+        channel,
+        tier,
+        experiment="l200",
+        datatype="cal",
+        name=None,
+        extension="json",
+    ):
+        keys = self.get_par_keys(
+            catalog_file, dataset, channel, tier, experiment=experiment, datatype=datatype
+        )
+        if channel == "default":
+            channel = "{channel}"
+        return [
+            fk.get_path_from_filekey(
+                get_pattern_pars_tmp_channel(self.setup, tier, name=name, extension=extension),
+                channel=channel,
+            )[0]
+            for fk in keys
+        ]
+
+    def get_run_par_files(
+        self,
+        catalog_file,
+        dataset,
+        channel,
+        tier,
+        experiment="l200",
+        datatype="cal",
+        name=None,
+        extension="json",
+    ):
+        """par files of the runs in the dataset shared by all channels e.g. pulser masks"""
+        keys = self.get_par_keys(
+            catalog_file, dataset, channel, tier, experiment=experiment, datatype=datatype
+        )
+        return [
+            fk.get_path_from_filekey(
+                get_pattern_pars_tmp(
+                    self.setup, tier, name=name, datatype=datatype, extension=extension
+                )
+            )[0]
+            for fk in keys
+        ]
 
     def get_plt_files(
         self,
@@ -107,39 +129,18 @@ class dataset_file:
         datatype="cal",
         name=None,
     ):
-        dataset = self.get_dataset(dataset, channel)
-        all_par_files = []
-        for item in PropsStream.read_from(catalog_file):
-            par_files = item["apply"]
-            for par_file in par_files:
-                if par_file.split("-")[-1] == f"par_{tier}.json":
-                    all_par_files.append(par_file)
+        keys = self.get_par_keys(
+            catalog_file, dataset, channel, tier, experiment=experiment, datatype=datatype
+        )
         if channel == "default":
             channel = "{channel}"
-        selected_par_files = []
-        for par_file in all_par_files:
-            fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(par_file))
-            if (
-                fk.datatype == datatype
-                and fk.experiment == experiment
-                and fk.period in list(dataset)
-                and (dataset[fk.period] == "all" or fk.run in dataset[fk.period])
-            ):
-                if name is not None:
-                    selected_par_files.append(
-                        fk.get_path_from_filekey(
-                            get_pattern_plts_tmp_channel(self.setup, tier, name=name),
-                            channel=channel,
-                        )[0]
-                    )
-                else:
-                    selected_par_files.append(
-                        fk.get_path_from_filekey(
-                            get_pattern_plts_tmp_channel(self.setup, tier, name=name),
-                            channel=channel,
-                        )[0]
-                    )
-        return selected_par_files
+        return [
+            fk.get_path_from_filekey(
+                get_pattern_plts_tmp_channel(self.setup, tier, name=name),
+                channel=channel,
+            )[0]
+            for fk in keys
+        ]
 
     def get_log_file(
         self,
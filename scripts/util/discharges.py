@@ -0,0 +1,40 @@
+"""
+This module contains the utilities for flagging events recorded while a detector
+is recovering from a discharge
+"""
+
+import numpy as np
+
+
+def get_recovery_mask(timestamps, discharges, window=0.01):
+    """
+    Returns a boolean mask flagging every event which follows a discharge
+    within `window` seconds, i.e. with ``0 < t - t_discharge < window``.
+
+    The discharge timestamps are sorted once and each event is matched to the
+    latest discharge strictly before it with a single ``np.searchsorted``,
+    so the cost is O(N log N) instead of O(N x N_discharges). The events do not
+    need to be time-ordered, so concatenated files can be passed directly.
+
+    Parameters
+    ----------
+    timestamps
+        timestamps of all events in seconds
+    discharges
+        boolean mask of the events that are discharges e.g. ``t_sat_lo > 0``
+    window
+        length of the recovery window in seconds
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    discharges = np.asarray(discharges, dtype=bool)
+    is_recovering = np.zeros(len(timestamps), dtype=bool)
+    discharge_timestamps = np.unique(timestamps[discharges])
+    if len(discharge_timestamps) == 0:
+        return is_recovering
+
+    # index of the last discharge strictly before each event
+    idx = np.searchsorted(discharge_timestamps, timestamps, side="left") - 1
+    has_prev = idx >= 0
+    delta = timestamps[has_prev] - discharge_timestamps[idx[has_prev]]
+    is_recovering[has_prev] = delta < window
+    return is_recovering
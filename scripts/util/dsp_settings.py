@@ -0,0 +1,51 @@
+"""
+This module contains the ``buffer_len`` and ``block_width`` build_dsp runs the
+processing chains with. They are read from the section of the datatype in the
+dsp settings file, which `tune_dsp.py` writes from benchmarks on a sample of a
+run, the values used before tuning are the fallback
+"""
+
+import json
+import os
+import tempfile
+
+default_settings = {"buffer_len": 3200, "block_width": 16}
+
+
+def get_dsp_settings(settings, datatype):
+    """
+    Returns the ``buffer_len`` and ``block_width`` of `datatype` in `settings` (the
+    dsp settings file read, None if there is none), the defaults where missing.
+    """
+    section = {} if settings is None else settings.get(datatype, {})
+    return {key: int(section.get(key, value)) for key, value in default_settings.items()}
+
+
+def best_trial(trials, max_rss=None):
+    """
+    Returns the trial with the highest throughput among the trials with a peak
+    RSS (in MB) of at most `max_rss`. If none fits, the trial with the lowest peak
+    RSS is returned.
+    """
+    fitting = [trial for trial in trials if max_rss is None or trial["peak_rss"] <= max_rss]
+    if len(fitting) == 0:
+        return min(trials, key=lambda trial: trial["peak_rss"])
+    return max(fitting, key=lambda trial: trial["throughput"])
+
+
+def write_dsp_settings(file, datatype, best, trials):
+    """
+    Sets the section of `datatype` in the dsp settings `file` to the settings of
+    the `best` trial, keeping the `trials` next to them. Other sections are kept.
+    """
+    settings = {}
+    if os.path.isfile(file):
+        with open(file) as f:
+            settings = json.load(f)
+    settings[datatype] = {key: best[key] for key in default_settings}
+    settings[datatype]["trials"] = trials
+    dir_name = os.path.dirname(os.path.abspath(file))
+    os.makedirs(dir_name, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=dir_name, suffix=".tmp", delete=False) as f:
+        json.dump(settings, f, indent=4)
+    os.replace(f.name, file)
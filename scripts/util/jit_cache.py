@@ -0,0 +1,58 @@
+"""
+This module contains the handling of the numba cache shared by the jobs of a
+production (or of a node), so the kernels of lgdo, dspeed and pygama are
+compiled once instead of in every job
+"""
+
+import fcntl
+import logging
+import os
+import pathlib
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+cache_env = "DATAFLOW_JIT_CACHE"
+
+
+def _lock_file(cache_dir):
+    pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    return os.path.join(cache_dir, ".lock")
+
+
+@contextmanager
+def jit_cache_lock(cache_dir, exclusive=False):
+    """
+    Holds the lock of the cache, exclusive while the cache is warmed up and
+    shared by the jobs waiting for a warm-up (of another workflow) to finish.
+    """
+    with open(_lock_file(cache_dir), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def setup_jit_cache(warm_up=False):
+    """
+    Sets up numba caching for lgdo, dspeed and pygama, to be called before they are
+    imported. With the cache directory in ``DATAFLOW_JIT_CACHE`` the kernels are
+    cached there, otherwise caching is disabled as before. Jobs wait for a running
+    warm-up to finish so they find the cache complete. Kernels a warm-up didn't
+    compile are compiled and added by the job, numba writes the cache files to a
+    temporary file and renames it so jobs doing this at once are safe. Returns the
+    cache directory or None.
+    """
+    cache_dir = os.environ.get(cache_env, "")
+    if cache_dir == "":
+        os.environ["LGDO_CACHE"] = "false"
+        os.environ["DSPEED_CACHE"] = "false"
+        return None
+    os.environ["NUMBA_CACHE_DIR"] = cache_dir
+    os.environ["LGDO_CACHE"] = "true"
+    os.environ["DSPEED_CACHE"] = "true"
+    if not warm_up:
+        with jit_cache_lock(cache_dir):
+            pass
+    return cache_dir
@@ -0,0 +1,170 @@
+"""
+This module contains snapshots of the metadata views the scripts need: the
+configs ``on`` a timestamp for a datatype, the channel map at the timestamp and
+the config files these refer to. A snapshot is resolved once and written to a
+cache file, keyed by a fingerprint of the metadata trees, which the following
+jobs of the timestamp load instead of walking and parsing the metadata again.
+Snapshots not loaded for `max_age` seconds are removed when a new one is written
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import time
+
+from legendmeta import AttrsDict, LegendMetadata
+from legendmeta.catalog import Props
+
+log = logging.getLogger(__name__)
+
+cache_env = "DATAFLOW_META_CACHE"
+
+# snapshots of metadata which changed since are never loaded again
+max_age = 7 * 24 * 3600
+
+_fingerprints = {}
+
+
+def _default_cache_dir():
+    return os.path.join(tempfile.gettempdir(), f"legend-dataflow-meta-{os.getuid()}")
+
+
+def tree_fingerprint(path):
+    """
+    Returns a hash of the names, sizes and modification times of the files under
+    `path`, which changes whenever a file is edited, added or removed. Stat-ing the
+    tree is much cheaper than reading it, it is done once per process.
+    """
+    path = os.path.abspath(path)
+    if path not in _fingerprints:
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for file in sorted(files):
+                stat = os.stat(os.path.join(root, file))
+                rel_path = os.path.relpath(os.path.join(root, file), path)
+                digest.update(f"{rel_path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        _fingerprints[path] = digest.hexdigest()
+    return _fingerprints[path]
+
+
+def _prune(cache_dir):
+    """Removes the snapshots (and left over temporary files) older than `max_age`."""
+    now = time.time()
+    for file in os.listdir(cache_dir):
+        if os.path.splitext(file)[1] not in (".json", ".tmp"):
+            continue
+        try:
+            if now - os.stat(os.path.join(cache_dir, file)).st_mtime > max_age:
+                os.remove(os.path.join(cache_dir, file))
+        except FileNotFoundError:
+            # removed by another job
+            pass
+
+
+def _config_files(obj, configs):
+    """Returns the config files under `configs` a config dictionary refers to."""
+    if isinstance(obj, dict):
+        return [file for value in obj.values() for file in _config_files(value, configs)]
+    if isinstance(obj, list):
+        return [file for value in obj for file in _config_files(value, configs)]
+    if (
+        isinstance(obj, str)
+        and os.path.splitext(obj)[1] in (".json", ".yaml", ".yml")
+        and os.path.abspath(obj).startswith(configs)
+        and os.path.isfile(obj)
+    ):
+        return [os.path.abspath(obj)]
+    return []
+
+
+class MetadataSnapshot:
+    """
+    The metadata views of a timestamp: `config` is ``LegendMetadata(configs).on(
+    timestamp, system=datatype)`` and `channelmap` ``LegendMetadata(metadata).
+    channelmap(timestamp)``, or the hardware ``LegendMetadata(chan_maps).channelmaps.
+    on(timestamp)`` if loaded with `chan_maps`. `read` replaces ``Props.read_from``
+    for the config files these refer to.
+    """
+
+    def __init__(self, config=None, channelmap=None, files=None):
+        self.config = config
+        self.channelmap = channelmap
+        self.files = {} if files is None else files
+
+    @classmethod
+    def load(
+        cls, timestamp, datatype=None, configs=None, metadata=None, chan_maps=None, cache_dir=None
+    ):
+        """
+        Returns the snapshot of `timestamp` for the `configs` (with `datatype`) and
+        `metadata` paths given, from the cache directory (``DATAFLOW_META_CACHE`` or
+        a directory in the node's temporary directory by default) if it was
+        resolved before, otherwise it is resolved and written there.
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get(cache_env, "") or _default_cache_dir()
+        key = hashlib.sha256(
+            json.dumps(
+                [
+                    timestamp,
+                    datatype,
+                    None if configs is None else tree_fingerprint(configs),
+                    None if metadata is None else tree_fingerprint(metadata),
+                    None if chan_maps is None else tree_fingerprint(chan_maps),
+                ]
+            ).encode()
+        ).hexdigest()
+        cache_file = os.path.join(cache_dir, f"{key}.json")
+        if os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                snapshot = json.load(f)
+            # loading keeps the snapshot from being pruned
+            os.utime(cache_file)
+            log.debug(f"loaded metadata snapshot {cache_file}")
+        else:
+            snapshot = cls._resolve(timestamp, datatype, configs, metadata, chan_maps)
+            # raises on values JSON can't represent, rather than caching them altered
+            text = json.dumps(snapshot, separators=(",", ":"))
+            pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+            _prune(cache_dir)
+            # jobs writing the same snapshot at once each rename their own file
+            with tempfile.NamedTemporaryFile("w", dir=cache_dir, suffix=".tmp", delete=False) as f:
+                f.write(text)
+            os.replace(f.name, cache_file)
+            log.debug(f"wrote metadata snapshot {cache_file}")
+        return cls(
+            config=None if snapshot["config"] is None else AttrsDict(snapshot["config"]),
+            channelmap=(
+                None if snapshot["channelmap"] is None else AttrsDict(snapshot["channelmap"])
+            ),
+            files=snapshot["files"],
+        )
+
+    @staticmethod
+    def _resolve(timestamp, datatype, configs, metadata, chan_maps):
+        config = None
+        files = {}
+        if configs is not None:
+            config = LegendMetadata(path=configs).on(timestamp, system=datatype)
+            for file in _config_files(config, os.path.abspath(configs)):
+                files[file] = Props.read_from(file)
+        channelmap = None
+        if metadata is not None:
+            channelmap = LegendMetadata(path=metadata).channelmap(timestamp)
+        elif chan_maps is not None:
+            channelmap = LegendMetadata(path=chan_maps).channelmaps.on(timestamp)
+        return {"config": config, "channelmap": channelmap, "files": files}
+
+    def read(self, files, **kwargs):
+        """
+        ``Props.read_from(files, **kwargs)``, config files in the snapshot are not
+        read again. A copy is returned so callers can modify it.
+        """
+        if isinstance(files, str) and not kwargs and os.path.abspath(files) in self.files:
+            return copy.deepcopy(self.files[os.path.abspath(files)])
+        return Props.read_from(files, **kwargs)
@@ -5,12 +5,20 @@ to determine the par and par overwrite for a particular timestamp
 
 import os
 
+import numpy as np
+
 from .CalibCatalog import CalibCatalog
 from .FileKey import ProcessingFileKey
 
 # from .patterns import
 from .utils import get_pars_path, par_overwrite_path
 
+# par files already resolved, keyed by the validity file paths
+_par_files_cache = {}
+
+# timestamps of the filelists precomputed and the catalogs they were resolved with
+_precomputed = {}
+
 
 class pars_catalog(CalibCatalog):
     @staticmethod
@@ -28,20 +36,105 @@ class pars_catalog(CalibCatalog):
         return filelist1, filelist2
 
     @staticmethod
-    def get_par_file(setup, timestamp, tier):
+    def get_par_files_many(setup, timestamps, tier):
+        """
+        Resolves the par files for many timestamps at once, returns a dict
+        mapping each timestamp to its list of par files. The results are kept
+        until either validity file changes so `get_par_file` is then just a
+        dictionary lookup.
+        """
         par_file = os.path.join(get_pars_path(setup, tier), "validity.jsonl")
-        pars_files = pars_catalog.get_calib_files(par_file, timestamp)
         par_overwrite_file = os.path.join(par_overwrite_path(setup), tier, "validity.jsonl")
-        pars_files_overwrite = pars_catalog.get_calib_files(par_overwrite_file, timestamp)
-        if len(pars_files_overwrite) > 0:
-            pars_files, pars_files_overwrite = pars_catalog.match_pars_files(
-                pars_files, pars_files_overwrite
+        catalog = pars_catalog.read_cached(par_file)
+        overwrite_catalog = pars_catalog.read_cached(par_overwrite_file)
+
+        cache_key = (os.path.abspath(par_file), os.path.abspath(par_overwrite_file))
+        cached = _par_files_cache.get(cache_key)
+        if cached is None or cached[0] is not catalog or cached[1] is not overwrite_catalog:
+            cached = (catalog, overwrite_catalog, {})
+            _par_files_cache[cache_key] = cached
+        resolved = cached[2]
+
+        timestamps = list(timestamps)
+        missing = sorted({timestamp for timestamp in timestamps if timestamp not in resolved})
+        if len(missing) > 0:
+            interval = np.zeros((len(missing), 2), dtype=np.int64)
+            groups = []
+            for i, cat in enumerate([catalog, overwrite_catalog]):
+                group = cat.calib_for_many(missing)
+                for j, (_, idxs) in enumerate(group):
+                    interval[idxs, i] = j
+                groups.append(group)
+
+            # match the par and overwrite files once per pair of validity intervals
+            pair_files = {}
+            for timestamp, pair in zip(missing, map(tuple, interval)):
+                if pair not in pair_files:
+                    pars_files = list(groups[0][pair[0]][0])
+                    pars_files_overwrite = list(groups[1][pair[1]][0])
+                    if len(pars_files_overwrite) > 0:
+                        pars_files, pars_files_overwrite = pars_catalog.match_pars_files(
+                            pars_files, pars_files_overwrite
+                        )
+                    pars_files = [
+                        os.path.join(get_pars_path(setup, tier), file) for file in pars_files
+                    ]
+                    if len(pars_files_overwrite) > 0:
+                        pars_files += [
+                            os.path.join(par_overwrite_path(setup), tier, file)
+                            for file in pars_files_overwrite
+                        ]
+                    pair_files[pair] = pars_files
+                resolved[timestamp] = pair_files[pair]
+        return {timestamp: list(resolved[timestamp]) for timestamp in timestamps}
+
+    @staticmethod
+    def get_par_file(setup, timestamp, tier):
+        return pars_catalog.get_par_files_many(setup, [timestamp], tier)[timestamp]
+
+    @staticmethod
+    def precompute_par_files(setup, files, tiers=("dsp", "hit", "psp", "pht"), key=None):
+        """
+        Resolves the par files of all `files` for each of `tiers` with an existing
+        validity file in one go, so the per job lookups hit the cache. With a `key`
+        (e.g. the path and mtime of the filelist) this is only done again for a tier once its
+        validity files changed. Timestamps without a calibration are left to the
+        per job lookup to report.
+        """
+        if key is None or key not in _precomputed:
+            timestamps = set()
+            for file in files:
+                filekey = ProcessingFileKey.get_filekey_from_filename(os.path.basename(file))
+                if filekey is not None:
+                    timestamps.add(filekey.timestamp)
+            timestamps = sorted(timestamps)
+            if key is None:
+                resolved = {}
+            else:
+                resolved = _precomputed[key] = {"timestamps": timestamps}
+        else:
+            resolved = _precomputed[key]
+            timestamps = resolved["timestamps"]
+
+        for tier in tiers:
+            par_file = os.path.join(get_pars_path(setup, tier), "validity.jsonl")
+            par_overwrite_file = os.path.join(par_overwrite_path(setup), tier, "validity.jsonl")
+            if not os.path.isfile(par_file) or not os.path.isfile(par_overwrite_file):
+                continue
+            catalogs = (
+                pars_catalog.read_cached(par_file),
+                pars_catalog.read_cached(par_overwrite_file),
+            )
+            done = resolved.get(tier)
+            if done is not None and all(c1 is c2 for c1, c2 in zip(done, catalogs)):
+                continue
+            # the timestamps before the first entry of the catalogs raise in the lookup
+            valid = np.ones(len(timestamps), dtype=bool)
+            for catalog in catalogs:
+                for file, idxs in catalog.calib_for_many(timestamps, allow_none=True):
+                    if file is None:
+                        valid[idxs] = False
+            pars_catalog.get_par_files_many(
+                setup, [timestamp for timestamp, ok in zip(timestamps, valid) if ok], tier
             )
-        pars_files = [os.path.join(get_pars_path(setup, tier), file) for file in pars_files]
-        if len(pars_files_overwrite) > 0:
-            pars_overwrite_files = [
-                os.path.join(par_overwrite_path(setup), tier, file)
-                for file in pars_files_overwrite
-            ]
-            pars_files += pars_overwrite_files
-        return pars_files
+            resolved[tier] = catalogs
@@ -2,8 +2,12 @@
 This module contains all the patterns needed for the data production
 """
 
+import functools
+import itertools
 import os
 import pathlib
+import re
+import string
 
 from .utils import (
     par_dsp_path,
@@ -34,6 +38,126 @@ from .utils import (
     tmp_plts_path,
 )
 
+# same wildcard syntax as snakemake: {name} or {name,constraint}
+_wildcard_rx = re.compile(
+    r"""
+    \{
+        (?=(
+            \s*(?P<name>\w+)
+            (\s*,\s*
+                (?P<constraint>
+                    ([^{}]+ | \{\d+(,\d+)?\})*
+                )
+            )?\s*
+        ))\1
+    \}
+    """,
+    re.VERBOSE,
+)
+
+
+class FilePattern:
+    """
+    A `{wildcard}` file pattern compiled once into a regex for parsing
+    filenames and a list of literal/field parts for formatting them.
+    Behaves like ``snakemake.io.regex`` and ``snakemake.io.expand``
+    without needing to import snakemake.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = str(pattern)
+
+        regex = []
+        wildcards = []
+        last = 0
+        for match in _wildcard_rx.finditer(self.pattern):
+            regex.append(re.escape(self.pattern[last : match.start()]))
+            wildcard = match.group("name")
+            if wildcard in wildcards:
+                if match.group("constraint"):
+                    msg = f"Constraint for wildcard {wildcard} must be in its first occurrence"
+                    raise ValueError(msg)
+                regex.append(f"(?P={wildcard})")
+            else:
+                wildcards.append(wildcard)
+                regex.append(f"(?P<{wildcard}>{match.group('constraint') or '.+'})")
+            last = match.end()
+        regex.append(re.escape(self.pattern[last:]))
+        regex.append("$")
+        self.regex = re.compile("".join(regex))
+
+        self.parts = []
+        for literal, field, _, _ in string.Formatter().parse(self.pattern):
+            if literal:
+                self.parts.append((literal, None))
+            if field is not None:
+                self.parts.append((None, field.split(",")[0].strip()))
+        self.fields = tuple(dict.fromkeys(field for _, field in self.parts if field is not None))
+
+    def parse(self, filename):
+        """Returns the dict of wildcard values in `filename` or None if it doesn't match."""
+        match = self.regex.match(filename)
+        return None if match is None else match.groupdict()
+
+    def parse_many(self, filenames):
+        """Parses a list of filenames, see `parse`."""
+        match = self.regex.match
+        return [None if m is None else m.groupdict() for m in map(match, filenames)]
+
+    def format(self, **wildcards):
+        """Fills in the wildcards, which must all be given, with single values."""
+        try:
+            return "".join(
+                literal if field is None else str(wildcards[field])
+                for literal, field in self.parts
+            )
+        except KeyError as e:
+            msg = f"No values given for wildcard {e} in {self.pattern}"
+            raise KeyError(msg) from None
+
+    def format_many(self, keys):
+        """
+        Formats one filename per key, keys can be dicts or any object with an
+        ``_asdict`` method e.g. a FileKey.
+        """
+        return [self.format(**(key._asdict() if hasattr(key, "_asdict") else key)) for key in keys]
+
+    def expand(self, **wildcards):
+        """
+        Returns the filenames for all combinations of the wildcard values,
+        values can be single values or lists.
+        """
+        values = []
+        for field in self.fields:
+            if field not in wildcards:
+                msg = f"No values given for wildcard {field} in {self.pattern}"
+                raise KeyError(msg)
+            value = wildcards[field]
+            if isinstance(value, str) or not hasattr(value, "__iter__"):
+                value = [value]
+            values.append(value)
+        return [self.format(**dict(zip(self.fields, comb))) for comb in itertools.product(*values)]
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    """Returns the cached `FilePattern` for `pattern`."""
+    return FilePattern(pattern)
+
+
+def regex(pattern):
+    return compile_pattern(str(pattern)).regex
+
+
+def expand(patterns, **wildcards):
+    if isinstance(patterns, (str, pathlib.Path)):
+        patterns = [patterns]
+    return [
+        filename
+        for pattern in patterns
+        for filename in compile_pattern(str(pattern)).expand(**wildcards)
+    ]
+
 
 # key_mask
 def key_pattern():
@@ -472,13 +596,16 @@ def get_pattern_pars_overwrite(setup, tier, name=None):
         )
 
 
-def get_pattern_pars_tmp(setup, tier, name=None, datatype=None):
+def get_pattern_pars_tmp(setup, tier, name=None, datatype=None, extension="json"):
     if datatype is None:
         datatype = "{datatype}"
     if name is None:
         return os.path.join(
             f"{tmp_par_path(setup)}",
-            "{experiment}-{period}-{run}-" + datatype + "-{timestamp}-par_" + tier + ".json",
+            "{experiment}-{period}-{run}-"
+            + datatype
+            + "-{timestamp}-par_"
+            + f"{tier}.{extension}",
         )
     else:
         return os.path.join(
@@ -486,13 +613,20 @@ def get_pattern_pars_tmp(setup, tier, name=None, datatype=None):
             "{experiment}-{period}-{run}-"
             + datatype
             + "-{timestamp}-par_"
-            + tier
-            + "_"
-            + name
-            + ".json",
+            + f"{tier}_{name}.{extension}",
         )
 
 
+def get_pattern_channel_shards(setup, tier, datatype=None):
+    if datatype is None:
+        datatype = "{datatype}"
+    return os.path.join(
+        f"{tmp_par_path(setup)}",
+        "shards",
+        "{experiment}-{period}-{run}-" + datatype + "-{timestamp}-tier_" + tier,
+    )
+
+
 def get_pattern_pars_tmp_channel(setup, tier, name=None, extension="json"):
     if name is None:
         return os.path.join(
@@ -507,6 +641,13 @@ def get_pattern_pars_tmp_channel(setup, tier, name=None, extension="json"):
         )
 
 
+def get_pattern_pars_tmp_batch(setup, tier):
+    return os.path.join(
+        f"{tmp_par_path(setup)}",
+        "{experiment}-{period}-{run}-cal-{timestamp}-{batch}-par_" + f"{tier}_batch",
+    )
+
+
 def get_pattern_plts_tmp_channel(setup, tier, name=None):
     if name is None:
         return os.path.join(
@@ -566,6 +707,14 @@ def get_pattern_log(setup, processing_step):
     )
 
 
+def get_pattern_jit_cache_warm_up(setup):
+    return os.path.join(
+        f"{tmp_par_path(setup)}",
+        "jit_cache",
+        "{experiment}-{period}-{run}-{datatype}-warm_jit_cache.json",
+    )
+
+
 def get_pattern_log_concat(setup, processing_step):
     return os.path.join(
         f"{tmp_log_path(setup)}",
@@ -0,0 +1,137 @@
+"""
+This module contains the functions for building the pulser masks of all channels
+of a run from the tcm files and for loading them in the per channel scripts
+"""
+
+import zipfile
+
+import numpy as np
+
+# version of the pulser mask files, checked on loading
+pulser_file_version = 1
+
+
+def channel_name(channel):
+    """Returns the ``ch{rawid:07d}`` name of a channel given as rawid or name."""
+    if isinstance(channel, str):
+        channel = int(channel[2:]) if channel.startswith("ch") else int(channel)
+    return f"ch{channel:07d}"
+
+
+def get_pulser_masks(array_id, array_idx, cumulative_length, multiplicity_threshold):
+    """
+    Computes the pulser masks of all channels in a tcm table in one pass.
+
+    An event is flagged as pulser if more than `multiplicity_threshold`
+    channels are in it, the same as ``get_tcm_pulser_ids`` in pygama which
+    does it for a single channel.
+
+    Parameters
+    ----------
+    array_id
+        channel of each hit in the tcm
+    array_idx
+        row of each hit in the channel's table
+    cumulative_length
+        cumulative number of hits of the tcm events
+    multiplicity_threshold
+        minimum number of channels for pulser events (exclusive)
+
+    Returns
+    -------
+    masks
+        dict of ``ch{rawid:07d}`` to the boolean mask over the rows of the channel
+    """
+    array_id = np.asarray(array_id)
+    array_idx = np.asarray(array_idx)
+    n_hits = np.diff(np.asarray(cumulative_length), prepend=0)
+    is_pulser = np.repeat(n_hits > multiplicity_threshold, n_hits)
+
+    order = np.argsort(array_id, kind="stable")
+    channels, starts, counts = np.unique(array_id[order], return_index=True, return_counts=True)
+    masks = {}
+    for channel, start, count in zip(channels, starts, counts):
+        hits = order[start : start + count]
+        mask = np.zeros(count, dtype=bool)
+        mask[array_idx[hits][is_pulser[hits]]] = True
+        masks[channel_name(int(channel))] = mask
+    return masks
+
+
+def concat_pulser_masks(masks_list):
+    """Concatenates the per channel masks of several tcm files in order."""
+    channels = sorted({channel for masks in masks_list for channel in masks})
+    return {
+        channel: np.concatenate([masks[channel] for masks in masks_list if channel in masks])
+        for channel in channels
+    }
+
+
+def write_pulser_masks(masks, pulser_file):
+    """
+    Writes the masks of all channels of a run into a single uncompressed ``.npz``
+    file, readable with ``numpy.load``. Each channel's mask is stored as packed bits
+    (``numpy.packbits``) under its name, next to the arrays ``channels`` and
+    ``n_rows`` with the number of rows of each mask, and ``version`` with the
+    `pulser_file_version`.
+    """
+    names = sorted(masks)
+    arrays = {name: np.packbits(np.asarray(masks[name], dtype=bool)) for name in names}
+    with open(pulser_file, "wb") as file:
+        # a file object, so numpy doesn't add the .npz extension
+        np.savez(
+            file,
+            version=np.array(pulser_file_version),
+            channels=np.array(names, dtype=str),
+            n_rows=np.array([len(masks[name]) for name in names], dtype=np.int64),
+            **arrays,
+        )
+
+
+def read_pulser_index(pulser_file):
+    """Returns the open ``.npz`` file and the number of rows of each channel in it."""
+    if not zipfile.is_zipfile(pulser_file):
+        msg = f"{pulser_file} is not a pulser mask file"
+        raise ValueError(msg)
+    data = np.load(pulser_file)
+    if "version" not in data.files:
+        data.close()
+        msg = f"{pulser_file} is not a pulser mask file"
+        raise ValueError(msg)
+    version = int(data["version"])
+    if version != pulser_file_version:
+        data.close()
+        msg = (
+            f"{pulser_file} has pulser mask file version {version}, expected {pulser_file_version}"
+        )
+        raise ValueError(msg)
+    return data, dict(zip(data["channels"].tolist(), data["n_rows"].tolist()))
+
+
+def load_pulser_mask(pulser_files, channel):
+    """
+    Returns the pulser mask of `channel` from one or several run pulser files,
+    the masks of several files are concatenated in the given order.
+    Channels not in a file have no rows in it.
+
+    The indices of all files are read first so the output is allocated once, only
+    the packed bits of the channel are then read and unpacked into it.
+    """
+    if isinstance(pulser_files, str):
+        pulser_files = [pulser_files]
+    name = channel_name(channel)
+    blocks = []
+    for pulser_file in pulser_files:
+        data, index = read_pulser_index(pulser_file)
+        if index.get(name, 0) > 0:
+            blocks.append((data, index[name]))
+        else:
+            data.close()
+
+    mask = np.empty(sum(n_rows for _, n_rows in blocks), dtype=bool)
+    start = 0
+    for data, n_rows in blocks:
+        with data:
+            mask[start : start + n_rows] = np.unpackbits(data[name], count=n_rows)
+        start += n_rows
+    return mask
@@ -0,0 +1,320 @@
+"""
+This module contains an in-process cache of the tables and configs read by the
+parameter generation scripts, so that stages run one after the other in the
+same process (e.g. by `pars_dsp_chain.py` or `pars_hit_chain.py`) don't read them
+again
+"""
+
+import copy
+import logging
+import os
+import pickle as pkl
+import re
+
+import lgdo
+import lgdo.lh5 as lh5
+import numpy as np
+import pandas as pd
+from pygama.pargen import utils as pargen_utils
+
+from . import channel_runs
+from .metadata_cache import MetadataSnapshot
+from .pulser import load_pulser_mask
+
+log = logging.getLogger(__name__)
+
+
+def _key(name, files):
+    if isinstance(files, (str, os.PathLike)):
+        files = [files]
+    return name.strip("/"), tuple(os.path.abspath(file) for file in files)
+
+
+def _attrs(obj):
+    return {key: value for key, value in obj.attrs.items() if key != "datatype"}
+
+
+def _positions(idx, n_rows, length):
+    """Converts the `idx` and `n_rows` arguments of ``LH5Store.read`` to row positions."""
+    if idx is None:
+        return np.arange(length if n_rows is None else min(n_rows, length))
+    if isinstance(idx, tuple):
+        idx = idx[0]
+    idx = np.asarray(idx)
+    if idx.dtype == bool:
+        idx = np.flatnonzero(idx)
+    return idx if n_rows is None else idx[:n_rows]
+
+
+def select_rows(obj, idx):
+    """
+    Returns the rows `idx` of an lgdo Table, WaveformTable or array as new
+    objects, the input is not modified.
+    """
+    if isinstance(obj, lgdo.WaveformTable):
+        return lgdo.WaveformTable(
+            t0=select_rows(obj.t0, idx),
+            dt=select_rows(obj.dt, idx),
+            values=select_rows(obj.values, idx),
+            attrs=_attrs(obj),
+        )
+    if isinstance(obj, lgdo.Table):
+        return lgdo.Table(
+            col_dict={name: select_rows(col, idx) for name, col in obj.items()},
+            attrs=_attrs(obj),
+        )
+    if isinstance(obj, (lgdo.Array, lgdo.ArrayOfEqualSizedArrays)):
+        return type(obj)(nda=obj.nda[idx], attrs=_attrs(obj))
+    msg = f"can't select rows of {type(obj).__name__}"
+    raise TypeError(msg)
+
+
+def concat_rows(objs):
+    """Returns the rows of several lgdo objects with the same structure concatenated."""
+    first = objs[0]
+    if isinstance(first, lgdo.WaveformTable):
+        return lgdo.WaveformTable(
+            t0=concat_rows([obj.t0 for obj in objs]),
+            dt=concat_rows([obj.dt for obj in objs]),
+            values=concat_rows([obj["values"] for obj in objs]),
+            attrs=_attrs(first),
+        )
+    if isinstance(first, lgdo.Table):
+        return lgdo.Table(
+            col_dict={name: concat_rows([obj[name] for obj in objs]) for name in first},
+            attrs=_attrs(first),
+        )
+    if isinstance(first, (lgdo.Array, lgdo.ArrayOfEqualSizedArrays)):
+        return type(first)(nda=np.concatenate([obj.nda for obj in objs]), attrs=_attrs(first))
+    msg = f"can't concatenate rows of {type(first).__name__}"
+    raise TypeError(msg)
+
+
+class StageCache:
+    """
+    Tables and configs shared between parameter generation stages run in one process.
+
+    Reads without `idx` or `n_rows` are kept in memory and later reads of the same
+    object from the same files, with any `idx`, `n_rows` or subset of the fields,
+    are served from memory. Tables written by a stage can be registered with
+    `append` so the next stage gets them from memory instead of reading back the file.
+    Returned objects are new objects so callers can add columns to them.
+    """
+
+    def __init__(self):
+        self.sto = lh5.LH5Store()
+        self.tables = {}
+        self.metadata = {}
+        self.configs = {}
+        self.pulser_masks = {}
+        self.objects = {}
+
+    def _from_memory(self, key, idx, n_rows, field_mask):
+        if key not in self.tables:
+            return None
+        obj, fields = self.tables[key]
+        if field_mask is not None:
+            if not isinstance(field_mask, (list, tuple)) or not isinstance(obj, lgdo.Table):
+                return None
+            if fields is not None and not set(field_mask) <= fields:
+                return None
+            obj = lgdo.Table(col_dict={field: obj[field] for field in field_mask})
+        elif fields is not None:
+            return None
+        rows = _positions(idx, n_rows, len(obj))
+        return select_rows(obj, rows), len(rows)
+
+    def _add_fields(self, key, name, files, field_mask):
+        """Reads the fields in `field_mask` missing from a table in memory and adds them to it."""
+        obj, fields = self.tables[key]
+        missing = [field for field in field_mask if field not in fields]
+        if len(missing) == 0:
+            return
+        extra = self.sto.read(name, files, field_mask=missing)[0]
+        for field in missing:
+            obj.add_column(field, extra[field])
+        fields.update(missing)
+
+    def read(self, name, files, idx=None, n_rows=None, field_mask=None, **kwargs):
+        """
+        Drop in replacement for ``LH5Store.read`` returning ``(obj, n_rows_read)``.
+        Fields requested from a table of which other fields are already in memory
+        are read on their own and added to it, so every field is read once.
+        """
+        key = _key(name, files)
+        if (
+            not kwargs
+            and isinstance(field_mask, (list, tuple))
+            and key in self.tables
+            and self.tables[key][1] is not None
+        ):
+            self._add_fields(key, name, files, field_mask)
+        if not kwargs:
+            cached = self._from_memory(key, idx, n_rows, field_mask)
+            if cached is not None:
+                return cached
+        # LH5Store.read takes sys.maxsize, not None, for all the rows
+        read_kwargs = kwargs if n_rows is None else {**kwargs, "n_rows": n_rows}
+        obj, n_rows_read = self.sto.read(
+            name, files, idx=idx, field_mask=field_mask, **read_kwargs
+        )
+        if (
+            idx is None
+            and n_rows is None
+            and not kwargs
+            and (field_mask is None or isinstance(field_mask, (list, tuple)))
+        ):
+            self.tables[key] = (obj, None if field_mask is None else set(field_mask))
+            obj = select_rows(obj, slice(None))
+        return obj, n_rows_read
+
+    def append(self, name, file, obj):
+        """Registers `obj` as appended to `name` in `file` e.g. after ``LH5Store.write``."""
+        key = _key(name, file)
+        if key in self.tables and self.tables[key][1] is None:
+            obj = concat_rows([self.tables[key][0], obj])
+        self.tables[key] = (obj, None)
+
+    def forget(self, name, files):
+        """Drops `name` in `files` from memory e.g. when the file is rewritten."""
+        self.tables.pop(_key(name, files), None)
+
+    def drop_tables(self):
+        """Drops the tables, masks and objects of a channel, the metadata and open files are kept."""
+        self.tables.clear()
+        self.pulser_masks.clear()
+        self.objects.clear()
+
+    def config_on(self, path, timestamp, datatype):
+        """
+        Returns ``LegendMetadata(path).on(timestamp, system=datatype)`` from the
+        cached metadata snapshot, it is only loaded once. A copy is returned so
+        callers can modify it.
+        """
+        if (path, timestamp, datatype) not in self.configs:
+            self.configs[(path, timestamp, datatype)] = MetadataSnapshot.load(
+                timestamp, datatype, configs=path
+            ).config
+        return copy.deepcopy(self.configs[(path, timestamp, datatype)])
+
+    def channelmap(self, path, timestamp):
+        """Returns ``LegendMetadata(path).channelmap(timestamp)``, see `config_on`."""
+        if (path, timestamp) not in self.metadata:
+            self.metadata[(path, timestamp)] = MetadataSnapshot.load(
+                timestamp, metadata=path
+            ).channelmap
+        return self.metadata[(path, timestamp)]
+
+    def load_data(
+        self,
+        files,
+        lh5_path,
+        cal_dict,
+        params,
+        cal_energy_param="cuspEmax_ctc_cal",
+        threshold=None,
+        return_selection_mask=False,
+    ):
+        """
+        ``pygama.pargen.utils.load_data`` for a list of files, from the tables in
+        memory. Only the fields of the files `params` and the `cal_dict` expressions
+        refer to are read, with `read` so the fields an earlier stage loaded are not
+        read again. The `cal_dict` operations, the selection of the `params` columns
+        and the `threshold` on `cal_energy_param` are then done as in pygama. Files
+        by run (a dict) are passed on to pygama.
+        """
+        if isinstance(files, dict):
+            return pargen_utils.load_data(
+                files,
+                lh5_path,
+                cal_dict,
+                params,
+                cal_energy_param=cal_energy_param,
+                threshold=threshold,
+                return_selection_mask=return_selection_mask,
+            )
+        if isinstance(files, (str, os.PathLike)):
+            files = [files]
+        keys = lh5.ls(files[0], lh5_path if lh5_path[-1] == "/" else lh5_path + "/")
+        keys = [key.split("/")[-1] for key in keys]
+        params = pargen_utils.get_params(keys + list(cal_dict.keys()), params)
+
+        # pygama evaluates all the cal_dict operations, so their inputs are read too
+        fields = set(params)
+        for info in cal_dict.values():
+            fields.update(re.findall(r"[A-Za-z_]\w*", info["expression"]))
+        table = self.read(lh5_path, files, field_mask=[key for key in keys if key in fields])[0]
+
+        df = pd.DataFrame(columns=params)
+        for outname, info in cal_dict.items():
+            outcol = table.eval(info["expression"], info.get("parameters", None))
+            table.add_column(outname, outcol)
+        for param in params:
+            df[param] = table[param]
+        if threshold is not None:
+            masks = df[cal_energy_param] > threshold
+            df = df.drop(np.where(~masks)[0])
+        else:
+            masks = np.ones(len(df), dtype=bool)
+
+        if return_selection_mask:
+            return df, masks
+        return df
+
+    def pulser_mask(self, pulser_files, channel):
+        """`load_pulser_mask` only loading the mask of a channel once."""
+        key = (tuple([pulser_files] if isinstance(pulser_files, str) else pulser_files), channel)
+        if key not in self.pulser_masks:
+            self.pulser_masks[key] = load_pulser_mask(pulser_files, channel)
+        return self.pulser_masks[key].copy()
+
+    def write_pickle(self, obj, path):
+        """Pickles `obj` to `path` and keeps it so `read_pickle` doesn't load it back."""
+        with open(path, "wb") as file:
+            pkl.dump(obj, file, protocol=pkl.HIGHEST_PROTOCOL)
+        self.objects[os.path.abspath(path)] = obj
+
+    def read_pickle(self, path):
+        """
+        Returns the object pickled to `path`, from memory if it was written with
+        `write_pickle`. Objects from memory are not copied, each one is expected to be
+        read by a single later stage.
+        """
+        path = os.path.abspath(path)
+        if path not in self.objects:
+            with open(path, "rb") as file:
+                return pkl.load(file)
+        return self.objects.pop(path)
+
+
+def run_chain(
+    stages,
+    intermediates=(),
+    keep_intermediates=False,
+    resume=False,
+    log_file=None,
+    cache=None,
+):
+    """
+    `channel_runs.run_chain` with the stages sharing a `StageCache`, a new one
+    unless `cache` is given.
+    """
+    if cache is None:
+        cache = StageCache()
+    channel_runs.run_chain(
+        stages,
+        cache,
+        intermediates=intermediates,
+        keep_intermediates=keep_intermediates,
+        resume=resume,
+        log_file=log_file,
+    )
+
+
+def run_channels(main, argv=None):
+    """
+    Entry point of the per channel scripts, `channel_runs.run_channels` with the
+    channels of a job sharing a `StageCache`, i.e. the metadata, configs and open
+    files.
+    """
+    return channel_runs.run_channels(main, StageCache, argv)
@@ -0,0 +1,84 @@
+"""
+This module contains the building of the hardware tcms of all FlashCam IDs of a
+raw file in one pass: the coincidence columns of all channels are read once,
+partitioned by fcid in memory and the ``hardware_tcm_{fcid}`` tables are built
+and written one after the other to the output file
+"""
+
+import logging
+import re
+import time
+
+import lgdo
+import lgdo.lh5 as lh5
+from daq2lh5.orca import orca_flashcam
+from pygama.evt import tcm as ptcm
+
+log = logging.getLogger(__name__)
+
+
+def fcid_channels(raw_file):
+    """Returns the raw tables of the channels of `raw_file` by FlashCam ID."""
+    channels = {}
+    for ch in lh5.ls(raw_file, "/ch*"):
+        channels.setdefault(orca_flashcam.get_fcid(int(ch[2:])), []).append(f"/{ch}/raw")
+    return channels
+
+
+def build_fcid_tcms(
+    raw_file,
+    out_file,
+    coin_col,
+    hash_func=r"\d+",
+    coin_window=0,
+    window_ref="last",
+    wo_mode="o",
+):
+    """
+    Builds the ``hardware_tcm_{fcid}`` table of each FlashCam ID of `raw_file`, as
+    ``pygama.evt.build_tcm`` does for the channels of one fcid, from a single read
+    of the coincidence column of all channels. The coincidence data and the
+    attributes of the tables are the ones ``build_tcm`` has, so the tables are
+    the same as from ``build_tcm`` per fcid.
+
+    Returns
+    -------
+    stats
+        channels, hits, events and build time of each fcid, plus the time of the
+        read of all channels under ``"read_time"``
+    """
+    store = lh5.LH5Store()
+
+    start = time.time()
+    channels = fcid_channels(raw_file)
+    coin_data = {
+        fcid: [store.read(f"{table}/{coin_col}", raw_file)[0].nda for table in tables]
+        for fcid, tables in channels.items()
+    }
+    stats = {"read_time": time.time() - start}
+
+    for fcid, tables in channels.items():
+        start = time.time()
+        # build_tcm keeps the names lh5.ls gives, without the leading "/"
+        names = [table.lstrip("/") for table in tables]
+        array_ids = list(range(len(names)))
+        if hash_func is not None:
+            array_ids = [int(re.search(hash_func, table).group()) for table in names]
+        tcm_cols = ptcm.generate_tcm_cols(
+            coin_data.pop(fcid),
+            coin_window=coin_window,
+            window_ref=window_ref,
+            array_ids=array_ids,
+        )
+        tcm = lgdo.Struct(
+            obj_dict={key: lgdo.Array(nda=value) for key, value in tcm_cols.items()},
+            attrs={"tables": str(names), "hash_func": str(hash_func)},
+        )
+        store.write(tcm, f"hardware_tcm_{fcid}", out_file, wo_mode=wo_mode)
+        stats[fcid] = {
+            "n_channels": len(tables),
+            "n_hits": len(tcm_cols["array_id"]),
+            "n_events": len(tcm_cols["cumulative_length"]),
+            "time": time.time() - start,
+        }
+    return stats
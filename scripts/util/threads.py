@@ -0,0 +1,54 @@
+"""
+This module contains the threading policy of the scripts: the thread pools of
+numpy (BLAS), numexpr and numba are pinned to the ``threads`` of the rule so jobs
+running side by side don't oversubscribe the node
+"""
+
+import os
+import sys
+
+# doesn't load any thread pool on import, so it's safe before numpy
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# Snakemake sets the first ones to the rule's threads for shell commands
+thread_vars = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMEXPR_MAX_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+
+def job_threads():
+    """Returns the threads of the job, Snakemake passes them in ``OMP_NUM_THREADS``."""
+    return max(1, int(os.environ.get("OMP_NUM_THREADS", "1")))
+
+
+def set_threads(parallel=False, n_threads=None):
+    """
+    Pins the thread pools to the threads of the job, to be called before
+    importing numpy, numexpr, numba and pygama. Scripts doing heavy fits opt in with
+    `parallel` to pygama's parallel numba kernels (``PYGAMA_PARALLEL``), which
+    are only used with more than one thread. Pools of libraries already imported
+    (e.g. in the worker pool) are limited as well. `n_threads` overrides the
+    threads of the job. Returns the number of threads.
+    """
+    if n_threads is None:
+        n_threads = job_threads()
+    for var in thread_vars:
+        os.environ[var] = str(n_threads)
+    os.environ["PYGAMA_PARALLEL"] = "true" if parallel and n_threads > 1 else "false"
+
+    if "numexpr" in sys.modules:
+        sys.modules["numexpr"].set_num_threads(n_threads)
+    if "numba" in sys.modules:
+        numba = sys.modules["numba"]
+        numba.set_num_threads(min(n_threads, numba.config.NUMBA_NUM_THREADS))
+    if "numpy" in sys.modules and threadpool_limits is not None:
+        threadpool_limits(n_threads)
+    return n_threads
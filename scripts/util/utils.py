@@ -7,9 +7,13 @@ from timestamp to unix time
 
 import copy
 import os
+import shlex
 import string
+import tempfile
 from datetime import datetime
 
+import numpy as np
+
 # from dateutil import parser
 
 # For testing/debugging, use
@@ -149,6 +153,10 @@ def pars_path(setup):
     return setup["paths"]["par"]
 
 
+def file_index_path(setup):
+    return os.path.join(pars_path(setup), "file_index.sqlite")
+
+
 def get_pars_path(setup, tier):
     if tier == "raw":
         return par_raw_path(setup)
@@ -199,11 +207,71 @@ def filelist_path(setup):
     return setup["paths"]["tmp_filelists"]
 
 
+def use_channel_shards(setup):
+    return setup.get("options", {}).get("channel_shards", False)
+
+
+def use_fused_pars(setup):
+    return setup.get("options", {}).get("fused_pars", False)
+
+
+def fused_raw_blind(setup):
+    # "blind" to write only the blinded phy raw files from the daq files, "both" to
+    # write the raw files as well, false for separate raw and blinding jobs
+    return setup.get("options", {}).get("fused_raw_blind", False)
+
+
+def channel_batch_size(setup):
+    # channels per job of the fused par chains, 0 for a job per channel
+    return setup.get("options", {}).get("channel_batch", 0)
+
+
+def jit_cache_path(setup):
+    # an empty path disables the numba cache
+    return setup["paths"].get("jit_cache", "")
+
+
+def metadata_cache_path(setup):
+    # an empty path keeps the metadata snapshots in the node's temporary directory
+    return setup["paths"].get("metadata_cache", "")
+
+
+def use_worker_pool(setup):
+    return setup.get("options", {}).get("worker_pool", False)
+
+
+def worker_pool_socket(setup):
+    # unix socket paths are limited to ~100 characters so the default is in /tmp
+    return setup.get("paths", {}).get(
+        "worker_pool_socket",
+        os.path.join(tempfile.gettempdir(), f"legend-dataflow-{os.getuid()}.sock"),
+    )
+
+
+def worker_pool_cmd(setup, command):
+    script = os.path.join(os.path.dirname(os.path.dirname(__file__)), "worker_pool.py")
+    return f"python3 -B {script} {command} --socket {worker_pool_socket(setup)}"
+
+
+def pool_runcmd(setup):
+    """
+    Command prefix running python scripts in the worker pool, other commands
+    (and all commands if the pool is not up) are run with `runcmd`.
+    """
+    return f"{worker_pool_cmd(setup, 'run')} --fallback {shlex.quote(runcmd(setup))} --"
+
+
 def runcmd(setup):
     exec_cmd = setup["execenv"]["cmd"]
     exec_arg = setup["execenv"]["arg"]
     path_install = setup["paths"]["install"]
-    return f"PYTHONUSERBASE={path_install} APPTAINERENV_PREPEND_PATH={path_install}/bin {exec_cmd} {exec_arg}"
+    cmd = f"PYTHONUSERBASE={path_install} APPTAINERENV_PREPEND_PATH={path_install}/bin"
+    if jit_cache_path(setup) != "":
+        cache = jit_cache_path(setup)
+        cmd += f" DATAFLOW_JIT_CACHE={cache} NUMBA_CACHE_DIR={cache}"
+    if metadata_cache_path(setup) != "":
+        cmd += f" DATAFLOW_META_CACHE={metadata_cache_path(setup)}"
+    return f"{cmd} {exec_cmd} {exec_arg}"
 
 
 def subst_vars_impl(x, var_values, ignore_missing=False):
@@ -253,27 +321,6 @@ def subst_vars_in_snakemake_config(workflow, config):
     )
 
 
-def run_splitter(files):
-    """
-    Returns list containing lists of each run
-    """
-
-    runs = []
-    run_files = []
-    for file in files:
-        base = os.path.basename(file)
-        file_name = os.path.splitext(base)[0]
-        parts = file_name.split("-")
-        run_no = parts[3]
-        if run_no not in runs:
-            runs.append(run_no)
-            run_files.append([])
-        for i, run in enumerate(runs):
-            if run == run_no:
-                run_files[i].append(file)
-    return run_files
-
-
 def unix_time(value):
     if isinstance(value, str):
         return datetime.timestamp(datetime.strptime(value, "%Y%m%dT%H%M%SZ"))
@@ -282,6 +329,46 @@ def unix_time(value):
         raise ValueError(msg)
 
 
+def unix_time_array(values):
+    """
+    Converts a list of timestamps of the form ``YYYYMMDDTHHMMSSZ`` to an array
+    of int64 unix times in one vectorized pass. Unlike `unix_time`, the
+    timestamps are taken to be in UTC as indicated by the trailing ``Z``.
+    """
+    chars = np.asarray(values, dtype=str).reshape(-1)
+    # longer strings would be truncated by the conversion to 16 characters
+    if np.any(np.char.str_len(chars) != 16):
+        msg = "Can't convert timestamps to unix time, expected format YYYYMMDDTHHMMSSZ"
+        raise ValueError(msg)
+    chars = chars.astype("U16")
+    codes = chars.view(np.uint32).reshape(-1, 16).astype(np.int64)
+    digits = codes - ord("0")
+    digit_cols = [*range(8), *range(9, 15)]
+    if (
+        np.any(codes[:, 8] != ord("T"))
+        or np.any(codes[:, 15] != ord("Z"))
+        or np.any((digits[:, digit_cols] < 0) | (digits[:, digit_cols] > 9))
+    ):
+        msg = "Can't convert timestamps to unix time, expected format YYYYMMDDTHHMMSSZ"
+        raise ValueError(msg)
+
+    def number(cols):
+        out = np.zeros(len(digits), dtype=np.int64)
+        for col in cols:
+            out = out * 10 + digits[:, col]
+        return out
+
+    months = (number(range(4)) - 1970) * 12 + number(range(4, 6)) - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    days += number(range(6, 8)) - 1
+    return (
+        days * 86400
+        + number(range(9, 11)) * 3600
+        + number(range(11, 13)) * 60
+        + number(range(13, 15))
+    )
+
+
 def set_last_rule_name(workflow, new_name):
     """Sets the name of the most recently created rule to be `new_name`.
     Useful when creating rules dynamically (i.e. unnamed).
@@ -0,0 +1,265 @@
+"""
+This module contains a pool of warm Python interpreters which runs the scripts of the
+workflow in-process, so the short jobs don't pay for the container and interpreter
+start and the imports every time
+"""
+
+import importlib
+import json
+import logging
+import os
+import runpy
+import shlex
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+import traceback
+
+log = logging.getLogger(__name__)
+
+# environment variables of the job passed on to the script, the rest of the
+# environment is the one the pool was started in (i.e. inside the container)
+forwarded_env = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+)
+
+default_preload = (
+    "numpy",
+    "scipy",
+    "pandas",
+    "matplotlib",
+    "h5py",
+    "lgdo",
+    "lgdo.lh5",
+    "dspeed",
+    "legendmeta",
+    "pygama.pargen.utils",
+    "pygama.pargen.dsp_optimize",
+)
+
+_header = struct.Struct("<Q")
+_exit_code = struct.Struct("<i")
+
+
+def _recv_exact(conn, size):
+    data = b""
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            msg = "connection closed"
+            raise ConnectionError(msg)
+        data += chunk
+    return data
+
+
+def _receive_request(conn):
+    """Returns the request and the stdin, stdout, stderr file descriptors of the client."""
+    data, fds, _, _ = socket.recv_fds(conn, _header.size, 3)
+    data += _recv_exact(conn, _header.size - len(data))
+    (length,) = _header.unpack(data)
+    return json.loads(_recv_exact(conn, length)), fds
+
+
+def parse_command(command):
+    """
+    Returns ``(script, argv)`` of a ``python3 [options] script.py args...`` command,
+    None for other commands.
+    """
+    if len(command) < 2 or os.path.basename(command[0]) not in ("python", "python3"):
+        return None
+    pos = 1
+    while pos < len(command) and command[pos].startswith("-"):
+        # options with values (-c, -m, -W ...) are not run in the pool
+        if command[pos] not in ("-B", "-u", "-O", "-E", "-s"):
+            return None
+        pos += 1
+    if pos == len(command) or not command[pos].endswith(".py"):
+        return None
+    return command[pos], command[pos + 1 :]
+
+
+def run_script(script, argv):
+    """
+    Runs `script` in this process and returns its exit code. Scripts imported
+    by the pool are called through their ``main(argv)``, others are run as
+    ``__main__``.
+    """
+    script = os.path.abspath(script)
+    script_dir = os.path.dirname(script)
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+    sys.argv = [script, *argv]
+    module = sys.modules.get(os.path.splitext(os.path.basename(script))[0])
+    try:
+        if module is not None and getattr(module, "__file__", None) == script:
+            module.main(argv)
+        else:
+            runpy.run_path(script, run_name="__main__")
+    except SystemExit as exit:
+        if exit.code is None or isinstance(exit.code, int):
+            return exit.code or 0
+        sys.stderr.write(f"{exit.code}\n")
+        return 1
+    except BaseException:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _reset_logging():
+    """
+    Removes the handlers of the pool from the root logger and restores its default
+    level, so the scripts' ``logging.basicConfig`` configures it as in a new process.
+    """
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.setLevel(logging.WARNING)
+
+
+def _handle(conn):
+    """Runs a job in a forked worker: the script's output goes to the client's stdout/stderr."""
+    request, fds = _receive_request(conn)
+    if request.get("command") == "stop":
+        os.kill(os.getppid(), signal.SIGTERM)
+        conn.sendall(_exit_code.pack(0))
+        return
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request["cwd"])
+    os.environ.update(request["env"])
+    _reset_logging()
+    code = run_script(request["script"], request["argv"])
+    sys.stdout.flush()
+    sys.stderr.flush()
+    conn.sendall(_exit_code.pack(code))
+
+
+def serve(socket_path, workers=1, preload=default_preload):
+    """
+    Imports the `preload` modules then accepts jobs on `socket_path`, each job is
+    run in a process forked from the warm server with at most `workers` at once.
+    Scripts can be preloaded as well (by their module name with the scripts
+    directory on the path) which are then called through their ``main(argv)``.
+    """
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            log.warning(f"failed to preload {module}", exc_info=True)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(64)
+
+    def shutdown(*_):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    running = set()
+    log.info(f"worker pool with {workers} workers listening on {socket_path}")
+    try:
+        while True:
+            while len(running) >= workers:
+                running.discard(os.wait()[0])
+            conn, _ = server.accept()
+            while running:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+                if pid == 0:
+                    break
+                running.discard(pid)
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                server.close()
+                try:
+                    _handle(conn)
+                finally:
+                    os._exit(0)
+            conn.close()
+            running.add(pid)
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def _send(socket_path, request):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    with client:
+        payload = json.dumps(request).encode()
+        socket.send_fds(client, [_header.pack(len(payload))], [0, 1, 2])
+        client.sendall(payload)
+        return _exit_code.unpack(_recv_exact(client, _exit_code.size))[0]
+
+
+def submit(socket_path, script, argv, cwd=None):
+    """Runs `script` with `argv` in the pool and returns its exit code."""
+    return _send(
+        socket_path,
+        {
+            "script": os.path.abspath(script),
+            "argv": list(argv),
+            "cwd": os.getcwd() if cwd is None else cwd,
+            "env": {name: os.environ[name] for name in forwarded_env if name in os.environ},
+        },
+    )
+
+
+def stop(socket_path):
+    """Stops the pool listening on `socket_path`, if any."""
+    if os.path.exists(socket_path):
+        try:
+            _send(socket_path, {"command": "stop"})
+        except (ConnectionError, OSError):
+            os.remove(socket_path)
+
+
+def run(socket_path, command, fallback):
+    """
+    Runs `command` in the pool if it is a python script and the pool is up,
+    otherwise runs it with the `fallback` prefix (e.g. the container command).
+    Returns the exit code.
+    """
+    parsed = parse_command(command)
+    if parsed is not None and os.path.exists(socket_path):
+        try:
+            return submit(socket_path, *parsed)
+        except (ConnectionRefusedError, FileNotFoundError):
+            log.warning(f"worker pool at {socket_path} not reachable, running {command[0]}")
+    return subprocess.call(f"{fallback} {shlex.join(command)}", shell=True)
+
+
+def start(command, socket_path, log_file, timeout=300):
+    """
+    Starts a pool with `command` (which runs `serve` e.g. inside the container)
+    in the background and waits until it listens on `socket_path`.
+    """
+    stop(socket_path)
+    with open(log_file, "w") as f:
+        process = subprocess.Popen(
+            command, shell=True, stdout=f, stderr=subprocess.STDOUT, start_new_session=True
+        )
+    start_time = time.time()
+    while not os.path.exists(socket_path):
+        if process.poll() is not None:
+            msg = f"worker pool exited with {process.returncode}, see {log_file}"
+            raise RuntimeError(msg)
+        if time.time() - start_time > timeout:
+            process.terminate()
+            msg = f"worker pool did not start within {timeout}s, see {log_file}"
+            raise RuntimeError(msg)
+        time.sleep(0.5)
+    return process
@@ -0,0 +1,122 @@
+"""
+Compiles the numba kernels used by the dsp and hit configs into the shared cache
+(see `util.jit_cache`) so the jobs load them from there. The dsp is run on the first
+rows of each distinct processing chain config with one raw file, the hit operations
+are evaluated on its output. Holds the cache lock while doing so, jobs starting in
+the meantime wait for it.
+"""
+
+import argparse
+import json
+import logging
+import os
+import pathlib
+import re
+import tempfile
+import time
+
+from util.jit_cache import jit_cache_lock, setup_jit_cache
+
+cache_dir = setup_jit_cache(warm_up=True)
+os.environ["LGDO_BOUNDSCHECK"] = "false"
+os.environ["DSPEED_BOUNDSCHECK"] = "false"
+
+import lgdo.lh5 as lh5
+import numpy as np
+from dspeed import build_dsp
+from legendmeta.catalog import Props
+from util.metadata_cache import MetadataSnapshot
+
+
+def replace_list_with_array(dic):
+    # as in build_dsp.py so the kernels are compiled for the same dtypes
+    for key, value in dic.items():
+        if isinstance(value, dict):
+            dic[key] = replace_list_with_array(value)
+        elif isinstance(value, list):
+            dic[key] = np.array(value, dtype="float32")
+    return dic
+
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument("--configs", help="configs path", type=str, required=True)
+argparser.add_argument("--datatype", help="Datatype", type=str, required=True)
+argparser.add_argument("--timestamp", help="Timestamp", type=str, required=True)
+argparser.add_argument("--pars_file", help="dsp pars", nargs="*", default=[])
+argparser.add_argument("--log", help="log file", type=str)
+argparser.add_argument("--input", help="raw file", type=str, required=True)
+argparser.add_argument("--n_rows", help="rows processed per config", type=int, default=64)
+argparser.add_argument("--output", help="summary of the warm-up", type=str, required=True)
+args = argparser.parse_args()
+
+pathlib.Path(os.path.dirname(args.log)).mkdir(parents=True, exist_ok=True)
+logging.basicConfig(level=logging.DEBUG, filename=args.log, filemode="w")
+logging.getLogger("numba").setLevel(logging.INFO)
+logging.getLogger("parse").setLevel(logging.INFO)
+logging.getLogger("lgdo").setLevel(logging.INFO)
+log = logging.getLogger(__name__)
+
+if cache_dir is None:
+    msg = "DATAFLOW_JIT_CACHE is not set, nothing to warm up"
+    raise RuntimeError(msg)
+
+configs = MetadataSnapshot.load(args.timestamp, args.datatype, configs=args.configs)
+rule_dict = configs.config["snakemake_rules"]
+dsp_configs = rule_dict["tier_dsp"]["inputs"]["processing_chain"]
+hit_configs = rule_dict["tier_hit"]["inputs"]["hit_config"]
+
+database = Props.read_from(
+    [file for file in args.pars_file if os.path.splitext(file)[1] in (".json", ".yml")],
+    subst_pathvar=True,
+)
+database = replace_list_with_array(database)
+
+raw_channels = [channel for channel in lh5.ls(args.input) if re.match("(ch\\d{7})", channel)]
+
+# one channel per distinct config, the kernels only depend on the config and the dtypes
+chan_config = {}
+for channel, file in dsp_configs.items():
+    if channel.split("/")[0] in raw_channels and file not in chan_config.values():
+        chan_config[channel] = file
+log.info(f"warming up {len(chan_config)} dsp configs with {args.input}")
+
+summary = {"dsp": {}, "hit": {}}
+with jit_cache_lock(cache_dir, exclusive=True), tempfile.TemporaryDirectory() as tmp_dir:
+    dsp_file = os.path.join(tmp_dir, "dsp.lh5")
+    start = time.time()
+    build_dsp(
+        args.input,
+        dsp_file,
+        {},
+        database={
+            channel.split("/")[0]: database.get(channel.split("/")[0], {})
+            for channel in chan_config
+        },
+        chan_config={channel: configs.read(file) for channel, file in chan_config.items()},
+        n_max=args.n_rows,
+        write_mode="r",
+    )
+    summary["dsp"] = {"configs": sorted(set(chan_config.values())), "time": time.time() - start}
+    log.info(f"dsp warm-up finished in {time.time() - start:.2f}s")
+
+    # the hit pars aren't known yet, operations needing them are skipped
+    start = time.time()
+    done = []
+    for channel, file in hit_configs.items():
+        if file in done or f"{channel}/dsp" not in lh5.ls(dsp_file, f"{channel}/"):
+            continue
+        table = lh5.read(f"{channel}/dsp", dsp_file)
+        for name, info in configs.read(file).get("operations", {}).items():
+            try:
+                table.add_column(
+                    name, table.eval(info["expression"], info.get("parameters", None))
+                )
+            except Exception as e:
+                log.debug(f"{channel}: skipped {name}: {e}")
+        done.append(file)
+    summary["hit"] = {"configs": sorted(done), "time": time.time() - start}
+    log.info(f"hit warm-up finished in {time.time() - start:.2f}s")
+
+pathlib.Path(os.path.dirname(args.output)).mkdir(parents=True, exist_ok=True)
+with open(args.output, "w") as f:
+    json.dump({"cache": cache_dir, "input": args.input, **summary}, f, indent=4)
@@ -0,0 +1,58 @@
+"""
+Starts, stops and submits to a pool of warm Python interpreters, see
+`util.worker_pool`. ``serve`` is run inside the container, ``run`` replaces the
+container command in the rules: it runs python scripts in the pool and any other
+command (or all commands if the pool is not up) with the fallback command.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from util.jit_cache import setup_jit_cache
+
+setup_jit_cache()
+os.environ["LGDO_BOUNDSCHECK"] = "false"
+os.environ["DSPEED_BOUNDSCHECK"] = "false"
+os.environ["PYGAMA_PARALLEL"] = "false"
+os.environ["PYGAMA_FASTMATH"] = "false"
+
+from util.worker_pool import default_preload, run, serve, stop
+
+argparser = argparse.ArgumentParser()
+subparsers = argparser.add_subparsers(dest="command", required=True)
+
+serve_parser = subparsers.add_parser("serve", help="start the pool")
+serve_parser.add_argument("--socket", help="socket path", type=str, required=True)
+serve_parser.add_argument("--workers", help="jobs run at once", type=int, default=1)
+serve_parser.add_argument(
+    "--preload",
+    help="modules imported before the first job, scripts with a main(argv) can be given by name",
+    nargs="*",
+    type=str,
+    default=list(default_preload),
+)
+serve_parser.add_argument("--log", help="log file", type=str)
+
+run_parser = subparsers.add_parser("run", help="run a command in the pool")
+run_parser.add_argument("--socket", help="socket path", type=str, required=True)
+run_parser.add_argument(
+    "--fallback", help="prefix for commands not run in the pool", type=str, default=""
+)
+run_parser.add_argument("cmd", help="command", nargs=argparse.REMAINDER)
+
+stop_parser = subparsers.add_parser("stop", help="stop the pool")
+stop_parser.add_argument("--socket", help="socket path", type=str, required=True)
+
+args = argparser.parse_args()
+
+if args.command == "serve":
+    logging.basicConfig(level=logging.INFO, filename=args.log, filemode="w")
+    logging.getLogger("numba").setLevel(logging.INFO)
+    serve(args.socket, workers=args.workers, preload=args.preload)
+elif args.command == "run":
+    cmd = args.cmd[1:] if args.cmd[:1] == ["--"] else args.cmd
+    sys.exit(run(args.socket, cmd, args.fallback))
+else:
+    stop(args.socket)
@@ -0,0 +1,66 @@
+"""
+The list based implementations `pars_key_resolve.generate_par_keylist` and
+`pars_key_resolve.match_all_entries` replaced, and synthetic keys to compare them
+on. Used by the tests and by ``benchmarks/par_keylist.py``.
+"""
+
+import numpy as np
+from scripts.util.create_pars_keylist import pars_key_resolve
+from scripts.util.FileKey import FileKey, ProcessingFileKey
+
+
+def list_generate_par_keylist(keys):
+    keylist = []
+    keys = sorted(keys, key=FileKey.get_unix_timestamp)
+    keylist.append(keys[0])
+    for key in keys[1:]:
+        matched_key = pars_key_resolve.match_keys(keylist[-1], key)
+        if matched_key not in keylist:
+            keylist.append(matched_key)
+    return keylist
+
+
+def list_match_entries(entry1, entry2):
+    datatype2 = ProcessingFileKey.get_filekey_from_filename(entry2.apply[0]).datatype
+    for entry in entry1.apply:
+        if ProcessingFileKey.get_filekey_from_filename(entry).datatype != datatype2:
+            entry2.apply.append(entry)
+
+
+def list_match_all_entries(entrylist, name_dict):
+    out_list = []
+    out_list.append(pars_key_resolve.from_filekey(entrylist[0], name_dict))
+    for entry in entrylist[1:]:
+        new_entry = pars_key_resolve.from_filekey(entry, name_dict)
+        list_match_entries(out_list[-1], new_entry)
+        out_list.append(new_entry)
+    return out_list
+
+
+def make_keys(n_keys, n_runs, run_length=10**5, lar_fraction=0.1, seed=0):
+    """
+    Synthetic keys of `n_runs` calibration runs of `run_length` seconds
+    (overlapping ones are interleaved) with a fraction of lar keys, in random
+    order and with some duplicates.
+    """
+    rng = np.random.default_rng(seed)
+    run_start = np.sort(rng.choice(4 * 10**7, n_runs, replace=False)) + 1.6 * 10**9
+    run_idx = rng.integers(0, n_runs, n_keys)
+    times = run_start[run_idx] + rng.integers(0, run_length, n_keys)
+    datatypes = rng.choice(["cal", "lar"], n_keys, p=[1 - lar_fraction, lar_fraction])
+    timestamps = np.datetime_as_string(times.astype("datetime64[s]"), unit="s")
+    keys = [
+        FileKey(
+            "l200",
+            f"p{idx // 50:02d}",
+            f"r{idx % 50:03d}",
+            datatype,
+            f"{ts.replace('-', '').replace(':', '')}Z",
+        )
+        for idx, datatype, ts in zip(run_idx, datatypes, timestamps)
+    ]
+    return keys + keys[: n_keys // 100]
+
+
+def to_jsonl(entrylist):
+    return "".join(f"{entry.get_json()}\n" for entry in entrylist)
@@ -1,21 +1,52 @@
 import json
 import os
+import subprocess
+import sys
+import time
 from pathlib import Path
+from types import SimpleNamespace
 
+import numpy as np
+import pytest
 from scripts.util import (
     CalibCatalog,
     FileKey,
+    ProcessingFileKey,
     pars_catalog,
     pars_key_resolve,
     subst_vars,
     unix_time,
 )
-from scripts.util.patterns import get_pattern_tier_daq, get_pattern_tier_dsp
+from scripts.util.channel_index import ChannelIndex
+from scripts.util.channel_runs import get_channels, run_chain, run_channels
+from scripts.util.coincidences import match_timestamps
+from scripts.util.discharges import get_recovery_mask
+from scripts.util.dsp_settings import best_trial, get_dsp_settings, write_dsp_settings
+from scripts.util.FileIndex import FileIndex
+from scripts.util.FileKey import per_grouper, run_grouper
+from scripts.util.jit_cache import jit_cache_lock, setup_jit_cache
+from scripts.util.KeyTable import KeyTable
+from scripts.util.patterns import (
+    compile_pattern,
+    expand,
+    get_pattern_tier_daq,
+    get_pattern_tier_dsp,
+)
+from scripts.util.pulser import get_pulser_masks, load_pulser_mask, write_pulser_masks
+from scripts.util.threads import set_threads, thread_vars
 from scripts.util.utils import (
     par_dsp_path,
     par_overwrite_path,
     tier_dsp_path,
     tier_path,
+    unix_time_array,
+)
+from scripts.util.worker_pool import parse_command, stop
+from tests.par_keylist_reference import (
+    list_generate_par_keylist,
+    list_match_all_entries,
+    make_keys,
+    to_jsonl,
 )
 
 testprod = Path(__file__).parent / "dummy_cycle"
@@ -131,3 +162,947 @@ def test_pars_loading():
             "dsp/cal/p00/r000/l200-p00-r000-cal-T%-par_dsp_energy-overwrite.json",
         ),
     }
+
+
+def test_recovery_mask():
+    rng = np.random.default_rng(42)
+    timestamps = np.sort(rng.uniform(0, 10, 5000))
+    discharges = rng.random(5000) < 0.01
+    expected = np.zeros(len(timestamps), dtype=bool)
+    for tstamp in timestamps[discharges]:
+        expected |= ((timestamps - tstamp) < 0.01) & ((timestamps - tstamp) > 0)
+    assert np.array_equal(get_recovery_mask(timestamps, discharges, window=0.01), expected)
+
+    # concatenated files are not globally sorted
+    order = np.concatenate([np.arange(2500, 5000), np.arange(0, 2500)])
+    assert np.array_equal(
+        get_recovery_mask(timestamps[order], discharges[order], window=0.01), expected[order]
+    )
+    assert not get_recovery_mask(timestamps, np.zeros(len(timestamps), dtype=bool)).any()
+
+
+def test_match_timestamps():
+    rng = np.random.default_rng(1)
+    trigger = rng.uniform(0, 100, 2000)
+    muon = rng.uniform(0, 100, 300)
+    jitter = 0.05
+    flag, idx = match_timestamps(trigger, muon, jitter)
+    for i, tstamp in enumerate(trigger):
+        in_window = np.flatnonzero((muon >= tstamp) & (muon <= tstamp + jitter))
+        assert flag[i] == (len(in_window) > 0)
+        if flag[i]:
+            assert idx[i] == in_window[np.argmin(muon[in_window])]
+        else:
+            assert idx[i] == -1
+    flag, idx = match_timestamps(trigger, [], jitter)
+    assert not flag.any()
+    assert (idx == -1).all()
+
+
+def test_calib_catalog_cache(tmp_path):
+    catalog_file = tmp_path / "validity.jsonl"
+    entry = {"valid_from": "20230101T123456Z", "category": "all", "apply": ["a.json"]}
+    catalog_file.write_text(json.dumps(entry) + "\n")
+    catalog = CalibCatalog.read_cached(catalog_file)
+    assert CalibCatalog.read_cached(str(catalog_file)) is catalog
+
+    files = CalibCatalog.get_calib_files(catalog_file, "20230102T000000Z")
+    files.append("b.json")
+    assert CalibCatalog.get_calib_files(catalog_file, "20230102T000000Z") == ["a.json"]
+
+    entry2 = {"valid_from": "20230103T000000Z", "category": "all", "apply": ["c.json"]}
+    catalog_file.write_text(json.dumps(entry) + "\n" + json.dumps(entry2) + "\n")
+    assert CalibCatalog.get_calib_files(catalog_file, "20230104T000000Z") == ["c.json"]
+    assert CalibCatalog.read_cached(catalog_file) is not catalog
+
+
+def test_calib_for_many():
+    assert list(unix_time_array(["20230101T123456Z", "19700101T000001Z"])) == [1672576496, 1]
+    with pytest.raises(ValueError, match="expected format YYYYMMDDTHHMMSSZ"):
+        unix_time_array(["20230101T123456Z", "20230101T123456Zextra"])
+
+    catalog = CalibCatalog.read_from(os.path.join(par_dsp_path(setup), "validity.jsonl"))
+    timestamps = ["20230203T000000Z", "20230101T123456Z", "20230115T000000Z", "20230102T000000Z"]
+    groups = catalog.calib_for_many(timestamps)
+    assert [list(idxs) for _, idxs in groups] == [[1, 3], [2], [0]]
+    for files, idxs in groups:
+        for idx in idxs:
+            assert files == catalog.calib_for(timestamps[idx])
+
+    with pytest.raises(RuntimeError):
+        catalog.calib_for_many(["20221231T000000Z"])
+    assert catalog.calib_for_many(["20221231T000000Z"], allow_none=True)[0][0] is None
+
+    par_files = pars_catalog.get_par_files_many(setup, timestamps, "dsp")
+    for timestamp in timestamps:
+        assert par_files[timestamp] == pars_catalog.get_par_file(setup, timestamp, "dsp")
+
+
+def test_precompute_par_files(monkeypatch):
+    resolved = []
+    get_par_files_many = pars_catalog.get_par_files_many
+
+    def count(setup, timestamps, tier):
+        resolved.append(list(timestamps))
+        return get_par_files_many(setup, timestamps, tier)
+
+    monkeypatch.setattr(pars_catalog, "get_par_files_many", staticmethod(count))
+    files = [
+        f"l200-p00-r000-cal-{timestamp}-tier_dsp.lh5"
+        for timestamp in ["20230101T123456Z", "20221231T000000Z", "20230115T000000Z"]
+    ]
+    # the timestamp without a calibration doesn't keep the others from being resolved
+    for _ in range(2):
+        pars_catalog.precompute_par_files(setup, files, tiers=["dsp"], key="test.filelist")
+    assert resolved == [["20230101T123456Z", "20230115T000000Z"]]
+    pars_catalog.precompute_par_files(setup, files, tiers=["dsp"])
+    assert len(resolved) == 2
+
+
+def test_file_pattern():
+    pattern = compile_pattern(get_pattern_tier_dsp(setup))
+    assert compile_pattern(get_pattern_tier_dsp(setup)) is pattern
+    keys = [
+        FileKey("l200", "p00", "r000", "cal", "20230101T123456Z"),
+        FileKey("l200", "p01", "r002", "phy", "20230202T004321Z"),
+    ]
+    files = pattern.format_many(keys)
+    assert files == [key.get_path_from_filekey(get_pattern_tier_dsp(setup))[0] for key in keys]
+    assert [FileKey(**d) for d in pattern.parse_many(files)] == keys
+    assert pattern.parse_many(["not-a-file"]) == [None]
+    assert FileKey.get_filekeys_from_pattern([*files, "bla"], get_pattern_tier_dsp(setup)) == [
+        *keys,
+        None,
+    ]
+    assert pattern.fields == ("datatype", "period", "run", "experiment", "timestamp")
+    assert expand("{a}-{b}.{ext}", a="x", b=["1", "2"], ext="json", unused=0) == [
+        "x-1.json",
+        "x-2.json",
+    ]
+    with pytest.raises(KeyError):
+        expand("{a}-{b}", a="x")
+
+    # the util package should not need snakemake, checked in a fresh interpreter as
+    # other tests or plugins may have imported it
+    subprocess.check_call(
+        [
+            sys.executable,
+            "-c",
+            "import sys, scripts.util.patterns; assert 'snakemake' not in sys.modules",
+        ],
+        cwd=Path(__file__).parent.parent,
+    )
+
+
+def test_key_table():
+    rng = np.random.default_rng(2)
+    files = [
+        f"/data/l200-p0{p}-r00{r}-{dt}-2023010{p + 1}T{h:02d}{m:02d}00Z-tier_dsp.lh5"
+        for p, r, dt, h, m in zip(
+            rng.integers(0, 3, 300),
+            rng.integers(0, 4, 300),
+            rng.choice(["cal", "phy"], 300),
+            rng.integers(0, 24, 300),
+            rng.integers(0, 60, 300),
+        )
+    ]
+    runs = {}
+    pers = {}
+    for file in files:
+        fk = ProcessingFileKey.get_filekey_from_pattern(os.path.basename(file))
+        runs.setdefault(f"{fk.experiment}-{fk.period}-{fk.run}", []).append(file)
+        pers.setdefault(f"{fk.experiment}-{fk.period}", []).append(file)
+    assert run_grouper(files) == list(runs.values())
+    assert per_grouper(files) == list(pers.values())
+
+    table = KeyTable.from_files(files)
+    keys = table.keys(FileKey)
+    assert keys == [FileKey.get_filekey_from_filename(os.path.basename(file)) for file in files]
+
+    cal = table.filter(datatype="cal", run=["r000", "r001"])
+    assert set(cal.column("datatype")) == {"cal"}
+    assert set(cal.column("run")) <= {"r000", "r001"}
+    assert len(cal) == sum(key.datatype == "cal" and key.run in ("r000", "r001") for key in keys)
+
+    sorted_table = table.sort(("period", "timestamp"))
+    assert [files[i] for i in sorted_table.rows] == [
+        files[i]
+        for i in sorted(
+            range(len(files)), key=lambda i: (keys[i].period, keys[i].get_unix_timestamp(), i)
+        )
+    ]
+    groups = table.groupby("period")
+    assert [values for values, _ in groups] == list(dict.fromkeys((key.period,) for key in keys))
+
+    validity = KeyTable.from_keys(
+        [
+            FileKey("l200", "p00", "r000", "cal", "20230101T000000Z"),
+            FileKey("l200", "p00", "r001", "cal", "20230102T120000Z"),
+        ]
+    )
+    assert list(
+        KeyTable.from_keys(
+            [
+                FileKey("l200", "p00", "r000", "phy", "20221231T000000Z"),
+                FileKey("l200", "p00", "r000", "phy", "20230102T000000Z"),
+                FileKey("l200", "p00", "r000", "phy", "20230102T120000Z"),
+            ]
+        ).join_timestamp(validity)
+    ) == [-1, 0, 1]
+
+
+def test_file_index(tmp_path):
+    with FileIndex(tmp_path / "file_index.sqlite") as index:
+        for keypart in ["-*-*-*-cal", "-*-*-*-lar", "-l200-p00-r001-cal"]:
+            assert sorted(index.get_keys(get_pattern_tier_daq(setup), keypart)) == sorted(
+                pars_key_resolve.get_keys(keypart, get_pattern_tier_daq(setup))
+            )
+        files = index.query(get_pattern_tier_daq(setup), "-l200-p00-r000_r001-cal")
+        assert [os.path.basename(path) for path, _ in files] == [
+            "l200-p00-r000-cal-20230101T123456Z.orca",
+            "l200-p00-r001-cal-20230202T004321Z.orca",
+        ]
+
+        pattern = str(
+            tmp_path
+            / "{datatype}/{period}/{run}/{experiment}-{period}-{run}-{datatype}-{timestamp}-tier_raw.lh5"
+        )
+        for run in ["r000", "r001", "r002"]:
+            for day in [1, 2]:
+                path = Path(
+                    expand(
+                        pattern,
+                        experiment="l200",
+                        period="p00",
+                        run=run,
+                        datatype="cal",
+                        timestamp=f"2023010{day}T000000Z",
+                    )[0]
+                )
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_text(run)
+        assert index.update(pattern) == 3
+        assert index.update(pattern) == 0
+        assert len(index.query(pattern, "-*-*-*-cal")) == 6
+        assert {key.run for key in index.get_keys(pattern, "-l200-p00-r000_r002-cal")} == {
+            "r000",
+            "r002",
+        }
+        assert index.get_tier(pattern) == "raw"
+        assert index.get_tier("l200-p00-r000-cal-20230101T000000Z.orca") == "daq"
+
+        # only the modified run directories are rescanned
+        (tmp_path / "cal/p00/r001/l200-p00-r001-cal-20230103T000000Z-tier_raw.lh5").touch()
+        for file in (tmp_path / "cal/p00/r002").iterdir():
+            file.unlink()
+        (tmp_path / "cal/p00/r002").rmdir()
+        assert index.update(pattern) == 1
+        keys = index.get_keys(pattern, update=False)
+        assert len(keys) == 5
+        assert {key.run for key in keys} == {"r000", "r001"}
+
+        # files rewritten in place are only seen when checking the files
+        rewritten = tmp_path / "cal/p00/r000/l200-p00-r000-cal-20230101T000000Z-tier_raw.lh5"
+        dir_mtime = (tmp_path / "cal/p00/r000").stat().st_mtime_ns
+        rewritten.write_text("rewritten")
+        os.utime(tmp_path / "cal/p00/r000", ns=(dir_mtime, dir_mtime))
+        assert index.update(pattern) == 0
+        assert index.update(pattern, check_files=True) == 1
+        assert index.update(pattern, check_files=True) == 0
+        size = index.connection.execute(
+            "SELECT size FROM files WHERE path=?", (str(rewritten),)
+        ).fetchone()[0]
+        assert size == len("rewritten")
+
+
+def test_write_par_catalog(tmp_path):
+    catalog = tmp_path / "dsp" / "validity.jsonl"
+    name_dict = {"cal": ["par_dsp"], "lar": ["par_dsp"]}
+    patterns = ["-*-*-*-cal", "-*-*-*-lar"]
+    assert pars_key_resolve.write_par_catalog(
+        patterns, str(catalog), get_pattern_tier_daq(setup), name_dict
+    )
+    entries = [json.loads(line) for line in catalog.read_text().splitlines()]
+    assert [entry["valid_from"] for entry in entries] == [
+        "20230101T123456Z",
+        "20230110T123456Z",
+        "20230202T004321Z",
+    ]
+    assert set(pars_key_resolve.get_keys_from_catalog(str(catalog))) == {
+        FileKey("l200", "p00", "r000", "cal", "20230101T123456Z"),
+        FileKey("l200", "p00", "r000", "lar", "20230110T123456Z"),
+        FileKey("l200", "p00", "r001", "cal", "20230202T004321Z"),
+    }
+
+    # unchanged content is not rewritten
+    os.utime(catalog, ns=(0, 0))
+    assert not pars_key_resolve.write_par_catalog(
+        patterns, str(catalog), get_pattern_tier_daq(setup), name_dict
+    )
+    assert catalog.stat().st_mtime_ns == 0
+
+    # keys already in the catalog are kept when their files are gone
+    key = FileKey("l200", "p01", "r000", "cal", "20230301T000000Z")
+    with open(catalog, "a") as file:
+        file.write(f"{pars_key_resolve.from_filekey(key, name_dict).get_json()}\n")
+    assert pars_key_resolve.write_par_catalog(
+        patterns, str(catalog), get_pattern_tier_daq(setup), name_dict
+    )
+    entries = [json.loads(line) for line in catalog.read_text().splitlines()]
+    assert entries[-1]["valid_from"] == "20230301T000000Z"
+    assert entries[-1]["apply"] == [
+        "cal/p01/r000/l200-p01-r000-cal-20230301T000000Z-par_dsp.json",
+        "lar/p00/r000/l200-p00-r000-lar-20230110T123456Z-par_dsp.json",
+    ]
+    assert pars_key_resolve.write_par_catalog(
+        patterns, str(catalog), get_pattern_tier_daq(setup), name_dict, overwrite=True
+    )
+    assert len(catalog.read_text().splitlines()) == 3
+
+
+def test_par_keylist_matches_list_implementation():
+    name_dict = {"cal": ["par_dsp", "par_hit"], "lar": ["par_dsp"]}
+    keys = pars_key_resolve.get_keys("-*-*-*-cal", get_pattern_tier_daq(setup))
+    keys += pars_key_resolve.get_keys("-*-*-*-lar", get_pattern_tier_daq(setup))
+    synthetic_keys = make_keys(50000, 200, run_length=1000, lar_fraction=0.002)
+    for keylist in [keys, synthetic_keys]:
+        expected = list_match_all_entries(list_generate_par_keylist(keylist), name_dict)
+        result = pars_key_resolve.match_all_entries(
+            pars_key_resolve.generate_par_keylist(keylist), name_dict
+        )
+        assert to_jsonl(result) == to_jsonl(expected)
+
+
+def test_pulser_masks(tmp_path):
+    rng = np.random.default_rng(3)
+    channels = np.array([1084803, 1084804, 1121600, 1104000])
+    masks_list = []
+    for i in range(2):
+        n_hits = rng.integers(1, 5, 1000)
+        array_id = np.concatenate([rng.choice(channels, n, replace=False) for n in n_hits])
+        array_idx = np.zeros(len(array_id), dtype=int)
+        for channel in channels:
+            array_idx[array_id == channel] = np.arange(np.sum(array_id == channel))
+        masks = get_pulser_masks(array_id, array_idx, np.cumsum(n_hits), 2)
+        # per channel selection as in pygama's get_tcm_pulser_ids
+        evt_mult = np.repeat(n_hits, n_hits)
+        for channel in channels:
+            expected = np.zeros(np.sum(array_id == channel), dtype=bool)
+            expected[array_idx[(array_id == channel) & (evt_mult > 2)]] = True
+            assert np.array_equal(masks[f"ch{channel}"], expected)
+        if i == 1:
+            # channel off in the second file
+            masks.pop("ch1104000")
+        write_pulser_masks(masks, str(tmp_path / f"pulser_{i}.bin"))
+        masks_list.append(masks)
+
+    files = [str(tmp_path / "pulser_0.bin"), str(tmp_path / "pulser_1.bin")]
+    assert np.array_equal(
+        load_pulser_mask(files, "ch1084803"),
+        np.concatenate([masks_list[0]["ch1084803"], masks_list[1]["ch1084803"]]),
+    )
+    assert np.array_equal(load_pulser_mask(files[0], 1121600), masks_list[0]["ch1121600"])
+    assert np.array_equal(load_pulser_mask(files, "ch1104000"), masks_list[0]["ch1104000"])
+    assert len(load_pulser_mask(files, "ch1000000")) == 0
+
+    # packed bits, one bit per row, readable with numpy
+    with np.load(files[0]) as data:
+        assert list(data["channels"]) == sorted(masks_list[0])
+        assert data["ch1084803"].nbytes == (len(masks_list[0]["ch1084803"]) + 7) // 8
+    old_file = tmp_path / "pulser_ids.json"
+    old_file.write_text(json.dumps({"idxs": [1], "mask": [False, True]}))
+    with pytest.raises(ValueError, match="is not a pulser mask file"):
+        load_pulser_mask(str(old_file), "ch1084803")
+    new_file = tmp_path / "pulser_new.bin"
+    with open(new_file, "wb") as f:
+        np.savez(f, version=np.array(2), channels=np.array([], dtype=str), n_rows=np.array([]))
+    with pytest.raises(ValueError, match="version 2, expected 1"):
+        load_pulser_mask(str(new_file), "ch1084803")
+
+
+def test_worker_pool(tmp_path):
+    socket_path = str(tmp_path / "pool.sock")
+    cli = Path(__file__).parent.parent / "scripts" / "worker_pool.py"
+    server_log = tmp_path / "pool.log"
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            str(cli),
+            "serve",
+            "--socket",
+            socket_path,
+            "--log",
+            str(server_log),
+            "--preload",
+            "json",
+        ]
+    )
+    try:
+        while not os.path.exists(socket_path):
+            assert server.poll() is None
+            time.sleep(0.05)
+        script = tmp_path / "job.py"
+        script.write_text(
+            "import sys\nprint(' '.join(sys.argv[1:]))\nsys.exit(int(sys.argv[1]))\n"
+        )
+        out = tmp_path / "out.txt"
+        for code in (0, 3):
+            with open(out, "w") as f:
+                assert (
+                    subprocess.call(
+                        [
+                            sys.executable,
+                            str(cli),
+                            "run",
+                            "--socket",
+                            socket_path,
+                            "--",
+                            "python3",
+                            "-B",
+                            str(script),
+                            str(code),
+                            "a",
+                        ],
+                        stdout=f,
+                        cwd=tmp_path,
+                    )
+                    == code
+                )
+            assert out.read_text() == f"{code} a\n"
+
+        # the scripts configure logging as in a new process, not with the pool's handler
+        log_script = tmp_path / "log_job.py"
+        log_script.write_text(
+            "import logging, sys\n"
+            "logging.basicConfig(level=logging.DEBUG, filename=sys.argv[1], filemode='w')\n"
+            "logging.debug('job debug')\n"
+            "logging.warning('job warning')\n"
+        )
+        job_log = tmp_path / "job.log"
+        command = [sys.executable, str(cli), "run", "--socket", socket_path, "--", "python3"]
+        assert subprocess.call([*command, str(log_script), str(job_log)], cwd=tmp_path) == 0
+        assert job_log.read_text() == "DEBUG:root:job debug\nWARNING:root:job warning\n"
+        assert "job warning" not in server_log.read_text()
+
+        assert parse_command(["python3", "-c", "print(1)"]) is None
+        assert parse_command(["lh5ls", "file.lh5"]) is None
+        stop(socket_path)
+        assert server.wait(timeout=10) == 0
+        assert not os.path.exists(socket_path)
+    finally:
+        server.kill()
+
+
+def test_jit_cache(tmp_path, monkeypatch):
+    monkeypatch.delenv("DATAFLOW_JIT_CACHE", raising=False)
+    for name in ("NUMBA_CACHE_DIR", "LGDO_CACHE", "DSPEED_CACHE"):
+        monkeypatch.delenv(name, raising=False)
+    assert setup_jit_cache() is None
+    assert os.environ["LGDO_CACHE"] == "false"
+    assert "NUMBA_CACHE_DIR" not in os.environ
+
+    cache_dir = str(tmp_path / "jit")
+    monkeypatch.setenv("DATAFLOW_JIT_CACHE", cache_dir)
+    assert setup_jit_cache() == cache_dir
+    assert os.environ["NUMBA_CACHE_DIR"] == cache_dir
+    assert os.environ["DSPEED_CACHE"] == "true"
+
+    # a job waits for a running warm-up
+    with jit_cache_lock(cache_dir, exclusive=True):
+        job = subprocess.Popen(
+            [sys.executable, "-c", "from scripts.util.jit_cache import setup_jit_cache as s; s()"],
+            cwd=Path(__file__).parent.parent,
+        )
+        time.sleep(0.5)
+        assert job.poll() is None
+    assert job.wait(timeout=10) == 0
+
+
+def test_set_threads(monkeypatch):
+    for var in (*thread_vars, "PYGAMA_PARALLEL"):
+        monkeypatch.delenv(var, raising=False)
+    assert set_threads(parallel=True) == 1
+    assert os.environ["NUMBA_NUM_THREADS"] == "1"
+    assert os.environ["PYGAMA_PARALLEL"] == "false"
+
+    monkeypatch.setenv("OMP_NUM_THREADS", "4")
+    assert set_threads() == 4
+    assert os.environ["NUMEXPR_MAX_THREADS"] == "4"
+    assert os.environ["PYGAMA_PARALLEL"] == "false"
+    assert set_threads(parallel=True) == 4
+    assert os.environ["PYGAMA_PARALLEL"] == "true"
+
+
+def test_channel_index():
+    chmap = {
+        "V01": {"system": "geds", "daq": {"rawid": 1104003}, "analysis": {"usability": "on"}},
+        "V02": {"system": "geds", "daq": {"rawid": 1104002}, "analysis": {"usability": "off"}},
+        "S01": {"system": "spms", "daq": {"rawid": 1057600}},
+        "PULS01": {"system": "puls", "daq": {"rawid": 1027201}},
+    }
+    index = ChannelIndex(chmap)
+    assert len(index) == 4
+    assert 1104002 in index
+    assert 1 not in index
+    assert index.is_in(1057600, "geds", "spms")
+    assert not index.is_in(1027201, "geds", "spms")
+    assert index.system(1) is None
+    assert list(index.rawids("geds")) == [1104002, 1104003]
+    assert list(index.rawids("puls", "geds")) == [1027201, 1104002, 1104003]
+    assert len(index.rawids("muon")) == 0
+    assert list(index.select("geds", {"analysis.usability": "on"})) == [1104003]
+    # channel lists keep the channel map order
+    assert list(index.select("geds")) == [1104003, 1104002]
+    assert len(index.select("spms", {"analysis.usability": "on"})) == 0
+    assert index.channel_names("geds") == ["ch1104003", "ch1104002"]
+    assert index.info(1104003)["analysis"]["usability"] == "on"
+
+
+class _ChannelCache:
+    def __init__(self):
+        self.n_channels = 0
+
+    def drop_tables(self):
+        self.n_channels += 1
+
+
+def _channel_main(argv, cache=None):
+    out_file = argv[argv.index("--output") + 1]
+    channel = argv[argv.index("--channel") + 1]
+    if channel == "ch1104001":
+        msg = "bad channel"
+        raise ValueError(msg)
+    with open(out_file, "w") as f:
+        json.dump({"argv": argv, "n_before": None if cache is None else cache.n_channels}, f)
+
+
+def test_channel_runs(tmp_path):
+    filelist = tmp_path / "pars.filelist"
+    filelist.write_text(
+        "\n".join(
+            f"/data/pars/l200-p03-r000-cal-20230101T000000Z-ch110400{i}-par_dsp.json"
+            for i in range(4)
+        )
+        + "\n"
+    )
+    names = tmp_path / "channels.filelist"
+    names.write_text("ch1\n\nch2\n")
+    all_channels = [f"ch110400{i}" for i in range(4)]
+    assert get_channels([str(filelist)]) == all_channels
+    assert get_channels([str(names), "ch3"]) == ["ch1", "ch2", "ch3"]
+    assert get_channels([str(filelist)], batch=1, batch_size=3) == ["ch1104003"]
+    assert get_channels([str(filelist)], batch=2, batch_size=3) == []
+
+    # a single channel runs main as is
+    out_file = tmp_path / "single.json"
+    run_channels(_channel_main, _ChannelCache, ["--channel", "ch1", "--output", str(out_file)])
+    assert json.loads(out_file.read_text()) == {
+        "argv": ["--channel", "ch1", "--output", str(out_file)],
+        "n_before": None,
+    }
+
+    for processes in (1, 2):
+        out_pattern = str(tmp_path / f"{processes}" / "{channel}.json")
+        os.makedirs(tmp_path / f"{processes}")
+        argv = ["--channel", str(filelist), "--output", out_pattern, "--processes", f"{processes}"]
+        with pytest.raises(RuntimeError, match=r"failed channels: ch1104001$"):
+            run_channels(_channel_main, _ChannelCache, argv)
+        outputs = sorted(os.listdir(tmp_path / f"{processes}"))
+        assert outputs == ["ch1104000.json", "ch1104002.json", "ch1104003.json"]
+        out = json.loads((tmp_path / f"{processes}" / "ch1104003.json").read_text())
+        assert out["argv"] == [
+            "--output",
+            out_pattern.replace("{channel}", "ch1104003"),
+            "--channel",
+            "ch1104003",
+        ]
+        # the cache is shared by the channels of a process
+        assert out["n_before"] == (3 if processes == 1 else 1)
+
+    out_pattern = str(tmp_path / "batch" / "{channel}.json")
+    os.makedirs(tmp_path / "batch")
+    argv = ["--channel", str(filelist), "--batch", "1", "--batch_size", "2", "--output"]
+    run_channels(_channel_main, _ChannelCache, [*argv, out_pattern])
+    assert sorted(os.listdir(tmp_path / "batch")) == ["ch1104002.json", "ch1104003.json"]
+
+
+def _chain_stages(tmp_path, runs, fail=None):
+    def stage(name):
+        def main(argv, cache=None):
+            runs.append(name)
+            cache.drop_tables()
+            Path(argv[0]).write_text(name)
+            if name == fail:
+                msg = f"{name} failed"
+                raise ValueError(msg)
+
+        out_file = str(tmp_path / "out" / f"{name}.json")
+        return (name, SimpleNamespace(main=main), [out_file], [out_file])
+
+    return [stage(name) for name in ("first", "second", "third")]
+
+
+def test_run_chain(tmp_path):
+    out_dir = tmp_path / "out"
+    intermediates = [str(out_dir / "first.json"), str(out_dir / "second.json")]
+    log_file = tmp_path / "log" / "chain.log"
+    cache = _ChannelCache()
+
+    runs = []
+    with pytest.raises(ValueError, match="second failed"):
+        run_chain(
+            _chain_stages(tmp_path, runs, fail="second"),
+            cache,
+            intermediates,
+            keep_intermediates=True,
+            log_file=str(log_file),
+        )
+    assert runs == ["first", "second"]
+    assert cache.n_channels == 2
+    # the outputs of the failed stage are removed, the intermediates are kept
+    assert sorted(os.listdir(out_dir)) == ["first.json"]
+    assert "first: finished" in log_file.read_text()
+    assert "second: failed" in log_file.read_text()
+
+    # existing outputs are only reused when resuming
+    runs = []
+    run_chain(_chain_stages(tmp_path, runs), cache, intermediates, resume=True)
+    assert runs == ["second", "third"]
+    assert sorted(os.listdir(out_dir)) == ["third.json"]
+    runs = []
+    run_chain(_chain_stages(tmp_path, runs), cache, intermediates, keep_intermediates=True)
+    assert runs == ["first", "second", "third"]
+
+    # without keep_intermediates a failed chain removes them
+    runs = []
+    with pytest.raises(ValueError, match="third failed"):
+        run_chain(_chain_stages(tmp_path, runs, fail="third"), cache, intermediates)
+    assert os.listdir(out_dir) == []
+
+
+def test_dsp_settings(tmp_path):
+    assert get_dsp_settings(None, "cal") == {"buffer_len": 3200, "block_width": 16}
+    assert get_dsp_settings({"phy": {"buffer_len": 800}}, "phy") == {
+        "buffer_len": 800,
+        "block_width": 16,
+    }
+
+    trials = [
+        {"buffer_len": 800, "block_width": 8, "throughput": 10.0, "peak_rss": 500},
+        {"buffer_len": 6400, "block_width": 64, "throughput": 20.0, "peak_rss": 3000},
+    ]
+    assert best_trial(trials)["buffer_len"] == 6400
+    assert best_trial(trials, max_rss=1000)["buffer_len"] == 800
+    # none fits, the one using the least memory
+    assert best_trial(trials, max_rss=100)["buffer_len"] == 800
+
+    settings_file = tmp_path / "dsp_settings.json"
+    write_dsp_settings(settings_file, "cal", trials[0], trials)
+    write_dsp_settings(settings_file, "phy", trials[1], trials)
+    settings = json.loads(settings_file.read_text())
+    assert get_dsp_settings(settings, "cal") == {"buffer_len": 800, "block_width": 8}
+    assert get_dsp_settings(settings, "phy") == {"buffer_len": 6400, "block_width": 64}
+    assert len(settings["phy"]["trials"]) == 2
+
+
+def test_stage_cache(tmp_path):
+    lgdo = pytest.importorskip("lgdo")
+    stage_cache = pytest.importorskip("scripts.util.stage_cache")
+
+    def columns(obj):
+        return {name: np.asarray(col.nda) for name, col in obj.items()}
+
+    def assert_same(obj1, obj2):
+        cols1, cols2 = columns(obj1), columns(obj2)
+        assert cols1.keys() == cols2.keys()
+        for name, col in cols1.items():
+            assert np.array_equal(col, cols2[name])
+
+    rng = np.random.default_rng(0)
+    sto = lgdo.lh5.LH5Store()
+    files = [str(tmp_path / f"dsp{i}.lh5") for i in range(2)]
+    for file in files:
+        table = lgdo.Table(
+            col_dict={name: lgdo.Array(rng.normal(size=20)) for name in ["a", "b", "c"]}
+        )
+        sto.write(table, "dsp", file, group="ch1104000", wo_mode="w")
+
+    cache = stage_cache.StageCache()
+    name = "ch1104000/dsp"
+    for kwargs in [
+        {"field_mask": ["a"]},
+        {"field_mask": ["a", "b"], "idx": np.array([1, 5, 30])},
+        {"field_mask": ["b"], "n_rows": 7},
+        {},
+        {"field_mask": ["c"], "idx": np.flatnonzero(np.arange(40) % 3 == 0)},
+    ]:
+        obj, n_rows = cache.read(name, files, **kwargs)
+        expected, expected_rows = sto.read(name, files, **kwargs)
+        assert n_rows == expected_rows
+        assert_same(obj, expected)
+        # returned objects are copies
+        obj.add_column("d", lgdo.Array(np.zeros(n_rows)))
+    assert "d" not in cache.read(name, files)[0]
+
+    extra = lgdo.Table(col_dict={name: lgdo.Array(np.ones(3)) for name in ["a", "b", "c"]})
+    cache.append(name, files, extra)
+    obj, n_rows = cache.read(name, files)
+    assert n_rows == 43
+    assert_same(obj, stage_cache.concat_rows([sto.read(name, files)[0], extra]))
+    assert_same(stage_cache.select_rows(obj, slice(40, None)), extra)
+
+
+def test_stage_cache_load_data(tmp_path):
+    lgdo = pytest.importorskip("lgdo")
+    pd = pytest.importorskip("pandas")
+    pargen_utils = pytest.importorskip("pygama.pargen.utils")
+    stage_cache = pytest.importorskip("scripts.util.stage_cache")
+
+    rng = np.random.default_rng(1)
+    sto = lgdo.lh5.LH5Store()
+    files = [str(tmp_path / f"dsp{i}.lh5") for i in range(2)]
+    fields = ["trapTmax", "cuspEmax", "timestamp", "A_max", "tp_0_est", "dt_eff"]
+    for file in files:
+        table = lgdo.Table(
+            col_dict={name: lgdo.Array(rng.uniform(0, 1000, 50)) for name in [*fields, "bl_mean"]}
+        )
+        sto.write(table, "dsp", file, group="ch1104000", wo_mode="w")
+
+    cal_dict = {
+        "cuspEmax_ctc": {"expression": "cuspEmax*(1+a*dt_eff)", "parameters": {"a": 1e-4}},
+        "cuspEmax_ctc_cal": {"expression": "cuspEmax_ctc*b", "parameters": {"b": 2}},
+        "AoE": {"expression": "A_max/cuspEmax", "parameters": {}},
+    }
+    stages = [
+        ({}, ["trapTmax", "timestamp"], {"cal_energy_param": "trapTmax", "threshold": 100}),
+        (cal_dict, ["cuspEmax_ctc_cal", "AoE", "timestamp"], {"threshold": 500}),
+        (cal_dict, ["cuspEmax_ctc_cal", "tp_0_est"], {}),
+    ]
+
+    cache = stage_cache.StageCache()
+    read_fields = []
+    read = cache.sto.read
+
+    def count(name, files, field_mask=None, **kwargs):
+        read_fields.extend(field_mask)
+        return read(name, files, field_mask=field_mask, **kwargs)
+
+    cache.sto.read = count
+    for stage_dict, params, kwargs in stages:
+        df, mask = cache.load_data(
+            files, "ch1104000/dsp", stage_dict, params, return_selection_mask=True, **kwargs
+        )
+        expected, expected_mask = pargen_utils.load_data(
+            files, "ch1104000/dsp", stage_dict, params, return_selection_mask=True, **kwargs
+        )
+        pd.testing.assert_frame_equal(df, expected)
+        assert np.array_equal(np.asarray(mask), np.asarray(expected_mask))
+    # every field is read once over the stages, the unused ones not at all
+    assert sorted(read_fields) == sorted(fields)
+
+
+def test_metadata_cache(tmp_path, monkeypatch):
+    metadata_cache = pytest.importorskip("scripts.util.metadata_cache")
+    monkeypatch.setattr(metadata_cache, "_fingerprints", {})
+
+    configs = tmp_path / "configs"
+    (configs / "tier").mkdir(parents=True)
+    (configs / "tier" / "dsp.json").write_text('{"a": 1}')
+    fingerprint = metadata_cache.tree_fingerprint(configs)
+    assert metadata_cache.tree_fingerprint(str(configs)) == fingerprint
+    (configs / "tier" / "hit.json").write_text('{"b": 2}')
+    # the tree is only stat-ed once per process
+    assert metadata_cache.tree_fingerprint(configs) == fingerprint
+    metadata_cache._fingerprints.clear()
+    assert metadata_cache.tree_fingerprint(configs) != fingerprint
+
+    resolved = []
+
+    def resolve(timestamp, datatype, *_):
+        resolved.append((timestamp, datatype))
+        return {"config": {"datatype": datatype}, "channelmap": None, "files": {}}
+
+    monkeypatch.setattr(metadata_cache.MetadataSnapshot, "_resolve", staticmethod(resolve))
+    cache_dir = tmp_path / "cache"
+    for datatype in ["cal", "cal", "phy"]:
+        snapshot = metadata_cache.MetadataSnapshot.load(
+            "20230101T000000Z", datatype, configs=configs, cache_dir=cache_dir
+        )
+        assert snapshot.config.datatype == datatype
+    assert resolved == [("20230101T000000Z", "cal"), ("20230101T000000Z", "phy")]
+    assert len(os.listdir(cache_dir)) == 2
+
+    # a change of the configs resolves the snapshot again
+    (configs / "tier" / "dsp.json").write_text('{"a": 10}')
+    metadata_cache._fingerprints.clear()
+    metadata_cache.MetadataSnapshot.load(
+        "20230101T000000Z", "cal", configs=configs, cache_dir=cache_dir
+    )
+    assert len(resolved) == 3
+
+    # writing a snapshot removes the ones not loaded for max_age
+    old = time.time() - metadata_cache.max_age - 10
+    for file in os.listdir(cache_dir):
+        os.utime(cache_dir / file, (old, old))
+    metadata_cache.MetadataSnapshot.load(
+        "20230101T000000Z", "cal", configs=configs, cache_dir=cache_dir
+    )
+    assert len(os.listdir(cache_dir)) == 3
+    metadata_cache.MetadataSnapshot.load(
+        "20230101T000000Z", "lar", configs=configs, cache_dir=cache_dir
+    )
+    assert len(os.listdir(cache_dir)) == 2
+
+    monkeypatch.setattr(
+        metadata_cache.MetadataSnapshot,
+        "_resolve",
+        staticmethod(lambda *_: {"config": {"date": time}, "channelmap": None, "files": {}}),
+    )
+    with pytest.raises(TypeError, match="not JSON serializable"):
+        metadata_cache.MetadataSnapshot.load(
+            "20230101T000000Z", "ana", configs=configs, cache_dir=cache_dir
+        )
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_blinding(tmp_path):
+    lgdo = pytest.importorskip("lgdo")
+    blinding = pytest.importorskip("scripts.util.blinding")
+
+    rng = np.random.default_rng(0)
+    sto = lgdo.lh5.LH5Store()
+    raw_file = str(tmp_path / "raw.lh5")
+    daqenergy = rng.integers(0, 100, 50)
+    for rawid in [1104000, 1104001, 1057600, 1052803]:
+        table = lgdo.Table(
+            col_dict={
+                "daqenergy": lgdo.Array(daqenergy if rawid == 1104000 else daqenergy[::-1]),
+                "waveform": lgdo.WaveformTable(
+                    t0=np.zeros(50),
+                    dt=16.0,
+                    values=lgdo.ArrayOfEqualSizedArrays(
+                        nda=rng.integers(0, 2**14, (50, 10), dtype="uint16"),
+                        attrs={"compression": lgdo.compression.ULEB128ZigZagDiff()},
+                    ),
+                ),
+            }
+        )
+        sto.write(table, "raw", raw_file, group=f"ch{rawid}", wo_mode="w")
+
+    chmap = {
+        "V00": {"system": "geds", "daq": {"rawid": 1104000}, "analysis": {"is_blinded": True}},
+        "V01": {"system": "geds", "daq": {"rawid": 1104001}, "analysis": {"is_blinded": False}},
+        "S00": {"system": "spms", "daq": {"rawid": 1057600}},
+        "MUON00": {"system": "muon", "daq": {"rawid": 1052803}},
+    }
+    curves = {
+        f"ch{rawid}": {"expression": "a*daqenergy", "parameters": {"a": 2}}
+        for rawid in [1104000, 1104001]
+    }
+
+    def n_rows(file, channel):
+        return sto.read_n_rows(f"{channel}/raw", file)
+
+    out_file = str(tmp_path / "blind.lh5")
+    n_blinded = blinding.blind_raw_file(
+        raw_file, out_file, ChannelIndex(chmap), curves, 100, 20, {}, chunk_rows=7
+    )
+    # only the first Ge channel is blinded
+    blinded = np.abs(2 * daqenergy - 100) <= 20
+    assert n_blinded == np.count_nonzero(blinded)
+    assert n_blinded > 0
+    for channel in ["ch1104000", "ch1104001", "ch1057600"]:
+        assert n_rows(out_file, channel) == 50 - n_blinded
+    assert n_rows(out_file, "ch1052803") == 50
+    tb, _ = sto.read("ch1057600/raw", out_file)
+    assert np.array_equal(tb["daqenergy"].nda, daqenergy[::-1][~blinded])
+
+    # all events blinded, the tables are written empty
+    out_file = str(tmp_path / "blind_all.lh5")
+    n_blinded = blinding.blind_raw_file(
+        raw_file, out_file, ChannelIndex(chmap), curves, 100, 200, {}
+    )
+    assert n_blinded == 50
+    for channel in ["ch1104000", "ch1104001", "ch1057600"]:
+        assert n_rows(out_file, channel) == 0
+    assert n_rows(out_file, "ch1052803") == 50
+
+    # the shards of the parallel writer hold the same tables, also when empty
+    channels = ["ch1104000", "ch1104001", "ch1057600"]
+    for keep in [np.flatnonzero(~blinded), np.array([], dtype=int)]:
+        serial_file = str(tmp_path / f"serial{len(keep)}.lh5")
+        blinding.copy_channels(raw_file, serial_file, channels, keep, {}, chunk_rows=7)
+        sharded_file = str(tmp_path / f"sharded{len(keep)}.lh5")
+        blinding.copy_channels(
+            raw_file, sharded_file, channels, keep, {}, chunk_rows=7, n_processes=2
+        )
+        for channel in channels:
+            assert n_rows(sharded_file, channel) == len(keep)
+            tb1, _ = sto.read(f"{channel}/raw", serial_file)
+            tb2, _ = sto.read(f"{channel}/raw", sharded_file)
+            assert np.array_equal(tb1["daqenergy"].nda, tb2["daqenergy"].nda)
+            assert np.array_equal(tb1["waveform"]["values"].nda, tb2["waveform"]["values"].nda)
+            tb, _ = sto.read(f"{channel}/raw", raw_file)
+            assert np.array_equal(
+                tb1["waveform"]["values"].nda, tb["waveform"]["values"].nda[keep]
+            )
+
+    # only the kept rows are loaded, as slices of at most a chunk
+    class Store(lgdo.lh5.LH5Store):
+        def read(self, name, lh5_file, **kwargs):
+            reads.append(kwargs)
+            return super().read(name, lh5_file, **kwargs)
+
+    reads = []
+    keep = np.flatnonzero(~blinded)
+    out_file = str(tmp_path / "rows.lh5")
+    blinding.copy_rows(raw_file, out_file, "ch1104000", keep, {}, chunk_rows=7, store=Store())
+    assert all(read.get("idx") is None and read["n_rows"] <= 7 for read in reads)
+    loaded = [np.arange(read["start_row"], read["start_row"] + read["n_rows"]) for read in reads]
+    assert np.array_equal(np.concatenate(loaded), keep)
+    assert blinding.row_runs(np.array([1, 2, 3, 5, 8, 9])) == [(1, 4), (5, 6), (8, 10)]
+
+    chmap["V00"]["analysis"]["is_blinded"] = False
+    with pytest.raises(RuntimeError, match="can be blinded"):
+        blinding.blind_raw_file(
+            raw_file, str(tmp_path / "none.lh5"), ChannelIndex(chmap), curves, 100, 20, {}
+        )
+
+
+def test_fcid_tcms(tmp_path):
+    lgdo = pytest.importorskip("lgdo")
+    pygama_tcm = pytest.importorskip("pygama.evt.build_tcm")
+    tcm = pytest.importorskip("scripts.util.tcm")
+
+    rng = np.random.default_rng(0)
+    sto = lgdo.lh5.LH5Store()
+    raw_file = str(tmp_path / "raw.lh5")
+    events = np.sort(rng.uniform(0, 10, 30))
+    for rawid in [1104000, 1104001, 2104000, 2104001, 2104002]:
+        timestamp = np.sort(rng.choice(events, 20, replace=False))
+        table = lgdo.Table(col_dict={"timestamp": lgdo.Array(timestamp)})
+        sto.write(table, "raw", raw_file, group=f"ch{rawid}", wo_mode="w")
+
+    out_file = str(tmp_path / "tcm.lh5")
+    stats = tcm.build_fcid_tcms(raw_file, out_file, "timestamp")
+    ref_file = str(tmp_path / "tcm_ref.lh5")
+    for fcid, tables in tcm.fcid_channels(raw_file).items():
+        pygama_tcm.build_tcm(
+            [(raw_file, tables)],
+            coin_col="timestamp",
+            out_file=ref_file,
+            out_name=f"hardware_tcm_{fcid}",
+            wo_mode="o",
+        )
+        assert stats[fcid]["n_channels"] == len(tables)
+
+    names = lgdo.lh5.ls(ref_file)
+    assert len(names) == 2
+    assert sorted(lgdo.lh5.ls(out_file)) == sorted(names)
+    for name in names:
+        tb, _ = sto.read(name, out_file)
+        ref, _ = sto.read(name, ref_file)
+        assert tb.attrs == ref.attrs
+        assert sorted(tb.keys()) == sorted(ref.keys())
+        for col in ref:
+            assert np.array_equal(tb[col].nda, ref[col].nda)